@@ -35,9 +35,14 @@ Usage:
 Go to Export and type a name for the file.
 """
 
-from Blender.BGL import *
-import Blender
-from Blender import Texture,Image,Material,Object, Draw, BGL, Window , sys
+from sys import argv
+try:
+    from Blender.BGL import *
+    import Blender
+    from Blender import Texture,Image,Material,Object, Draw, BGL, Window , sys
+except ImportError :
+    #Imported outside of Blender (benchmarks, tools) : only the encoder can be used
+    Blender = None
 import random
 from random import random
 import math
@@ -45,6 +50,28 @@ from math import *
 
 from Numeric import *
 from struct import *
+from cStringIO import StringIO
+import os
+import shutil
+import filecmp
+import hashlib
+import time
+from heapq import heappush , heappop
+try:
+    import json
+except ImportError :
+    #Python < 2.6 (Blender 2.4x) : the reports are written by json_string
+    json = None
+try:
+    import nds_archive
+except ImportError :
+    #nds_archive.py is only needed to pack the exported files into one archive
+    nds_archive = None
+try:
+    import nds_lz
+except ImportError :
+    #nds_lz.py is only needed to compress the exported files
+    nds_lz = None
 
 # Define libnds binary functions and macros
 
@@ -72,7 +99,25 @@ def TEXTURE_PACK(u,v) :
 def RGB15(r,g,b) :
     return array(r | (g << 5) | (b <<10 ) , Int32)
 
+# Vectorized counterparts of the conversions above : they work on whole Numeric
+# arrays at once and widen their result to Int32 so that the *_PACK macros can
+# shift them without overflowing.
+
+def floattov16_array(n) :
+    return array(n * (1<<12) , Float32).astype(Int16).astype(Int32)
+
+def floattov10_array(n) :
+    return where( greater(n , .998) , 0x1FF , array(n * (1<<9) , Float32).astype(Int16) ).astype(Int32)
+
+def floattot16_array(n) :
+    return array( n * (1 << 4) , Float32).astype(Int16).astype(Int32)
+
 FIFO_VERTEX16  = 0x23
+FIFO_VERTEX10  = 0x24
+FIFO_VERTEX_XY = 0x25
+FIFO_VERTEX_XZ = 0x26
+FIFO_VERTEX_YZ = 0x27
+FIFO_DIFF      = 0x28
 FIFO_NORMAL    = 0x21
 FIFO_TEX_COORD = 0x22
 FIFO_COLOR     = 0x20
@@ -89,31 +134,97 @@ GL_GLBEGIN_ENUM = {
     'GL_QUAD'           : 1
 }
 
+# DS texture formats (TEXIMAGE_PARAM bits 26-28), 'PCX' keeps the PCX file export
+TEXTURE_FORMAT_ENUM = {
+    'PCX'           : 0 ,
+    'GL_RGB32_A3'   : 1 ,
+    'GL_RGB4'       : 2 ,
+    'GL_RGB16'      : 3 ,
+    'GL_RGB256'     : 4 ,
+    'GL_COMPRESSED' : 5 ,
+    'GL_RGB8_A5'    : 6 ,
+    'GL_RGBA'       : 7
+}
+
 EXPORT_OPTIONS = {
     'FORMAT_TEXT'   : 1,
     'FORMAT_BINARY' : 0,
+    'FORMAT_ASM'    : 2,
+    'FORMAT_HEX'    : 3,
+    'FORMAT_HEX_COMMENTS' : 4,
     'TEXCOORDS'     : 1,
     'NO_TEXCOORDS'  : 0,
     'COLORS'        : 1,
     'NO_COLORS'     : 0,
     'NORMALS'       : 1,
-    'NO_NORMALS'    : 0
+    'NO_NORMALS'    : 0,
+    'ELIDE_STATE'   : 1,
+    'NO_ELIDE_STATE': 0,
+    'STRIPS'        : 1,
+    'NO_STRIPS'     : 0,
+    'VERTEX_SMALLEST' : 1,
+    'VERTEX16'      : 0,
+    'REPORT'        : 1,
+    'NO_REPORT'     : 0,
+    'STREAM'        : 1,
+    'NO_STREAM'     : 0,
+    'SCHEDULE'      : 1,
+    'NO_SCHEDULE'   : 0,
+    'FIT_RANGE'     : 1,
+    'NO_FIT_RANGE'  : 0,
+    'ANIM_NONE'     : 0,
+    'ANIM_DELTAS'   : 1,
+    'ANIM_LISTS'    : 2,
+    'BAKE_LIGHTS'   : 1,
+    'NO_BAKE_LIGHTS': 0,
+    'REORDER_FACES' : 1,
+    'NO_REORDER_FACES' : 0,
+    'MATERIAL_LISTS': 1,
+    'NO_MATERIAL_LISTS' : 0,
+    'LZ_NONE'       : 0,
+    'LZ_10'         : 1,
+    'LZ_11'         : 2
 }
 
 # a _mesh_option represents export options in the gui
 class _mesh_options (object) :
-    __slots__ = 'format' , 'uv_export' ,'texfile_export' , 'normals_export' , 'color_export' , 'mesh_data' , 'mesh_name', 'texture_data' , 'texture_list' , 'texture_w' , 'texture_h', 'dir_path'
+    __slots__ = 'format' , 'uv_export' ,'texfile_export' , 'normals_export' , 'color_export' , 'mesh_data' , 'mesh_name', 'texture_data' , 'texture_list' , 'texture_w' , 'texture_h', 'dir_path' , 'state_elision' , 'strip_export' , 'vertex_packing' , 'vertex_tolerance' , 'texture_format' , 'export_report' , 'stream_export' , 'pack_schedule' , 'chunk_faces' , 'range_fit' , 'anim_export' , 'anim_start' , 'anim_end' , 'mesh_object' , 'lod_targets' , 'light_bake' , 'bake_lights' , 'bake_ambient' , 'bake_diffuse' , 'face_reorder' , 'material_lists' , 'material_groups' , 'material_images' , 'lz_compression'
 
-    def __init__(self,mesh_data,dir_path) :
-        self.format         = EXPORT_OPTIONS['FORMAT_BINARY']   #Which format for the export? FORMAT_BINARY->Binary, FORMAT_TEXT->C-Style
+    def __init__(self,mesh_data,dir_path,mesh_object=None) :
+        self.format         = EXPORT_OPTIONS['FORMAT_BINARY']   #Which format for the export? FORMAT_BINARY->Binary, FORMAT_TEXT->C-Style, FORMAT_ASM->GNU as, FORMAT_HEX->C-Style hex words (FORMAT_HEX_COMMENTS->with the command names)
         self.uv_export      = EXPORT_OPTIONS['NO_TEXCOORDS']    #Do we export uv coordinates? NO_TEXCOORDS->No, TEXCOORDS->Yes
         self.normals_export = EXPORT_OPTIONS['NORMALS']         #Do we export normals coordinates ? NO_NORMALS->No, NORMALS->Yes
         self.color_export   = EXPORT_OPTIONS['NO_COLORS']          #Do we export color attributes ? COLORS->No, NO_COLORS->Yes
+        self.state_elision  = EXPORT_OPTIONS['NO_ELIDE_STATE']  #Do we skip attributes equal to the previous ones? NO_ELIDE_STATE->No, ELIDE_STATE->Yes
+        self.strip_export   = EXPORT_OPTIONS['NO_STRIPS']       #Do we join faces into strips? NO_STRIPS->No, STRIPS->Yes
+        self.vertex_packing = EXPORT_OPTIONS['VERTEX16']        #Which vertex commands? VERTEX16->FIFO_VERTEX16 only, VERTEX_SMALLEST->the cheapest one
+        self.vertex_tolerance = 0.0                             #Error allowed on each coordinate to use FIFO_VERTEX10 (0.0 -> only if exact)
+        self.export_report  = EXPORT_OPTIONS['NO_REPORT']       #Do we write the timings and counters of the export? NO_REPORT->No, REPORT->Yes
+        self.stream_export  = EXPORT_OPTIONS['NO_STREAM']       #Do we write the faces as they are read, in bounded memory? NO_STREAM->No, STREAM->Yes
+        self.pack_schedule  = EXPORT_OPTIONS['NO_SCHEDULE']     #Do we drop the commands the GPU does not need? NO_SCHEDULE->No, SCHEDULE->Yes
+        self.chunk_faces    = 0                                 #Faces per spatial chunk with its own CallList and BOX_TEST bounds (0 -> a single CallList)
+        self.range_fit      = EXPORT_OPTIONS['NO_FIT_RANGE']    #Do we scale the mesh into the 4.12 range and export the matrix giving it back? NO_FIT_RANGE->No, FIT_RANGE->Yes
+        self.anim_export    = EXPORT_OPTIONS['ANIM_NONE']       #Do we export the frames anim_start..anim_end? ANIM_NONE->No, ANIM_DELTAS->First frame CallList and vertex deltas, ANIM_LISTS->One CallList per frame
+        self.anim_start     = 1
+        self.anim_end       = 1
+        self.lod_targets    = ""                                #Polygon counts, or errors after an e, of the levels of detail : "500,e0.05" ("" -> no levels of detail)
+        self.light_bake     = EXPORT_OPTIONS['NO_BAKE_LIGHTS']  #Do we send the lighting computed here as colors, instead of the normals? NO_BAKE_LIGHTS->No, BAKE_LIGHTS->Yes
+        self.bake_lights    = [ ( (0.0 , 0.0 , -1.0) , (1.0 , 1.0 , 1.0) ) ] #(direction in mesh coordinates , color) of each directional light, replaced by the Sun lamps of the scene
+        self.bake_ambient   = (0.2 , 0.2 , 0.2)                 #Ambient light, replaced by the one of the world
+        self.bake_diffuse   = []                                #Diffuse color of each material of the mesh, white for the others
+        self.face_reorder   = EXPORT_OPTIONS['NO_REORDER_FACES'] #Do we order the faces so that consecutive corners share their attributes? NO_REORDER_FACES->No, REORDER_FACES->Yes
+        self.material_lists = EXPORT_OPTIONS['NO_MATERIAL_LISTS'] #Do we export one CallList per material and image? NO_MATERIAL_LISTS->No, MATERIAL_LISTS->Yes
+        self.material_groups = []                               #(material index , image name , texture_w , texture_h) of each CallList, in the order they are drawn
+        self.material_images = None                             #The Blender Images of the groups by name (None -> not listed yet)
+        self.lz_compression = EXPORT_OPTIONS['LZ_NONE']         #Do we compress the binary files for the BIOS? LZ_NONE->No, LZ_10->LZ77 (swiDecompressLZSSWram/Vram), LZ_11->Extended LZ77
+
+        self.mesh_object = mesh_object #The Blender Object deformed by the animation
 
         self.mesh_data = mesh_data #The Blender Mesh data
         self.mesh_name = mesh_data.name #The Blender Mesh name
         self.texture_w = 0
         self.texture_h = 0
+        self.texture_format = 'PCX' #Which texture file? PCX->PCX image, else a TEXTURE_FORMAT_ENUM DS texture format
         self.list_textures() #Retrieve all texture bound to the Blender mesh
         
         if (self.mesh_data.faceUV ): self.uv_export = EXPORT_OPTIONS['TEXCOORDS']
@@ -149,242 +260,1160 @@ class _mesh_options (object) :
         if (img_found == 1):
             image = self.texture_list[0].tex.getImage()
             self.texture_data.append(image)
+            self.texture_w , self.texture_h = texture_size(image)
+        else :
+            print "!!!Warning : Cannot find any textures bound to the mesh!!!"
+            print "!!!          TEXTURE_PACKs won't be exported           !!!"
 
-            w = image.getSize()[0]
-            h = image.getSize()[1]
-            ratio = float(w)/float(h)
-            print "Texture %s %dx%d ratio=%f" % (image.getName(),w,h,ratio)
+    def get_material_images(self):
+        """The first Image of the textures of each material of the mesh, None for the materials without any"""
+        images = []
+        for material in self.mesh_data.materials :
+            image = None
+            if (material != None) :
+                for t in material.getTextures() :
+                    if (t != None and t.tex.getType() == 'Image' and t.tex.getImage() != None) :
+                        image = t.tex.getImage()
+                        break
+            images.append(image)
+        return ( images )
+
+    def get_face_image(self,face,material_images):
+        """Image of face : its UV image, else the image of its material"""
+        if (self.mesh_data.faceUV and face.image != None) : return ( face.image )
+        if (face.mat < len(material_images)) : return ( material_images[face.mat] )
+        return ( None )
+
+    def get_face_key(self,face,material_images):
+        """(material index , image name) of the CallList of face"""
+        image = self.get_face_image(face , material_images)
+        if (image == None) : return ( ( face.mat , None ) )
+        return ( ( face.mat , image.getName() ) )
+
+    def list_materials(self):
+        """Group the faces by material and image into material_groups, in the order needing the fewest texture then material switches"""
+        if (self.material_images != None) : return
+        material_images = self.get_material_images()
+        self.material_images = {}
+        keys = {}
+        for face in self.mesh_data.faces :
+            if (len(face) not in (3 , 4)) : continue
+            key = self.get_face_key(face , material_images)
+            if (keys.has_key(key)) : continue
+            keys[key] = 1
+            if (key[1] != None) : self.material_images[key[1]] = self.get_face_image(face , material_images)
+
+        sizes = { None : ( self.texture_w , self.texture_h ) }
+        for name , image in self.material_images.items() :
+            sizes[name] = texture_size(image)
+        self.material_groups = []
+        for material , name in order_material_groups( keys.keys() ) :
+            self.material_groups.append( (material , name) + sizes[name] )
+        names = [ g[1] for g in self.material_groups ]
+        materials = [ g[0] for g in self.material_groups ]
+        print "Material lists : %d CallLists , %d textures bound , %d material switches" % (len(names) , count_switches(names) , count_switches(materials))
+
+    def get_texture_names(self):
+        """Names of the images of the material groups, in the order they are first drawn : the texture numbers"""
+        names = []
+        for material , name , w , h in self.material_groups :
+            if (name != None and name not in names) : names.append(name)
+        return ( names )
+
+    def get_textures(self):
+        """(Blender Image , texture_w , texture_h) of every texture file to write"""
+        if (not self.material_lists) : return ( [ ( self.texture_data[0] , self.texture_w , self.texture_h ) ] )
+        self.list_materials()
+        textures = []
+        for name in self.get_texture_names() :
+            for material , group_name , w , h in self.material_groups :
+                if (group_name == name) : break
+            textures.append( ( self.material_images[name] , w , h ) )
+        return ( textures )
+
+    def list_lights(self,scene):
+        """Take the Sun lamps of scene, the ambient light of its world and the diffuse colors of the materials for the lighting bake"""
+        #normals are in mesh coordinates : bring the light directions there
+        to_mesh = self.mesh_object.matrixWorld.rotationPart()
+        to_mesh.invert()
+        lights = []
+        for lamp_obj in scene.objects :
+            if (lamp_obj.getType() != "Lamp") : continue
+            lamp = lamp_obj.getData()
+            if (lamp.type != Blender.Lamp.Types['Sun']) : continue
+            #a sun lights along its -Z axis
+            z = lamp_obj.matrixWorld[2]
+            direction = Blender.Mathutils.Vector(-z[0] , -z[1] , -z[2]) * to_mesh
+            direction.normalize()
+            lights.append( ( tuple(direction) , tuple([ c * lamp.energy for c in lamp.col ]) ) )
+        if (len(lights) > 0) : self.bake_lights = lights
+        world = scene.world
+        if (world != None) : self.bake_ambient = tuple(world.getAmb())
+        self.bake_diffuse = []
+        for material in self.mesh_data.materials :
+            if (material == None) : self.bake_diffuse.append( (1.0 , 1.0 , 1.0) )
+            else : self.bake_diffuse.append( tuple([ c * material.ref for c in material.rgbCol ]) )
+        print "Baked lighting : %d lights , ambient %s , diffuse %s" % (len(self.bake_lights) , repr(self.bake_ambient) , repr(self.bake_diffuse))
+
+    def get_diffuse(self,material):
+        """Diffuse color of the material number material of the mesh, for the lighting bake"""
+        if (material < len(self.bake_diffuse)) : return ( self.bake_diffuse[material] )
+        return ( (1.0 , 1.0 , 1.0) )
+
+    def get_lighting(self):
+        """(lights , ambient) to bake into the colors, None without lighting bake"""
+        if (not self.light_bake) : return ( None )
+        return ( ( self.bake_lights , self.bake_ambient ) )
+
+    def get_fit_limit(self):
+        """Largest 4.12 coordinate of range fitting : the whole range, or half of it when the CallLists are
+        indexed, so that their BOX_TEST sizes (16 bits too) with the FIFO_VERTEX10 margin fit"""
+        if (self.chunk_faces or self.lod_targets or self.material_lists or self.anim_export == EXPORT_OPTIONS['ANIM_LISTS']) :
+            return ( 0x3FFF - int(self.vertex_tolerance * (1<<12)) )
+        return ( 0x7FFF )
+
+    def get_texture_filename(self,image=None):
+        """Path of the image file of the texture (or of image), unpacked from the .blend if needed"""
+        if (image == None) : image = self.texture_data[0]
+        print image.filename
+        print Blender.sys.expandpath(image.filename)
+        if (image.packed ) : image.unpack(Blender.UnpackModes.USE_LOCAL)
+        return ( Blender.sys.expandpath(image.getFilename()) )
+
+    def get_export_flags(self):
+        """Every option which changes the exported files, as (name , value) pairs"""
+        flags = []
+        for name in _mesh_options.__slots__ :
+            if ( name not in ('mesh_data' , 'mesh_object' , 'texture_data' , 'texture_list' , 'material_images' , 'dir_path' , 'texfile_export' , 'export_report') ) :
+                flags.append( (name , getattr(self , name)) )
+        return ( flags )
+
+    def copy(self):
+        options = object.__new__(_mesh_options)
+        for name in _mesh_options.__slots__ :
+            setattr(options , name , getattr(self , name))
+        return ( options )
+
+    def get_snapshot(self):
+        """Copy of these options without any Blender data, which can be sent to another process"""
+        options = self.copy()
+        options.mesh_data = None
+        options.mesh_object = None
+        options.texture_data = []
+        options.texture_list = []
+        options.material_images = {}
+        options.texfile_export = 0
+        return ( options )
+
+    def copy_export_flags(self,source):
+        """Use the file format and optimizations chosen for another mesh"""
+        for name in ('format' , 'normals_export' , 'state_elision' , 'strip_export' , 'vertex_packing' , 'vertex_tolerance' , 'texture_format' , 'export_report' , 'stream_export' , 'pack_schedule' , 'chunk_faces' , 'range_fit' , 'anim_export' , 'anim_start' , 'anim_end' , 'lod_targets' , 'light_bake' , 'face_reorder' , 'material_lists' , 'lz_compression') :
+            setattr(self , name , getattr(source , name))
+
+    def get_texture_jobs(self) :
+        """(image file , texture_w , texture_h , texture_format , paths , lz_compression) of every texture to write :
+        everything convert_texture needs, read from Blender"""
+        jobs = []
+        textures = self.get_textures()
+        for i in range( len(textures) ) :
+            image , w , h = textures[i]
+            number = None
+            if (self.material_lists) : number = i
+            jobs.append( ( self.get_texture_filename(image) , w , h , self.texture_format , self.get_texture_paths(number) , self.lz_compression ) )
+        return ( jobs )
 
-            if (w > 128) : w = 128
-            if (w < 8) : w = 8
+    def save_tex(self) :
+        try:
+            import PIL.Image
+        except ImportError :
+            print "Python Imaging Library not installed"
+        else :
+            for job in self.get_texture_jobs() :
+                convert_texture(job)
 
-            if (h > 128) : h = 128
-            if (h < 8) : h = 8
+    def compress_files(self,paths) :
+        """Compress the written files paths into path.lz when LZ compression is chosen"""
+        compress_files(paths , self.lz_compression)
 
-            if (ratio < 1.0) :
-                w = h * (1/round(1/ratio))
-                print "ratio <  1 : Texture %s %dx%d" % (image.getName(),w,h)
-            else :
-                h = w / round(ratio)
-                print "ratio >= 1 :Texture %s %dx%d" % (image.getName(),w,h)
+    def get_lz_paths(self,paths) :
+        """Names of the written files paths once compressed"""
+        return ( get_lz_paths(paths , self.lz_compression) )
 
-            self.texture_w = int(w)
-            self.texture_h = int(h)
-        else :
-            print "!!!Warning : Cannot find any textures bound to the mesh!!!"
-            print "!!!          TEXTURE_PACKs won't be exported           !!!"
+    def get_emitter(self):
+        return ( EMITTERS[self.format] )
 
-    def get_final_path_mesh(self):
-        return ( Blender.sys.join(self.dir_path,self.mesh_name + (".h" if (self.format) else ".bin")) )
+    def get_path_mesh(self):
+        """File the CallList is written into, before its compression"""
+        return ( Blender.sys.join(self.dir_path,self.mesh_name + self.get_emitter().extension) )
 
-    def get_final_path_tex(self):
-        return ( Blender.sys.join(self.dir_path,self.mesh_name + ".pcx") )
+    def get_final_path_mesh(self):
+        #the text formats are compiled into the game : only the binary CallList is compressed
+        if (self.format != EXPORT_OPTIONS['FORMAT_BINARY']) : return ( self.get_path_mesh() )
+        return ( self.get_lz_paths([ self.get_path_mesh() ])[0] )
+
+    def get_texture_name(self,number=None):
+        """Base name of the files of the texture number of the material lists, or of the texture of the mesh"""
+        if (number == None) : return ( self.mesh_name )
+        return ( "%s_%d" % (self.mesh_name , number) )
+
+    def get_final_path_tex(self,number=None):
+        return ( Blender.sys.join(self.dir_path,self.get_texture_name(number) + (".pcx" if (self.texture_format == 'PCX') else ".tex")) )
+
+    def get_texture_paths(self,number=None):
+        """Every file written for one texture : texels, then palette and palette indexes when the format has them"""
+        paths = [ self.get_final_path_tex(number) ]
+        if (self.texture_format not in ('PCX' , 'GL_RGBA')) : paths.append( Blender.sys.join(self.dir_path,self.get_texture_name(number) + ".pal") )
+        if (self.texture_format == 'GL_COMPRESSED') : paths.append( Blender.sys.join(self.dir_path,self.get_texture_name(number) + ".pidx") )
+        return ( paths )
+
+    def get_final_paths_tex(self):
+        """Every file written for the textures of the mesh, once compressed"""
+        if (not self.material_lists) : return ( self.get_lz_paths(self.get_texture_paths()) )
+        self.list_materials()
+        paths = []
+        for number in range( len(self.get_texture_names()) ) :
+            paths.extend( self.get_texture_paths(number) )
+        return ( self.get_lz_paths(paths) )
+
+    def get_final_path_report(self):
+        return ( Blender.sys.join(self.dir_path,self.mesh_name + ".report.json") )
+
+    def get_path_anim(self):
+        """File the vertex deltas are written into, before its compression"""
+        return ( Blender.sys.join(self.dir_path,self.mesh_name + ".anim") )
+
+    def get_final_path_anim(self):
+        return ( self.get_lz_paths([ self.get_path_anim() ])[0] )
+
+    def get_final_paths(self):
+        """Every file the export of the mesh writes, but the report"""
+        paths = [ self.get_final_path_mesh() ]
+        if (self.anim_export == EXPORT_OPTIONS['ANIM_DELTAS']) : paths.append( self.get_final_path_anim() )
+        if (self.texfile_export) : paths.extend( self.get_final_paths_tex() )
+        return ( paths )
 
     def __str__(self):
-        return "File Format:%s , Exporting Texture:%s , Exporting Normals:%s , Exporting Colors:%s" % (self.format,self.uv_export,self.normals_export,self.color_export)
+        return "File Format:%s , Exporting Texture:%s , Exporting Normals:%s , Exporting Colors:%s , Skipping Repeated States:%s , Strips:%s , Smallest Vertices:%s (error<=%f) , Streaming:%s , Pack Schedule:%s , Chunk Faces:%d , Fit Range:%s , Animation:%s (frames %d-%d) , LOD:%s , Baked Lights:%s , Reorder Faces:%s , Material Lists:%s , LZ:%s" % (self.format,self.uv_export,self.normals_export,self.color_export,self.state_elision,self.strip_export,self.vertex_packing,self.vertex_tolerance,self.stream_export,self.pack_schedule,self.chunk_faces,self.range_fit,self.anim_export,self.anim_start,self.anim_end,self.lod_targets,self.light_bake,self.face_reorder,self.material_lists,self.lz_compression)
 
 
-class _nds_cmdpack_nop(object) :
-    __slots__ = 'cmd','val'
+def texture_size(image) :
+    """(w , h) of the texture made from the Blender Image image : 8 to 128 texels, keeping its ratio"""
+    w = image.getSize()[0]
+    h = image.getSize()[1]
+    ratio = float(w)/float(h)
+    print "Texture %s %dx%d ratio=%f" % (image.getName(),w,h,ratio)
 
-    def __init__(self):
-        self.cmd = {}
-        self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']] = "FIFO_NOP"
-        self.cmd[EXPORT_OPTIONS['FORMAT_BINARY']] = pack( 'b' , FIFO_NOP )
+    if (w > 128) : w = 128
+    if (w < 8) : w = 8
+
+    if (h > 128) : h = 128
+    if (h < 8) : h = 8
+
+    if (ratio < 1.0) :
+        w = h * (1/round(1/ratio))
+        print "ratio <  1 : Texture %s %dx%d" % (image.getName(),w,h)
+    else :
+        h = w / round(ratio)
+        print "ratio >= 1 :Texture %s %dx%d" % (image.getName(),w,h)
+    return ( ( int(w) , int(h) ) )
+
+def count_switches(values) :
+    """Number of times a value differs from the previous one, the first one included"""
+    switches = 0
+    previous = None
+    for i in range( len(values) ) :
+        if (i == 0 or values[i] != previous) : switches += 1
+        previous = values[i]
+    return ( switches )
+
+def order_material_groups(keys) :
+    """Order the (material index , image name) keys of the CallLists : every image is bound once, and a run
+    of images starts with the material the previous run ends with whenever one has it"""
+    runs = {}
+    for material , name in keys :
+        runs.setdefault(name , []).append(material)
+    names = runs.keys()
+    names.sort()
+    order = []
+    material = None
+    while (len(names) > 0) :
+        name = names[0]
+        for n in names :
+            if (material in runs[n]) :
+                name = n
+                break
+        names.remove(name)
+        materials = runs[name]
+        materials.sort()
+        #the material of the previous run first, and last one the next runs have too
+        if (material in materials) :
+            materials.remove(material)
+            materials.insert(0 , material)
+        for m in materials[1:] :
+            if ([ n for n in names if m in runs[n] ]) :
+                materials.remove(m)
+                materials.append(m)
+                break
+        order.extend([ (m , name) for m in materials ])
+        material = materials[-1]
+    return ( order )
+
+def le16_string(values) :
+    """Little-endian bytes of a Numeric array of 16-bit values"""
+    values = ravel(values).astype(Int32)
+    return ( transpose( array( [ values & 0xFF , (values >> 8) & 0xFF ] ) ).astype(UnsignedInt8).tostring() )
+
+def nearest_colors(colors,palette) :
+    """Index of the nearest palette entry for every color, colors and palette being (n,3) Numeric arrays"""
+    index = []
+    #a few thousand colors at a time to bound the size of the distance array
+    for i in range(0 , len(colors) , 4096) :
+        d = colors[i:i+4096,NewAxis,:] - palette[NewAxis,:,:]
+        index.append( argmin( sum(d * d , 2) , 1 ) )
+    return ( concatenate(index) )
+
+# a _nds_texture converts a RGBA PIL image, already at its final size, into one
+# of the DS texture formats : the raw texels as they go into texture VRAM, the
+# BGR555 palette and, for GL_COMPRESSED, the palette index data of the 4x4 texel
+# blocks. Colors are reduced to 5 bits per channel, then every texel is mapped
+# and packed with whole-image Numeric operations.
+class _nds_texture (object) :
+    __slots__ = 'format' , 'width' , 'height' , 'texels' , 'palette' , 'palette_index' , 'color0_transparent'
+
+    def __init__(self,image,format):
+        self.format = format
+        self.width , self.height = image.size
+        self.palette = ""
+        self.palette_index = ""
+        self.color0_transparent = 0
+
+        #PIL >= 1.2 renamed Image.tostring() to Image.tobytes()
+        if (hasattr(image , 'tobytes')) : data = image.tobytes()
+        else : data = image.tostring()
+        rgba = reshape( fromstring(data , UnsignedInt8).astype(Int32) , (self.height * self.width , 4) )
+        self.texels = getattr(self , 'encode_' + format)(image , rgba[:,0:3] >> 3 , rgba[:,3])
+
+    def get_palette(self,image,nb_colors):
+        """Adaptive palette of nb_colors colors (5 bits per channel) for the image"""
+        import PIL.Image
+        pal = image.convert("RGB").convert("P" , palette=PIL.Image.ADAPTIVE , colors=nb_colors).getpalette()[0:3 * nb_colors]
+        pal = reshape( array(pal , Int32) , (len(pal) / 3 , 3) ) >> 3
+        return ( pal )
+
+    def set_palette(self,pal):
+        self.palette = le16_string( pal[:,0] | (pal[:,1] << 5) | (pal[:,2] << 10) )
+
+    def encode_paletted(self,image,rgb,alpha,nb_colors):
+        #texels with alpha < 128 use the color 0, which is then transparent
+        transparent = less(alpha , 128)
+        self.color0_transparent = sometrue(transparent)
+        if (self.color0_transparent) :
+            pal = self.get_palette(image , nb_colors - 1)
+            index = where( transparent , 0 , nearest_colors(rgb , pal) + 1 )
+            pal = concatenate( ( zeros((1,3) , Int32) , pal ) )
+        else :
+            pal = self.get_palette(image , nb_colors)
+            index = nearest_colors(rgb , pal)
+        self.set_palette(pal)
+        return ( index )
+
+    def pack_index(self,index,bits):
+        """Pack the texel indexes, the first texel of each byte in the lowest bits"""
+        per_byte = 8 / bits
+        index = reshape(index , (len(index) / per_byte , per_byte))
+        packed = zeros( (len(index) ,) , Int32 )
+        for i in range(per_byte) :
+            packed = packed | (index[:,i] << (i * bits))
+        return ( packed.astype(UnsignedInt8).tostring() )
+
+    def encode_GL_RGB4(self,image,rgb,alpha):
+        return ( self.pack_index(self.encode_paletted(image , rgb , alpha , 4) , 2) )
+
+    def encode_GL_RGB16(self,image,rgb,alpha):
+        return ( self.pack_index(self.encode_paletted(image , rgb , alpha , 16) , 4) )
+
+    def encode_GL_RGB256(self,image,rgb,alpha):
+        return ( self.pack_index(self.encode_paletted(image , rgb , alpha , 256) , 8) )
+
+    def encode_GL_RGB32_A3(self,image,rgb,alpha):
+        pal = self.get_palette(image , 32)
+        self.set_palette(pal)
+        return ( self.pack_index(nearest_colors(rgb , pal) | ((alpha >> 5) << 5) , 8) )
+
+    def encode_GL_RGB8_A5(self,image,rgb,alpha):
+        pal = self.get_palette(image , 8)
+        self.set_palette(pal)
+        return ( self.pack_index(nearest_colors(rgb , pal) | ((alpha >> 3) << 3) , 8) )
+
+    def encode_GL_RGBA(self,image,rgb,alpha):
+        return ( le16_string( rgb[:,0] | (rgb[:,1] << 5) | (rgb[:,2] << 10) | (greater_equal(alpha , 128) << 15) ) )
+
+    def encode_GL_COMPRESSED(self,image,rgb,alpha):
+        #every 4x4 block gets two colors c0 and c1 : the texels with the highest and lowest luminance.
+        #Blocks with transparent texels use mode 1 (c0 , c1 , (c0+c1)/2 , transparent),
+        #the others mode 3 (c0 , c1 , (5*c0+3*c1)/8 , (3*c0+5*c1)/8)
+        w , h = self.width / 4 , self.height / 4
+        nb = w * h
+        blocks = reshape( transpose( reshape(rgb , (h , 4 , w , 4 , 3)) , (0 , 2 , 1 , 3 , 4) ) , (nb * 16 , 3) )
+        transparent = reshape( transpose( reshape(less(alpha , 128) , (h , 4 , w , 4)) , (0 , 2 , 1 , 3) ) , (nb , 16) )
+        lum = reshape( blocks[:,0] * 2 + blocks[:,1] * 4 + blocks[:,2] , (nb , 16) )
+
+        first = arange(nb) * 16
+        c0 = take( blocks , first + argmax( where(transparent , -1 , lum) , 1 ) )
+        c1 = take( blocks , first + argmin( where(transparent , 1000 , lum) , 1 ) )
+        mode1 = sometrue(transparent , 1)
+        m = mode1[:,NewAxis]
+        c2 = where( m , (c0 + c1) / 2 , (c0 * 5 + c1 * 3) / 8 )
+        c3 = where( m , 0 , (c0 * 3 + c1 * 5) / 8 )
+
+        colors = reshape( transpose( array( [ c0 , c1 , c2 , c3 ] ) , (1 , 0 , 2) ) , (nb , 1 , 4 , 3) )
+        d = reshape(blocks , (nb , 16 , 1 , 3)) - colors
+        d = sum(d * d , 3)
+        #in mode 1 the color 3 is only used by the transparent texels
+        d[:,:,3] = where( m , 1 << 20 , d[:,:,3] )
+        index = where( transparent , 3 , argmin(d , 2) )
+
+        #the same two colors are shared between blocks
+        c01 = ( c0[:,0] | (c0[:,1] << 5) | (c0[:,2] << 10) | (c1[:,0] << 16) | (c1[:,1] << 21) | (c1[:,2] << 26) ).tolist()
+        slots = {}
+        pal = []
+        offsets = []
+        for key in c01 :
+            if (not slots.has_key(key)) :
+                slots[key] = len(pal)
+                pal.append(key)
+            offsets.append(slots[key])
+        pal = array(pal , Int32)
+        self.palette = le16_string( transpose( array( [ pal & 0x7FFF , pal >> 16 ] ) ) )
+        self.palette_index = le16_string( array(offsets , Int32) | where( mode1 , 1 << 14 , 3 << 14 ) )
+
+        #each 4x4 block is a 32-bit word, 8 bits per row, the first texel in the lowest bits
+        return ( self.pack_index(ravel(index) , 2) )
+
+    def save(self,paths):
+        """Write the texels, then the palette and the palette indexes when the format has them"""
+        data = [ self.texels ]
+        if (self.format != 'GL_RGBA') : data.append(self.palette)
+        if (self.format == 'GL_COMPRESSED') : data.append(self.palette_index)
+        for path , d in zip(paths , data) :
+            f = open(path , "wb")
+            try:
+                f.write(d)
+            finally:
+                f.close()
 
+    def __str__(self):
+        s = "NDS Texture %s %dx%d : %d bytes of texels , %d bytes of palette" % (self.format , self.width , self.height , len(self.texels) , len(self.palette))
+        if (self.format == 'GL_COMPRESSED') : s += " , %d bytes of palette index" % (len(self.palette_index))
+        if (self.color0_transparent) : s += " (color 0 is transparent)"
+        return ( s )
+
+
+def get_lz_paths(paths,lz_compression) :
+    """Names of the files paths once compressed by compress_files : path.lz, so that they are not taken
+    for the raw ones"""
+    if (not lz_compression or nds_lz == None) : return ( paths )
+    return ( [ path + nds_lz.LZ_SUFFIX for path in paths ] )
+
+def compress_files(paths,lz_compression) :
+    """Compress the written files paths into path.lz, in the LZ_* format lz_compression"""
+    if (not lz_compression) : return
+    if (nds_lz == None) :
+        print "!!!Warning : nds_lz.py not found next to nds_3d_export.py : files are not compressed!!!"
+        return
+    type = nds_lz.LZ10
+    if (lz_compression == EXPORT_OPTIONS['LZ_11']) : type = nds_lz.LZ11
+    for path in paths :
+        size , compressed = nds_lz.compress_file(path , type)
+        print "LZ%X %s%s : %d bytes -> %d bytes" % (type , path , nds_lz.LZ_SUFFIX , size , compressed)
+
+def convert_texture(job) :
+    """Convert, save and compress the texture of job (see _mesh_options.get_texture_jobs), without Blender : return the seconds it took"""
+    import PIL.Image
+    start = time.time()
+    filename , w , h , texture_format , paths , lz_compression = job
+    img = PIL.Image.open(filename)
+    if (texture_format == 'PCX') :
+        img_rgb = img.convert("RGB")
+        img_pal = img_rgb.convert("P",palette=PIL.Image.ADAPTIVE)
+        img_res = img_pal.resize((w,h) )
+        img_res.save(paths[0])
+    else :
+        img_res = img.convert("RGBA").resize((w,h) , PIL.Image.ANTIALIAS)
+        texture = _nds_texture(img_res , texture_format)
+        print texture
+        texture.save(paths)
+    compress_files(paths , lz_compression)
+    return ( time.time() - start )
+
+
+# a _nds_texture_queue converts textures in the worker processes of the batch
+# export, next to the meshes they encode. submit() reads the texture jobs from
+# Blender, then hands each one to the pool with apply_async, or converts it at
+# once without a pool. A texture whose image file, size, format and compression
+# were already submitted is converted once : join() waits for every result, then
+# copies the files of the first one.
+class _nds_texture_queue (object) :
+    __slots__ = 'pool' , 'results' , 'converted' , 'copies' , 'times'
+
+    def __init__(self,pool=None):
+        self.pool = pool
+        self.results = []
+        self.converted = {}
+        self.copies = []
+        self.times = {}
+
+    def add_time(self,mesh_name,t):
+        self.times[mesh_name] = self.times.get(mesh_name , 0.0) + t
+
+    def submit(self,mesh_options):
+        """Convert the textures of mesh_options, in the pool if there is one"""
+        try:
+            import PIL.Image
+        except ImportError :
+            print "Python Imaging Library not installed"
+            return
+        for job in mesh_options.get_texture_jobs() :
+            key = job[0:4] + job[5:]
+            paths = get_lz_paths(job[4] , job[5])
+            if (self.converted.has_key(key)) :
+                self.copies.append( (self.converted[key] , paths) )
+                continue
+            self.converted[key] = paths
+            if (self.pool != None) : self.results.append( (mesh_options.mesh_name , job , self.pool.apply_async(convert_texture , (job ,))) )
+            else : self.add_time(mesh_options.mesh_name , convert_texture(job))
+
+    def join(self):
+        """Wait for every texture and copy the shared ones, raise the first conversion error"""
+        errors = []
+        for mesh_name , job , result in self.results :
+            try:
+                self.add_time(mesh_name , result.get())
+            except Exception , e :
+                errors.append(e)
+                print "Cannot convert the texture %s : %s" % (job[0] , e)
+        self.results = []
+        if (len(errors) > 0) : raise errors[0]
+        for sources , paths in self.copies :
+            for source , path in zip(sources , paths) :
+                if (source != path) : shutil.copyfile(source , path)
+        self.copies = []
+
+    def get_time(self,mesh_name):
+        """Seconds spent converting the textures submitted for mesh_name"""
+        return ( self.times.get(mesh_name , 0.0) )
+
+
+# Every command stores its source values once and encodes them only when an
+# emitter asks for them : get_words() gives the packed 32-bit parameters used by
+# the binary and assembly outputs, get_text() the C macro used by the C output.
 
-        self.val = {}
-        self.val[EXPORT_OPTIONS['FORMAT_TEXT']] = None
-        self.val[EXPORT_OPTIONS['FORMAT_BINARY']] = None
+class _nds_cmdpack_nop(object) :
+    __slots__ = ()
+    cmd = FIFO_NOP
+    name = "FIFO_NOP"
 
-    def get_cmd(self,format):
-        return ( self.cmd[format] )
+    def get_words(self):
+        return ( () )
 
-    def get_val(self,format):
-        return ( self.val[format] )
+    def get_text(self):
+        return ( None )
 
     def get_nb_val(self):
         return ( 0 )
 
     def __str__(self):
-        return ( "%s , %s" % ( self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']], self.val[EXPORT_OPTIONS['FORMAT_TEXT']]) )
+        return ( "%s , %s" % ( self.name , self.get_text() ) )
 
 class _nds_cmdpack_begin (object) :
-    __slots__ = 'cmd','val'
+    __slots__ = 'begin_opt'
+    cmd = FIFO_BEGIN
+    name = "FIFO_BEGIN"
 
     def __init__(self,begin_opt):
-        self.cmd = {}
-        self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']] = "FIFO_BEGIN"
-        self.cmd[EXPORT_OPTIONS['FORMAT_BINARY']] = pack( 'b' , FIFO_BEGIN )
-
+        self.begin_opt = begin_opt
 
-        self.val = {}
-        self.val[EXPORT_OPTIONS['FORMAT_TEXT']] = begin_opt
-        self.val[EXPORT_OPTIONS['FORMAT_BINARY']] = pack('<i' , GL_GLBEGIN_ENUM[begin_opt] )
+    def get_words(self):
+        return ( ( GL_GLBEGIN_ENUM[self.begin_opt] , ) )
 
-
-    def get_cmd(self,format):
-        return ( self.cmd[format] )
-
-    def get_val(self,format):
-        return ( self.val[format] )
+    def get_text(self):
+        return ( self.begin_opt )
 
     def get_nb_val(self):
         return ( 1 )
 
     def __str__(self):
-        return ( "%s , %s" % ( self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']], self.val[EXPORT_OPTIONS['FORMAT_TEXT']]) )
+        return ( "%s , %s" % ( self.name , self.get_text() ) )
 
 class _nds_cmdpack_end(object) :
+    __slots__ = ()
+    cmd = FIFO_END
+    name = "FIFO_END"
 
-    __slots__ = 'cmd','val'
+    def get_words(self):
+        return ( () )
 
-    def __init__(self):
-        self.cmd = {}
-        self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']] = "FIFO_END"
-        self.cmd[EXPORT_OPTIONS['FORMAT_BINARY']] = pack( 'b' , FIFO_END )
-
-
-        self.val = {}
-        self.val[EXPORT_OPTIONS['FORMAT_TEXT']] = None
-        self.val[EXPORT_OPTIONS['FORMAT_BINARY']] = None
-
-
-    def get_cmd(self,format):
-        return ( self.cmd[format] )
-
-    def get_val(self,format):
-        return ( self.val[format] )
+    def get_text(self):
+        return ( None )
 
     def get_nb_val(self):
         return ( 0 )
 
     def __str__(self):
-        return ( "%s , %s" % ( self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']], self.val[EXPORT_OPTIONS['FORMAT_TEXT']]) )
+        return ( "%s , %s" % ( self.name , self.get_text() ) )
 
 
 class _nds_cmdpack_vertex (object) :
-    __slots__ = 'cmd','val'
-
-    def __init__(self,vertex=(0.0,0.0,0.0)):
-        x, y, z = vertex
-        self.cmd = {}
-        self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']] = "FIFO_VERTEX16"
-        self.cmd[EXPORT_OPTIONS['FORMAT_BINARY']] = pack( 'b' , FIFO_VERTEX16 )
-
+    __slots__ = 'vertex','packed'
+    cmd = FIFO_VERTEX16
+    name = "FIFO_VERTEX16"
 
-        self.val = {}
-        self.val[EXPORT_OPTIONS['FORMAT_TEXT']] = "VERTEX_PACK(floattov16(%f),floattov16(%f)) , VERTEX_PACK(floattov16(%f),0)" % (x,y,z)
-        self.val[EXPORT_OPTIONS['FORMAT_BINARY']] = pack('<ii' , VERTEX_PACK(floattov16(x) , floattov16(y)) , VERTEX_PACK(floattov16(z) , 0))
+    def __init__(self,vertex=(0.0,0.0,0.0),packed=None):
+        self.vertex = vertex
+        self.packed = packed
 
+    def get_words(self):
+        if (self.packed == None) :
+            x, y, z = self.vertex
+            self.packed = ( int(VERTEX_PACK(floattov16(x) , floattov16(y))) , int(VERTEX_PACK(floattov16(z) , 0)) )
+        return ( self.packed )
 
-    def get_cmd(self, format):
-        return ( self.cmd[format] )
-
-    def get_val(self, format):
-        return ( self.val[format] )
+    def get_text(self):
+        return ( "VERTEX_PACK(floattov16(%f),floattov16(%f)) , VERTEX_PACK(floattov16(%f),0)" % tuple(self.vertex) )
 
     def get_nb_val(self):
         return ( 2 )
 
     def __str__(self):
-        return ( "%s , %s" % ( self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']], self.val[EXPORT_OPTIONS['FORMAT_TEXT']]) )
+        return ( "%s , %s" % ( self.name , self.get_text() ) )
 
 
-class _nds_cmdpack_normal (object):
-    __slots__ = 'cmd','val'
+# a _nds_cmdpack_vertex_word is one of the vertex commands taking a single
+# parameter word : FIFO_VERTEX10, FIFO_VERTEX_XY/XZ/YZ or FIFO_DIFF
+class _nds_cmdpack_vertex_word (object) :
+    __slots__ = 'cmd' , 'name' , 'word' , 'text'
 
-    def __init__(self,normal=(0.0,0.0,0.0)):
-        x, y, z = normal
-        self.cmd = {}
-        self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']] = "FIFO_NORMAL"
-        self.cmd[EXPORT_OPTIONS['FORMAT_BINARY']] = pack( 'b' , FIFO_NORMAL )
+    def __init__(self,cmd,name,word,text=None):
+        self.cmd = cmd
+        self.name = name
+        self.word = word
+        self.text = text
 
+    def get_words(self):
+        return ( ( self.word , ) )
 
-        self.val = {}
-        self.val[EXPORT_OPTIONS['FORMAT_TEXT']] =  "NORMAL_PACK(floattov10(%3.6f),floattov10(%3.6f),floattov10(%3.6f))" % (x,y,z)
-        self.val[EXPORT_OPTIONS['FORMAT_BINARY']] = pack('<i' , NORMAL_PACK(floattov10(x) , floattov10(y) , floattov10(z)))
+    def get_text(self):
+        if (self.text == None) : return ( "0x%08X" % ( self.word & 0xFFFFFFFF ) )
+        return ( self.text )
 
+    def get_nb_val(self):
+        return ( 1 )
 
-    def get_cmd(self, format):
-        return ( self.cmd[format] )
+    def __str__(self):
+        return ( "%s , %s" % ( self.name , self.get_text() ) )
 
-    def get_val(self, format):
-        return ( self.val[format] )
+
+class _nds_cmdpack_normal (object):
+    __slots__ = 'normal','packed'
+    cmd = FIFO_NORMAL
+    name = "FIFO_NORMAL"
+
+    def __init__(self,normal=(0.0,0.0,0.0),packed=None):
+        self.normal = normal
+        self.packed = packed
+
+    def get_words(self):
+        if (self.packed == None) :
+            x, y, z = self.normal
+            self.packed = int(NORMAL_PACK(floattov10(x) , floattov10(y) , floattov10(z)))
+        return ( ( self.packed , ) )
+
+    def get_text(self):
+        return ( "NORMAL_PACK(floattov10(%3.6f),floattov10(%3.6f),floattov10(%3.6f))" % tuple(self.normal) )
 
     def get_nb_val(self):
         return ( 1 )
 
     def __str__(self):
-        return ( "%s , %s" % ( self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']], self.val[EXPORT_OPTIONS['FORMAT_TEXT']]) )
+        return ( "%s , %s" % ( self.name , self.get_text() ) )
 
 class _nds_cmdpack_color (object):
-    __slots__ = 'cmd' , 'val'
+    __slots__ = 'color' , 'packed'
+    cmd = FIFO_COLOR
+    name = "FIFO_COLOR"
+
+    def __init__(self,color=(0,0,0),packed=None):
+        self.color = color
+        self.packed = packed
+
+    def get_words(self):
+        if (self.packed == None) :
+            r, g, b = self.color
+            self.packed = int(RGB15(r,g,b))
+        return ( ( self.packed , ) )
+
+    def get_text(self):
+        return ( "RGB15(%d,%d,%d)" % tuple(self.color) )
 
-    def __init__(self,color=(0,0,0)):
-        r,g,b = color
-        self.cmd = {}
-        self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']] = "FIFO_COLOR"
-        self.cmd[EXPORT_OPTIONS['FORMAT_BINARY']] = pack( 'b' , FIFO_COLOR )
+    def get_nb_val(self):
+        return ( 1 )
 
+    def __str__(self):
+        return ( "%s , %s" % ( self.name , self.get_text() ) )
 
-        self.val = {}
-        self.val[EXPORT_OPTIONS['FORMAT_TEXT']] =  "RGB15(%d,%d,%d)" % (r,g,b)
-        self.val[EXPORT_OPTIONS['FORMAT_BINARY']] = pack( '<i' , RGB15(r,g,b) )
 
+class _nds_cmdpack_texture (object):
+    __slots__ = 'uv' , 'packed'
+    cmd = FIFO_TEX_COORD
+    name = "FIFO_TEX_COORD"
 
-    def get_cmd(self, format):
-        return ( self.cmd[format] )
+    def __init__(self,uv=(0.0,0.0),packed=None):
+        self.uv = uv
+        self.packed = packed
 
-    def get_val(self, format):
-        return ( self.val[format] )
+    def get_words(self):
+        if (self.packed == None) :
+            u, v = self.uv
+            self.packed = int(TEXTURE_PACK( floattot16(u) , floattot16(v) ))
+        return ( ( self.packed , ) )
+
+    def get_text(self):
+        return ( "TEXTURE_PACK(floattot16(%3.6f),floattot16(%3.6f))" % tuple(self.uv) )
 
     def get_nb_val(self):
         return ( 1 )
 
     def __str__(self):
-        return ( "%s , %s" % ( self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']], self.val[EXPORT_OPTIONS['FORMAT_TEXT']]) )
+        return ( "%s , %s" % ( self.name , self.get_text() ) )
+
+
+# a _nds_gpu_state remembers the last value sent for each attribute the DS
+# geometry engine latches (color, texture coordinates, normal) so that an
+# attribute equal to the current state can be dropped from the CallList.
+class _nds_gpu_state (object):
+    __slots__ = 'enabled' , 'last' , 'elided_commands' , 'elided_params'
+
+    def __init__(self,enabled=1):
+        self.enabled = enabled
+        self.last = {}
+        self.elided_commands = 0
+        self.elided_params = 0
+
+    def changed(self,cmd,value):
+        """Tell if the attribute command cmd carrying the packed value must be sent"""
+        if (self.enabled and self.last.get(cmd) == value) :
+            self.elided_commands += 1
+            self.elided_params += 1
+            return ( False )
 
+        self.last[cmd] = value
+        #With lighting enabled a FIFO_NORMAL overwrites the vertex color, so after
+        #a FIFO_COLOR the next normal has to be sent again even if it did not change
+        if (cmd == FIFO_COLOR and self.last.has_key(FIFO_NORMAL)) : del self.last[FIFO_NORMAL]
+        return ( True )
 
-class _nds_cmdpack_texture (object):
-    __slots__ = 'cmd' , 'val'
-
-    def __init__(self,uv=(0.0,0.0)):
-        u,v = uv
-        self.cmd = {}
-        self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']] = "FIFO_TEX_COORD"
-        self.cmd[EXPORT_OPTIONS['FORMAT_BINARY']] = pack( 'b' , FIFO_TEX_COORD )
+    def __str__(self):
+        return "State elision : %d commands and %d parameter words saved" % (self.elided_commands , self.elided_params)
+
+
+def sign16(n) :
+    return ( ((n + 0x8000) & 0xFFFF) - 0x8000 )
+
+def sign32(n) :
+    return ( ((n + 0x80000000) & 0xFFFFFFFF) - 0x80000000 )
+
+# a _nds_vertex_packer picks the cheapest vertex command able to send a vertex :
+# FIFO_VERTEX_XY/XZ/YZ when one coordinate equals the previous vertex one,
+# FIFO_DIFF when the vertex is within 511/4096 of the previous one and
+# FIFO_VERTEX10 when its 3.6 coordinates are exact (or within tolerance), all
+# of them one parameter word instead of two for FIFO_VERTEX16. The previous
+# vertex is forgotten at every BEGIN since the list can be called from anywhere.
+class _nds_vertex_packer (object):
+    __slots__ = 'enabled' , 'tolerance' , 'previous' , 'counts'
+
+    def __init__(self,enabled=1,tolerance=0.0):
+        self.enabled = enabled
+        self.tolerance = int(tolerance * (1<<12))
+        self.previous = None
+        self.counts = {}
+
+    def reset(self):
+        self.previous = None
+
+    def count(self,name):
+        self.counts[name] = self.counts.get(name , 0) + 1
+
+    def command(self,position,words):
+        """Return the vertex command for position already packed as two FIFO_VERTEX16 words"""
+        if (not self.enabled) :
+            self.count("FIFO_VERTEX16")
+            return ( _nds_cmdpack_vertex(position , words) )
+
+        x = sign16(words[0])
+        y = words[0] >> 16
+        z = sign16(words[1])
+        cmd = None
+        p = self.previous
+
+        if (p != None) :
+            px , py , pz = p
+            if (z == pz) :
+                cmd = _nds_cmdpack_vertex_word(FIFO_VERTEX_XY , "FIFO_VERTEX_XY" , words[0] , "VERTEX_PACK(floattov16(%f),floattov16(%f))" % (position[0] , position[1]))
+            elif (y == py) :
+                cmd = _nds_cmdpack_vertex_word(FIFO_VERTEX_XZ , "FIFO_VERTEX_XZ" , sign32((x & 0xFFFF) | (z << 16)) , "VERTEX_PACK(floattov16(%f),floattov16(%f))" % (position[0] , position[2]))
+            elif (x == px) :
+                cmd = _nds_cmdpack_vertex_word(FIFO_VERTEX_YZ , "FIFO_VERTEX_YZ" , sign32((y & 0xFFFF) | (z << 16)) , "VERTEX_PACK(floattov16(%f),floattov16(%f))" % (position[1] , position[2]))
+            else :
+                dx , dy , dz = x - px , y - py , z - pz
+                if (-512 <= dx <= 511 and -512 <= dy <= 511 and -512 <= dz <= 511) :
+                    cmd = _nds_cmdpack_vertex_word(FIFO_DIFF , "FIFO_DIFF" , sign32((dx & 0x3FF) | ((dy & 0x3FF) << 10) | ((dz & 0x3FF) << 20)))
 
+        if (cmd == None) :
+            #FIFO_VERTEX10 coordinates are 3.6 fixed point : round to the nearest one
+            q = [ max(-512 , min(511 , (c + 32) >> 6)) for c in (x , y , z) ]
+            if ( max( abs(x - (q[0] << 6)) , abs(y - (q[1] << 6)) , abs(z - (q[2] << 6)) ) <= self.tolerance ) :
+                cmd = _nds_cmdpack_vertex_word(FIFO_VERTEX10 , "FIFO_VERTEX10" , sign32((q[0] & 0x3FF) | ((q[1] & 0x3FF) << 10) | ((q[2] & 0x3FF) << 20)))
+                x , y , z = q[0] << 6 , q[1] << 6 , q[2] << 6
 
-        self.val = {}
-        self.val[EXPORT_OPTIONS['FORMAT_TEXT']] =  "TEXTURE_PACK(floattot16(%3.6f),floattot16(%3.6f))" % (u,v)
-        self.val[EXPORT_OPTIONS['FORMAT_BINARY']] = pack( '<i' , TEXTURE_PACK( floattot16(u) , floattot16(v) ) )
+        if (cmd == None) :
+            cmd = _nds_cmdpack_vertex(position , words)
 
+        self.previous = ( x , y , z )
+        self.count(cmd.name)
+        return ( cmd )
 
-    def get_cmd(self, format):
-        return ( self.cmd[format] )
+    def __str__(self):
+        names = self.counts.keys()
+        names.sort()
+        return "Vertex commands : %s" % ( " , ".join([ "%s=%d" % (n , self.counts[n]) for n in names ]) )
+
+
+# a _nds_stripifier joins faces sharing an edge into GL_TRIANGLE_STRIP or
+# GL_QUAD_STRIP lists. Faces are described by one key per corner (corners with
+# the same key send the same commands) and are stored corner after corner, size
+# corners per face. A strip is grown greedily from the free face having the
+# fewest neighbours, in the direction giving the longest strip, keeping the
+# winding of every face so that back-face culling still works.
+class _nds_stripifier (object):
+    __slots__ = 'size' , 'faces' , 'edges' , 'used' , 'strips' , 'leftovers' , 'nb_strip_faces'
+
+    def __init__(self,keys,size):
+        self.size = size
+        self.faces = [ keys[i:i+size] for i in range(0,len(keys),size) ]
+        self.used = [0] * len(self.faces)
+        self.strips = []     #corner indices of each strip
+        self.leftovers = []  #corner indices of the faces left in a list
+        self.nb_strip_faces = 0
+
+        #directed edge -> faces having this edge, degenerated faces are never stripped
+        self.edges = {}
+        for f in range( len(self.faces) ) :
+            face = self.faces[f]
+            if ( len(dict.fromkeys(face)) < size ) :
+                self.used[f] = 1
+                continue
+            for j in range(size) :
+                self.edges.setdefault( (face[j] , face[(j+1) % size]) , [] ).append(f)
+
+        self.build()
+
+    def neighbours(self,f):
+        face = self.faces[f]
+        nb = 0
+        for j in range(self.size) :
+            for g in self.edges.get( (face[(j+1) % self.size] , face[j]) , () ) :
+                if ( not self.used[g] ) : nb += 1
+        return ( nb )
 
-    def get_val(self, format):
-        return ( self.val[format] )
+    def next_face(self,a,b,members):
+        """Return (face , index of a in face) for a free face having the directed edge a->b"""
+        for g in self.edges.get( (a,b) , () ) :
+            if ( self.used[g] or members.has_key(g) ) : continue
+            face = self.faces[g]
+            for j in range(self.size) :
+                if ( face[j] == a and face[(j+1) % self.size] == b ) :
+                    return ( g , j )
+        return ( None , None )
+
+    def grow(self,f,r):
+        """Grow a strip starting with face f rotated by r, return its faces and corners"""
+        size = self.size
+        face = self.faces[f]
+        members = { f : 1 }
+        if (size == 3) :
+            order = (0 , 1 , 2)
+        else :
+            order = (0 , 1 , 3 , 2)
+        corners = [ f * size + (r + j) % size for j in order ]
+        keys = [ face[(r + j) % size] for j in order ]
+
+        while 1 :
+            p , q = keys[-2] , keys[-1]
+            if ( size == 3 ) :
+                #odd triangles of a strip have their first two vertices swapped
+                if ( len(members) % 2 == 0 ) : g , j = self.next_face(p , q , members)
+                else : g , j = self.next_face(q , p , members)
+                if ( g == None ) : break
+                added = ( (j + 2) % 3 , )
+            else :
+                g , j = self.next_face(p , q , members)
+                if ( g == None ) : break
+                added = ( (j + 3) % 4 , (j + 2) % 4 )
+            members[g] = 1
+            for k in added :
+                corners.append( g * size + k )
+                keys.append( self.faces[g][k] )
+
+        return ( members.keys() , corners )
+
+    def build(self):
+        order = [ ( self.neighbours(f) , f ) for f in range( len(self.faces) ) if not self.used[f] ]
+        order.sort()
+        for nb , f in order :
+            if ( self.used[f] ) : continue
+            best = None
+            for r in range(self.size) :
+                members , corners = self.grow(f , r)
+                if ( best == None or len(members) > len(best[0]) ) : best = ( members , corners )
+                if ( nb == 0 ) : break
+            members , corners = best
+            if ( len(members) < 2 ) : continue
+            for g in members : self.used[g] = 1
+            self.strips.append(corners)
+            self.nb_strip_faces += len(members)
+
+        for f in range( len(self.faces) ) :
+            if ( not self.used[f] or len(dict.fromkeys(self.faces[f])) < self.size ) :
+                self.leftovers.extend( range(f * self.size , (f + 1) * self.size) )
+
+
+def fit_position_range(low,high,limit=0x7FFF) :
+    """Offset and uniform scale, as f32 (20.12) integers, mapping the box low-high onto the 4.12 range, up to limit"""
+    offset = [ int(floor((l + h) * (1<<11) + .5)) for l , h in zip(low , high) ]
+    half = 0.0
+    for l , h , o in zip(low , high , offset) :
+        half = max(half , h - o / 4096.0 , o / 4096.0 - l)
+    #the biggest coordinate sent must stay below limit/4096 once divided by the scale
+    scale = int(ceil(half * (1<<24) / limit))
+    if (scale == 0) : scale = 1<<12
+    return ( ( offset , scale ) )
+
+def fit_positions(positions,position_range) :
+    """positions scaled into the 4.12 range by the (offset , scale) given by fit_position_range"""
+    offset , scale = position_range
+    return ( (positions - array(offset , Float) / 4096.0) * (4096.0 / scale) )
+
+def position_bounds(positions) :
+    """(low , high) of the corners of a (n,3) Numeric array of positions"""
+    return ( ( minimum.reduce(positions).tolist() , maximum.reduce(positions).tolist() ) )
+
+def merge_bounds(bounds) :
+    """Box enclosing a list of (low , high) boxes"""
+    low = [ min([ b[0][i] for b in bounds ]) for i in range(3) ]
+    high = [ max([ b[1][i] for b in bounds ]) for i in range(3) ]
+    return ( ( low , high ) )
+
+def morton_codes(points) :
+    """Morton code (10 bits per axis) of each row of the (n,3) array points, inside their bounding box"""
+    if (len(points) == 0) : return ( zeros(0 , Int) )
+    low = minimum.reduce(points)
+    size = maximum.reduce(points) - low
+    q = ( (points - low) / where( greater(size , 0.0) , size , 1.0 ) * 1023 ).astype(Int)
+    codes = zeros(len(points) , Int)
+    for bit in range(10) :
+        for axis in range(3) :
+            codes = codes | ( ((q[:,axis] >> bit) & 1) << (3 * bit + axis) )
+    return ( codes )
+
+# a _nds_quantization_error accumulates, attribute by attribute, the largest and
+# the RMS difference between the values in Blender and the fixed-point values
+# sent : positions in Blender units, normals, and texture coordinates in texels.
+class _nds_quantization_error (object):
+    __slots__ = 'highest' , 'squares' , 'count'
 
-    def get_nb_val(self):
-        return ( 1 )
+    def __init__(self):
+        self.highest = {}
+        self.squares = {}
+        self.count = {}
+
+    def add(self,name,error):
+        error = absolute(ravel(error))
+        if (len(error) == 0) : return
+        self.highest[name] = max(self.highest.get(name , 0.0) , float(maximum.reduce(error)))
+        self.squares[name] = self.squares.get(name , 0.0) + float(add.reduce(error * error))
+        self.count[name] = self.count.get(name , 0) + len(error)
+
+    def merge(self,other):
+        for name in other.count.keys() :
+            self.highest[name] = max(self.highest.get(name , 0.0) , other.highest[name])
+            self.squares[name] = self.squares.get(name , 0.0) + other.squares[name]
+            self.count[name] = self.count.get(name , 0) + other.count[name]
+
+    def get_report(self):
+        """{ attribute : { 'max' : error , 'rms' : error } }"""
+        report = {}
+        for name in self.count.keys() :
+            report[name] = { 'max' : self.highest[name] , 'rms' : sqrt(self.squares[name] / self.count[name]) }
+        return ( report )
 
     def __str__(self):
-        return ( "%s , %s" % ( self.cmd[EXPORT_OPTIONS['FORMAT_TEXT']], self.val[EXPORT_OPTIONS['FORMAT_TEXT']]) )
+        report = self.get_report()
+        names = report.keys()
+        names.sort()
+        return "Quantization error : %s" % ( " , ".join([ "%s max=%f rms=%f" % (n , report[n]['max'] , report[n]['rms']) for n in names ]) )
 
 
-class _nds_mesh_vertex (object):
-    __slots__ = 'vertex','uv','normal','color'
+# a _nds_mesh_attributes stores the face-corners of one primitive type (quads or
+# triangles) column by column, so that every packed word can be computed in a
+# single vectorized pass instead of one Numeric call per scalar.
+class _nds_mesh_attributes (object):
+    __slots__ = 'positions' , 'normals' , 'uvs' , 'uv_mask' , 'colors' , 'vertex_words' , 'normal_words' , 'texcoord_words' , 'color_words'
 
     def __init__(self):
-        self.vertex = None
-        self.uv = None
-        self.normal = None
-        self.color = None
+        self.positions = []
+        self.normals = []
+        self.uvs = []
+        self.uv_mask = []
+        self.colors = []
+
+    def append(self,co,no,uv=None,col=None,diffuse=None):
+        x, y, z = co
+        self.positions.append( (x,y,z) )
+        x, y, z = no
+        self.normals.append( (x,y,z) )
+        if (uv != None) :
+            self.uvs.append( (uv.x,uv.y) )
+            self.uv_mask.append( uv.x >= 0 and uv.y >= 0 )
+        if (diffuse != None) :
+            #with the lighting bake, the color is the diffuse color of the corner : its material one, times its vertex color
+            r , g , b = 255.0 , 255.0 , 255.0
+            if (col != None) : r , g , b = col.r , col.g , col.b
+            self.colors.append( (r * diffuse[0] , g * diffuse[1] , b * diffuse[2]) )
+        elif (col != None) :
+            self.colors.append( (col.r,col.g,col.b) )
+
+    def append_face(self,face,options):
+        diffuse = None
+        if (options.light_bake) : diffuse = options.get_diffuse(face.mat)
+        for i, v in enumerate(face.v):
+            #we copy vertex's coordinates and normals, UV coordinates only if there is UV layer
+            #for the current mesh and color only if there is Color Layer for the current mesh
+            uv = col = None
+            if (options.uv_export) : uv = face.uv[i]
+            if (options.color_export) : col = face.col[i]
+            self.append(v.co , v.no , uv , col , diffuse)
+
+    def __len__(self):
+        return ( len(self.positions) )
+
+    def get_subset(self,faces,size):
+        """New _nds_mesh_attributes with the corners of the faces listed in faces, not encoded yet"""
+        subset = _nds_mesh_attributes()
+        corners = [ f * size + j for f in faces for j in range(size) ]
+        subset.positions = [ self.positions[i] for i in corners ]
+        subset.normals = [ self.normals[i] for i in corners ]
+        if (len(self.uvs) > 0) :
+            subset.uvs = [ self.uvs[i] for i in corners ]
+            subset.uv_mask = [ self.uv_mask[i] for i in corners ]
+        if (len(self.colors) > 0) :
+            subset.colors = [ self.colors[i] for i in corners ]
+        return ( subset )
+
+    def get_frame(self,positions,normals):
+        """New _nds_mesh_attributes sharing the texture coordinates and colors of these ones, with other positions and normals"""
+        frame = _nds_mesh_attributes()
+        frame.positions = positions
+        frame.normals = normals
+        frame.uvs = self.uvs
+        frame.uv_mask = self.uv_mask
+        frame.colors = self.colors
+        return ( frame )
+
+    def get_centroids(self,size):
+        """(faces,3) Numeric array of the face centers"""
+        if (len(self) == 0) : return ( zeros((0,3) , Float) )
+        return ( add.reduce( reshape( array(self.positions , Float) , (len(self) / size , size , 3) ) , 1 ) / size )
+
+    def update_hash(self,h):
+        """Feed the collected columns to the hash object h, a few thousand rows at a time"""
+        for column in (self.positions , self.normals , self.uvs , self.uv_mask , self.colors) :
+            h.update( "%d:" % len(column) )
+            for i in range(0 , len(column) , 4096) :
+                h.update( repr(column[i:i+4096]) )
+
+    def get_bounds(self):
+        return ( position_bounds( array(self.positions , Float) ) )
+
+    def encode(self,texture_w,texture_h,position_range=None,errors=None,lighting=None):
+        """Convert the collected columns into contiguous arrays and compute every packed word at once.
+        position_range is the (offset , scale) given by fit_position_range, errors a _nds_quantization_error,
+        lighting the (lights , ambient) given by _mesh_options.get_lighting"""
+        if (len(self) == 0) : return
+
+        positions = array(self.positions , Float)
+        self.positions = positions
+        if (position_range != None) :
+            offset , scale = position_range
+            self.positions = fit_positions(positions , position_range)
+        elif (maximum.reduce(absolute(ravel(positions))) >= 8.0) :
+            print "!!!Warning : coordinates outside [-8.0,8.0[ overflow FIFO_VERTEX16 : use range fitting!!!"
+        x = floattov16_array(self.positions[:,0])
+        y = floattov16_array(self.positions[:,1])
+        z = floattov16_array(self.positions[:,2])
+        self.vertex_words = transpose( array( [ VERTEX_PACK(x,y) , VERTEX_PACK(z,0) ] , Int32 ) )
+        if (errors != None) :
+            sent = transpose( array( [ x , y , z ] , Float ) ) / 4096.0
+            if (position_range != None) : sent = sent * (scale / 4096.0) + array(offset , Float) / 4096.0
+            errors.add('position' , sent - positions)
+
+        self.normals = array(self.normals , Float)
+        x = floattov10_array(self.normals[:,0])
+        y = floattov10_array(self.normals[:,1])
+        z = floattov10_array(self.normals[:,2])
+        self.normal_words = NORMAL_PACK(x,y,z)
+        if (errors != None) : errors.add('normal' , transpose( array( [ x , y , z ] , Float ) ) / 512.0 - self.normals)
+
+        if (len(self.uvs) > 0) :
+            uvs = array(self.uvs , Float)
+            self.uvs = transpose( array( [ uvs[:,0] * texture_w , (1 - uvs[:,1]) * texture_h ] , Float ) )
+            u = floattot16_array(self.uvs[:,0])
+            v = floattot16_array(self.uvs[:,1])
+            self.texcoord_words = TEXTURE_PACK( u , v )
+            if (errors != None) : errors.add('uv' , transpose( array( [ u , v ] , Float ) ) / 16.0 - self.uvs)
+
+        if (lighting != None) : self.colors = self.bake_lighting(lighting)
+
+        if (len(self.colors) > 0) :
+            self.colors = array(self.colors , Int32) * 32 / 256
+            self.color_words = RGB15( self.colors[:,0] , self.colors[:,1] , self.colors[:,2] )
+
+    def get_reordered(self,corners):
+        """New encoded _nds_mesh_attributes with these corners in the order of the index list corners"""
+        reordered = _nds_mesh_attributes()
+        for name in ('positions' , 'normals' , 'vertex_words' , 'normal_words') :
+            setattr( reordered , name , take(getattr(self , name) , corners) )
+        if (len(self.uvs) > 0) :
+            reordered.uvs = take(self.uvs , corners)
+            reordered.texcoord_words = take(self.texcoord_words , corners)
+            reordered.uv_mask = [ self.uv_mask[i] for i in corners ]
+        if (len(self.colors) > 0) :
+            reordered.colors = take(self.colors , corners)
+            reordered.color_words = take(self.color_words , corners)
+        return ( reordered )
+
+    def bake_lighting(self,lighting):
+        """(corners,3) array of the colors lit by the directional lights and the ambient light, from 0 to 255,
+        the colors of the corners being their diffuse colors (see append)"""
+        lights , ambient = lighting
+        light = zeros( (len(self) , 3) , Float ) + array(ambient , Float)
+        for direction , color in lights :
+            lambert = maximum( -dot(self.normals , array(direction , Float)) , 0.0 )
+            light = light + lambert[:,NewAxis] * array(color , Float)
+        if (len(self.colors) > 0) : light = light * array(self.colors , Float) / 255.0
+        return ( minimum(light , 1.0) * 255.0 )
 
     def __str__(self):
-        return "MESH_VERTEX(vertex=%s uv=%s normal=%s color=%s)" % (self.vertex , self.uv , self.normal , self.color)
+        return "MESH_ATTRIBUTES(corners=%d uv=%s color=%s)" % (len(self) , len(self.uvs) > 0 , len(self.colors) > 0)
 
 
 class _nds_cmdpack (object) :
@@ -401,9 +1430,11 @@ class _nds_cmdpack (object) :
             return ( True )
 
     def terminate(self):
-        if (self.len() < 4):
-            for i in range(self.len(),4):
-                self.commands.append(_nds_cmdpack_nop())
+        """Fill the pack with NOP commands, return how many were added"""
+        nb = 4 - self.len()
+        for i in range(nb):
+            self.commands.append(_nds_cmdpack_nop())
+        return ( nb )
 
     def len(self):
         return ( len(self.commands) )
@@ -419,30 +1450,8 @@ class _nds_cmdpack (object) :
 
         return ( nb )
 
-    def get_pack(self,format):
-        str = ""
-        str += self.get_cmd(format)
-        str += self.get_val(format)
-        return ( str )
-
-    def get_cmd(self,format):
-        cmd = ""
-        c = self.commands
-        if ( format == EXPORT_OPTIONS['FORMAT_TEXT'] ) :
-            cmd += "FIFO_COMMAND_PACK( %s , %s , %s , %s ),\n" % ( c[0].get_cmd(format) ,c[1].get_cmd(format) ,c[2].get_cmd(format) ,c[3].get_cmd(format) )
-        elif ( format == EXPORT_OPTIONS['FORMAT_BINARY'] ) :
-            cmd += c[0].get_cmd(format) + c[1].get_cmd(format) + c[2].get_cmd(format) + c[3].get_cmd(format)
-        return cmd
-
-    def get_val(self,format):
-        val = ""
-        for i in self.commands:
-            if ( i.get_val(format) != None ):
-                val += i.get_val(format)
-                if ( format == EXPORT_OPTIONS['FORMAT_TEXT'] ) :
-                    val += ",\n"
-
-        return val
+    def write_pack(self,emitter,writer):
+        emitter.write_pack(writer , self.commands)
 
     def __str__(self):
         str = "CMD_PACK ELEMENT:\n"
@@ -452,6 +1461,308 @@ class _nds_cmdpack (object) :
 
 
 
+# a _nds_cmdpack_writer receives the encoded CallList piece by piece : it streams
+# them straight into a file, or appends them to a growable in-memory buffer, so
+# the export time and memory grow linearly with the number of commands.
+class _nds_cmdpack_writer (object):
+    __slots__ = 'out' , 'in_memory' , 'separator' , 'size' , 'count_offset'
+
+    def __init__(self,out=None):
+        self.in_memory = (out == None)
+        if (self.in_memory) : out = StringIO()
+        self.out = out
+        self.separator = ""
+        self.size = 0
+        self.count_offset = 0
+
+    def write(self,data):
+        self.out.write(data)
+        self.size += len(data)
+
+    def item(self,data):
+        """Write one element of a C-style array, separated from the previous one"""
+        self.write(self.separator)
+        self.write(data)
+        self.separator = ",\n"
+
+    def patch_count(self,data):
+        """Overwrite the parameter count written by the emitter, which must keep its size"""
+        self.out.seek(self.count_offset)
+        self.out.write(data)
+        self.out.seek(0 , 2)
+
+    def getvalue(self):
+        if (self.in_memory) : return ( self.out.getvalue() )
+        return ( None )
+
+
+# An emitter encodes the command packs for one output format. Adding a new
+# output format only requires a new emitter registered in EMITTERS.
+# begin() writes the parameter count with format_count() at writer.count_offset
+# so that a streamed export can write it again once it is known, at the same
+# width.
+
+COUNT_WIDTH = 10
+
+class _nds_emitter_binary (object) :
+    """Raw CallList : the parameter count followed by the packs, little-endian"""
+    __slots__ = ()
+    extension = ".bin"
+    description = "NDS Binary CallList"
+
+    def format_count(self,nb_params,width=0):
+        return ( pack( '<i' , nb_params ) )
+
+    def begin(self,writer,name,nb_params,width=0):
+        writer.count_offset = writer.size
+        writer.write( self.format_count(nb_params , width) )
+
+    def write_pack(self,writer,commands):
+        c = commands
+        writer.write( pack( '<BBBB' , c[0].cmd , c[1].cmd , c[2].cmd , c[3].cmd ) )
+        for i in c:
+            words = i.get_words()
+            if ( len(words) > 0 ) :
+                writer.write( pack( '<%di' % len(words) , *words ) )
+
+    def end(self,writer,name):
+        pass
+
+    def write_matrix(self,writer,name,matrix):
+        """The 12 f32 parameters of MTX_MULT_4x3 giving back the Blender coordinates, after the CallList"""
+        writer.write( pack( '<12i' , *matrix ) )
+
+    def write_distances(self,writer,name,distances):
+        """The distance (f32) from which each level of detail is used, after the CallLists"""
+        writer.write( pack( '<%di' % len(distances) , *distances ) )
+
+    def write_textures(self,writer,name,textures):
+        """The texture number of each CallList (-1 without texture), after the CallLists"""
+        writer.write( pack( '<%di' % len(textures) , *textures ) )
+
+    def write_chunks(self,writer,name,chunks):
+        """Index then CallLists of chunks, a list of (name , BOX_TEST words , parameter count , pack list)"""
+        #the index : the number of chunks, then for each one its BOX_TEST parameters and the byte offset of its CallList
+        offset = 4 + 16 * len(chunks)
+        writer.write( pack( '<i' , len(chunks) ) )
+        for chunk_name , box , nb_params , cmdpacks in chunks :
+            writer.write( pack( '<4i' , box[0] , box[1] , box[2] , offset ) )
+            offset += 4 + 4 * nb_params
+        for chunk_name , box , nb_params , cmdpacks in chunks :
+            self.begin(writer , chunk_name , nb_params)
+            cmdpacks.write_pack(self , writer)
+            self.end(writer , chunk_name)
+
+class _nds_emitter_text (object) :
+    """C-style u32 array using the libnds macros"""
+    __slots__ = ()
+    extension = ".h"
+    description = "C-Style Format"
+
+    def format_count(self,nb_params,width=0):
+        return ( "%-*d" % ( width , nb_params ) )
+
+    def begin(self,writer,name,nb_params,width=0):
+        writer.write( "u32 %s[] = {\n" % ( name ) )
+        writer.separator = ""
+        writer.count_offset = writer.size
+        writer.item( self.format_count(nb_params , width) )
+
+    def write_pack(self,writer,commands):
+        c = commands
+        writer.item( "FIFO_COMMAND_PACK( %s , %s , %s , %s )" % ( c[0].name , c[1].name , c[2].name , c[3].name ) )
+        for i in c:
+            text = i.get_text()
+            if ( text != None ):
+                writer.item( text )
+
+    def end(self,writer,name):
+        writer.write( "\n};\n" )
+
+    def write_matrix(self,writer,name,matrix):
+        """The 12 f32 parameters of MTX_MULT_4x3 giving back the Blender coordinates, as <name>_matrix"""
+        writer.write( "s32 %s_matrix[] = {\n" % ( name ) )
+        writer.separator = ""
+        for i in range(0 , 12 , 3) :
+            writer.item( "%d , %d , %d" % tuple(matrix[i:i+3]) )
+        self.end(writer , name)
+
+    def write_distances(self,writer,name,distances):
+        """The distance (f32) from which each level of detail is used, as <name>_distance"""
+        writer.write( "s32 %s_distance[] = {\n" % ( name ) )
+        writer.separator = ""
+        for d in distances :
+            writer.item( "%d" % ( d ) )
+        self.end(writer , name)
+
+    def write_textures(self,writer,name,textures):
+        """The texture number of each CallList (-1 without texture), as <name>_texture"""
+        writer.write( "s32 %s_texture[] = {\n" % ( name ) )
+        writer.separator = ""
+        for t in textures :
+            writer.item( "%d" % ( t ) )
+        self.end(writer , name)
+
+    def write_chunks(self,writer,name,chunks):
+        """CallLists of chunks, a list of (name , BOX_TEST words , parameter count , pack list), then their index"""
+        for chunk_name , box , nb_params , cmdpacks in chunks :
+            self.begin(writer , chunk_name , nb_params)
+            cmdpacks.write_pack(self , writer)
+            self.end(writer , chunk_name)
+
+        writer.write( "u32 %s_nb_chunks = %d;\n" % ( name , len(chunks) ) )
+        writer.write( "u32 %s_box[] = {\n" % ( name ) )
+        writer.separator = ""
+        for chunk_name , box , nb_params , cmdpacks in chunks :
+            writer.item( "0x%08X , 0x%08X , 0x%08X" % ( box[0] & 0xFFFFFFFF , box[1] & 0xFFFFFFFF , box[2] & 0xFFFFFFFF ) )
+        self.end(writer , name)
+        writer.write( "u32 *%s[] = {\n" % ( name ) )
+        writer.separator = ""
+        for chunk_name , box , nb_params , cmdpacks in chunks :
+            writer.item( chunk_name )
+        self.end(writer , name)
+
+class _nds_emitter_asm (object) :
+    """GNU as source file using .word directives"""
+    __slots__ = ()
+    extension = ".s"
+    description = "GNU as Format"
+
+    def format_count(self,nb_params,width=0):
+        return ( "%-*d" % ( width , nb_params ) )
+
+    def label(self,writer,name):
+        writer.write( "\t.section .rodata\n\t.align 2\n\t.global %s\n\t.type %s, %%object\n%s:\n" % ( name , name , name ) )
+
+    def begin(self,writer,name,nb_params,width=0):
+        self.label(writer , name)
+        writer.write( "\t.word " )
+        writer.count_offset = writer.size
+        writer.write( "%s\n" % ( self.format_count(nb_params , width) ) )
+
+    def write_pack(self,writer,commands):
+        c = commands
+        writer.write( "\t.word 0x%02X%02X%02X%02X @ %s , %s , %s , %s\n" % ( c[3].cmd , c[2].cmd , c[1].cmd , c[0].cmd , c[0].name , c[1].name , c[2].name , c[3].name ) )
+        for i in c:
+            for w in i.get_words() :
+                writer.write( "\t.word 0x%08X\n" % ( w & 0xFFFFFFFF ) )
+
+    def end(self,writer,name):
+        writer.write( "\t.size %s, .-%s\n" % ( name , name ) )
+
+    def write_matrix(self,writer,name,matrix):
+        """The 12 f32 parameters of MTX_MULT_4x3 giving back the Blender coordinates, as <name>_matrix"""
+        self.label(writer , name + "_matrix")
+        for i in range(0 , 12 , 3) :
+            writer.write( "\t.word %d , %d , %d\n" % tuple(matrix[i:i+3]) )
+        self.end(writer , name + "_matrix")
+
+    def write_distances(self,writer,name,distances):
+        """The distance (f32) from which each level of detail is used, as <name>_distance"""
+        self.label(writer , name + "_distance")
+        writer.write( "\t.word %s\n" % ( " , ".join([ "%d" % d for d in distances ]) ) )
+        self.end(writer , name + "_distance")
+
+    def write_textures(self,writer,name,textures):
+        """The texture number of each CallList (-1 without texture), as <name>_texture"""
+        self.label(writer , name + "_texture")
+        writer.write( "\t.word %s\n" % ( " , ".join([ "%d" % t for t in textures ]) ) )
+        self.end(writer , name + "_texture")
+
+    def write_chunks(self,writer,name,chunks):
+        """CallLists of chunks, a list of (name , BOX_TEST words , parameter count , pack list), then their index"""
+        for chunk_name , box , nb_params , cmdpacks in chunks :
+            self.begin(writer , chunk_name , nb_params)
+            cmdpacks.write_pack(self , writer)
+            self.end(writer , chunk_name)
+
+        #the index : the number of chunks, then for each one its BOX_TEST parameters and the address of its CallList
+        self.label(writer , name)
+        writer.write( "\t.word %d\n" % ( len(chunks) ) )
+        for chunk_name , box , nb_params , cmdpacks in chunks :
+            writer.write( "\t.word 0x%08X , 0x%08X , 0x%08X , %s\n" % ( box[0] & 0xFFFFFFFF , box[1] & 0xFFFFFFFF , box[2] & 0xFFFFFFFF , chunk_name ) )
+        self.end(writer , name)
+
+
+class _nds_emitter_hex (object) :
+    """C-style const u32 array of the packed words as hex literals, one command pack per line"""
+    __slots__ = 'comments'
+    extension = ".h"
+    description = "C-Style Hex Format"
+
+    def __init__(self,comments=0):
+        self.comments = comments #Do we write the command names next to the words of each pack?
+
+    def format_count(self,nb_params,width=0):
+        return ( "%-*d" % ( width , nb_params ) )
+
+    def declare(self,writer,type,name):
+        writer.write( "const %s %s[] __attribute__((aligned(4))) = {\n" % ( type , name ) )
+
+    def begin(self,writer,name,nb_params,width=0):
+        self.declare(writer , "u32" , name)
+        writer.write( "\t" )
+        writer.count_offset = writer.size
+        writer.write( "%s,\n" % ( self.format_count(nb_params , width) ) )
+
+    def write_pack(self,writer,commands):
+        c = commands
+        words = [ c[0].cmd | (c[1].cmd << 8) | (c[2].cmd << 16) | (c[3].cmd << 24) ]
+        for i in c:
+            words.extend( i.get_words() )
+        line = "\t%s," % ( ",".join([ "0x%08X" % (w & 0xFFFFFFFF) for w in words ]) )
+        if (self.comments) : line = "%-72s /* %s %s %s %s */" % ( line , c[0].name , c[1].name , c[2].name , c[3].name )
+        writer.write( line + "\n" )
+
+    def end(self,writer,name):
+        writer.write( "};\n" )
+
+    def write_matrix(self,writer,name,matrix):
+        """The 12 f32 parameters of MTX_MULT_4x3 giving back the Blender coordinates, as <name>_matrix"""
+        self.declare(writer , "s32" , name + "_matrix")
+        for i in range(0 , 12 , 3) :
+            writer.write( "\t%d,%d,%d,\n" % tuple(matrix[i:i+3]) )
+        self.end(writer , name)
+
+    def write_distances(self,writer,name,distances):
+        """The distance (f32) from which each level of detail is used, as <name>_distance"""
+        self.declare(writer , "s32" , name + "_distance")
+        writer.write( "\t%s,\n" % ( ",".join([ "%d" % d for d in distances ]) ) )
+        self.end(writer , name)
+
+    def write_textures(self,writer,name,textures):
+        """The texture number of each CallList (-1 without texture), as <name>_texture"""
+        self.declare(writer , "s32" , name + "_texture")
+        writer.write( "\t%s,\n" % ( ",".join([ "%d" % t for t in textures ]) ) )
+        self.end(writer , name)
+
+    def write_chunks(self,writer,name,chunks):
+        """CallLists of chunks, a list of (name , BOX_TEST words , parameter count , pack list), then their index"""
+        for chunk_name , box , nb_params , cmdpacks in chunks :
+            self.begin(writer , chunk_name , nb_params)
+            cmdpacks.write_pack(self , writer)
+            self.end(writer , chunk_name)
+
+        writer.write( "const u32 %s_nb_chunks = %d;\n" % ( name , len(chunks) ) )
+        self.declare(writer , "u32" , name + "_box")
+        for chunk_name , box , nb_params , cmdpacks in chunks :
+            writer.write( "\t0x%08X,0x%08X,0x%08X,\n" % ( box[0] & 0xFFFFFFFF , box[1] & 0xFFFFFFFF , box[2] & 0xFFFFFFFF ) )
+        self.end(writer , name)
+        writer.write( "const u32 * const %s[] = {\n" % ( name ) )
+        for chunk_name , box , nb_params , cmdpacks in chunks :
+            writer.write( "\t%s,\n" % ( chunk_name ) )
+        self.end(writer , name)
+
+
+EMITTERS = {
+    EXPORT_OPTIONS['FORMAT_BINARY'] : _nds_emitter_binary() ,
+    EXPORT_OPTIONS['FORMAT_TEXT']   : _nds_emitter_text() ,
+    EXPORT_OPTIONS['FORMAT_ASM']    : _nds_emitter_asm() ,
+    EXPORT_OPTIONS['FORMAT_HEX']    : _nds_emitter_hex() ,
+    EXPORT_OPTIONS['FORMAT_HEX_COMMENTS'] : _nds_emitter_hex(1)
+}
+
+
 class _nds_cmdpack_list (object):
     __slots__ = 'list'
 
@@ -474,13 +1785,11 @@ class _nds_cmdpack_list (object):
         return ( nb )
 
     def terminate(self):
-        self.list[-1].terminate()
+        return ( self.list[-1].terminate() )
 
-    def get_pack(self,format):
-        str = ""
+    def write_pack(self,emitter,writer):
         for cp in self.list:
-            str += cp.get_pack(format)
-        return ( str )
+            cp.write_pack(emitter,writer)
 
     def __str__(self):
         str = "COMMAND_PACK LIST\n"
@@ -489,190 +1798,1470 @@ class _nds_cmdpack_list (object):
         return ( str )
 
 
-class _nds_mesh (object) :
-    __slots__ = 'name', 'quads' , 'triangles' , 'texture' , 'cmdpack_list' , 'cmdpack_count' , 'options', 'final_cmdpack'
+# a _nds_cmdpack_stream can replace a _nds_cmdpack_list : every pack is written
+# by the emitter as soon as it holds 4 commands and then forgotten, only the
+# parameter count is kept.
+class _nds_cmdpack_stream (object):
+    __slots__ = 'emitter' , 'writer' , 'stats' , 'pack' , 'nb_packs' , 'nb_params'
+
+    def __init__(self,emitter,writer,stats):
+        self.emitter = emitter
+        self.writer = writer
+        self.stats = stats
+        self.pack = _nds_cmdpack()
+        self.nb_packs = 0
+        self.nb_params = 0
+
+    def add(self,cmd):
+        self.pack.add(cmd)
+        if ( self.pack.len() == 4 ) : self.flush()
+
+    def flush(self):
+        self.nb_params += self.pack.get_nb_param()
+        self.pack.write_pack(self.emitter , self.writer)
+        self.stats.count_pack(self.pack.commands)
+        self.nb_packs += 1
+        self.pack = _nds_cmdpack()
 
+    def len(self):
+        return ( self.nb_packs + (self.pack.len() > 0) )
+
+    def get_nb_params(self):
+        return ( self.nb_params + self.pack.get_nb_param() )
+
+    def terminate(self):
+        if ( self.pack.len() == 0 and self.nb_packs > 0 ) : return ( 0 )
+        nb = self.pack.terminate()
+        self.flush()
+        return ( nb )
+
+
+# a _nds_gpu_simulator decodes a command stream the way the DS geometry engine
+# does and lists the polygons it draws, each one as its vertices with the
+# position and the color, normal and texture coordinates latched for them.
+class _nds_gpu_simulator (object):
+    __slots__ = 'size' , 'strip' , 'vertices' , 'nb_vertices' , 'polygons' , 'position' , 'attributes'
+
+    def __init__(self):
+        self.size = 0
+        self.strip = 0
+        self.vertices = []
+        self.nb_vertices = 0
+        self.polygons = []
+        self.position = ( 0 , 0 , 0 )
+        self.attributes = {}
+
+    def decode_vertex(self,cmd,words):
+        x , y , z = self.position
+        w = words[0]
+        if (cmd == FIFO_VERTEX16) : return ( sign16(w) , w >> 16 , sign16(words[1]) )
+        if (cmd == FIFO_VERTEX_XY) : return ( sign16(w) , w >> 16 , z )
+        if (cmd == FIFO_VERTEX_XZ) : return ( sign16(w) , y , w >> 16 )
+        if (cmd == FIFO_VERTEX_YZ) : return ( x , sign16(w) , w >> 16 )
+        a , b , c = [ (((w >> s) + 0x200) & 0x3FF) - 0x200 for s in (0 , 10 , 20) ]
+        if (cmd == FIFO_VERTEX10) : return ( a << 6 , b << 6 , c << 6 )
+        return ( x + a , y + b , z + c )
+
+    def run(self,command):
+        cmd = command.cmd
+        if (cmd == FIFO_BEGIN) :
+            begin = command.get_words()[0]
+            self.size = 3 + (begin & 1)
+            self.strip = begin >= 2
+            self.vertices = []
+            self.nb_vertices = 0
+        elif (cmd in (FIFO_COLOR , FIFO_NORMAL , FIFO_TEX_COORD)) :
+            self.attributes[cmd] = command.get_words()[0]
+        elif (cmd >= FIFO_VERTEX16 and cmd <= FIFO_DIFF) :
+            self.position = self.decode_vertex(cmd , command.get_words())
+            a = self.attributes
+            self.vertices.append( ( self.position , a.get(FIFO_COLOR) , a.get(FIFO_NORMAL) , a.get(FIFO_TEX_COORD) ) )
+            self.nb_vertices += 1
+            self.add_polygon()
+
+    def add_polygon(self):
+        v = self.vertices
+        if (not self.strip) :
+            if (len(v) == self.size) :
+                self.polygons.append( tuple(v) )
+                self.vertices = []
+        elif (self.size == 3) :
+            if (len(v) == 3) :
+                #odd triangles of a strip have their first two vertices swapped
+                if (self.nb_vertices % 2 == 1) : self.polygons.append( ( v[0] , v[1] , v[2] ) )
+                else : self.polygons.append( ( v[1] , v[0] , v[2] ) )
+                del v[0]
+        elif (len(v) == 4) :
+            self.polygons.append( ( v[0] , v[1] , v[3] , v[2] ) )
+            del v[0:2]
+
+    def is_complete(self):
+        """Tell if the vertices sent since the BEGIN only made whole polygons"""
+        return ( len(self.vertices) == 0 )
+
+
+# a _nds_cmdpack_scheduler stands in front of a _nds_cmdpack_list or a
+# _nds_cmdpack_stream and chooses what goes into the packs. Since every command
+# takes one of the 4 slots of a pack and only the last pack is padded with NOPs,
+# filling the packs in order already gives the fewest packs for a given set of
+# commands : moving attributes around inside their vertex group cannot save a
+# word. The words are saved by leaving out the commands the GPU does not need :
+# FIFO_END, which does nothing on the DS, and a BEGIN of GL_TRIANGLES or GL_QUADS
+# following whole polygons of the same type. Both streams are decoded by a
+# _nds_gpu_simulator and the polygons drawn are compared as they come.
+class _nds_cmdpack_scheduler (object):
+    __slots__ = 'target' , 'begin' , 'naive' , 'scheduled' , 'nb_commands' , 'nb_params' , 'dropped' , 'mismatches'
+
+    def __init__(self,target):
+        self.target = target
+        self.begin = None
+        self.naive = _nds_gpu_simulator()
+        self.scheduled = _nds_gpu_simulator()
+        self.nb_commands = 0
+        self.nb_params = 0
+        self.dropped = {}
+        self.mismatches = 0
+
+    def add(self,cmd):
+        self.nb_commands += 1
+        self.nb_params += cmd.get_nb_val()
+        self.naive.run(cmd)
+
+        drop = 0
+        if (cmd.cmd == FIFO_END) :
+            drop = 1
+        elif (cmd.cmd == FIFO_BEGIN) :
+            drop = ( cmd.begin_opt == self.begin and cmd.begin_opt in ('GL_TRIANGLES' , 'GL_QUADS') and self.scheduled.is_complete() )
+            self.begin = cmd.begin_opt
+
+        if (drop) :
+            self.dropped[cmd.name] = self.dropped.get(cmd.name , 0) + 1
+        else :
+            self.scheduled.run(cmd)
+            self.target.add(cmd)
+
+        if (self.naive.polygons != self.scheduled.polygons) : self.mismatches += 1
+        self.naive.polygons = []
+        self.scheduled.polygons = []
+
+    def terminate(self):
+        return ( self.target.terminate() )
+
+    def get_saved_words(self):
+        """Words saved over the naive packing, once terminated"""
+        return ( (self.nb_commands + 3) / 4 + self.nb_params + (self.nb_commands == 0) - self.target.get_nb_params() )
+
+    def __str__(self):
+        names = self.dropped.keys()
+        names.sort()
+        dropped = " , ".join([ "%s=%d" % (n , self.dropped[n]) for n in names ])
+        if (self.mismatches) : check = "%d MISMATCHES" % (self.mismatches)
+        else : check = "same polygons"
+        return "Pack scheduler : dropped %s , %d words saved , checked against the naive order : %s" % (dropped or "nothing" , self.get_saved_words() , check)
+
+
+def json_string(value,indent="") :
+    """JSON text of value made of dicts, lists, strings and numbers, where the json module is missing"""
+    if (isinstance(value , dict)) :
+        keys = value.keys()
+        keys.sort()
+        items = [ "%s  %s : %s" % (indent , json_string(str(k)) , json_string(value[k] , indent + "  ")) for k in keys ]
+        if (len(items) == 0) : return ( "{}" )
+        return ( "{\n%s\n%s}" % (",\n".join(items) , indent) )
+    if (isinstance(value , (list , tuple))) :
+        return ( "[%s]" % (" , ".join([ json_string(v , indent) for v in value ])) )
+    if (value == None) :
+        return ( "null" )
+    if (isinstance(value , float)) :
+        return ( "%.6f" % (value) )
+    if (isinstance(value , (int , long))) :
+        return ( "%d" % (value) )
+    return ( '"%s"' % (str(value).replace('\\' , '\\\\').replace('"' , '\\"')) )
+
+# a _nds_export_stats records, when enabled, the wall time spent in each stage
+# of the export of one mesh (faces, encode, cmdpack, write, texture) and the
+# counters which explain the size of its files. It holds no Blender data so the
+# batch worker processes can send it back with their result.
+class _nds_export_stats (object) :
+    __slots__ = 'enabled' , 'mesh_name' , 'times' , 'started' , 'counters'
+
+    def __init__(self,enabled=1,mesh_name=""):
+        self.enabled = enabled
+        self.mesh_name = mesh_name
+        self.times = {}
+        self.started = {}
+        self.counters = {}
+
+    def start(self,stage):
+        if (self.enabled) : self.started[stage] = time.time()
+
+    def stop(self,stage):
+        if (self.enabled) : self.times[stage] = self.times.get(stage , 0.0) + time.time() - self.started.pop(stage)
+
+    def add(self,name,n=1):
+        if (self.enabled) : self.counters[name] = self.counters.get(name , 0) + n
+
+    def add_time(self,stage,seconds):
+        """Add the seconds a stage took elsewhere, on a worker thread"""
+        if (self.enabled) : self.times[stage] = self.times.get(stage , 0.0) + seconds
+
+    def count_pack(self,commands):
+        """Count one pack and its commands by opcode name"""
+        if (not self.enabled) : return
+        counts = self.counters.setdefault('commands' , {})
+        for c in commands :
+            counts[c.name] = counts.get(c.name , 0) + 1
+        self.add('packs')
+
+    def count_commands(self,cmdpack_list):
+        for cp in cmdpack_list.list :
+            self.count_pack(cp.commands)
+
+    def count_files(self,name,paths):
+        """Add the size of the files written at paths to the counter name"""
+        for path in paths :
+            if (os.path.isfile(path)) : self.add(name , os.path.getsize(path))
+
+    def save(self,path):
+        report = { 'mesh' : self.mesh_name , 'times' : self.times , 'counters' : self.counters }
+        f = open(path , "w")
+        try:
+            if (json != None) : json.dump(report , f , indent=2 , sort_keys=True)
+            else : f.write( json_string(report) )
+            f.write( "\n" )
+        finally:
+            f.close()
+
+    def __str__(self):
+        stages = [ "%s=%.3fs" % (k , self.times[k]) for k in ('faces' , 'lod' , 'encode' , 'cmdpack' , 'write' , 'compress' , 'texture') if self.times.has_key(k) ]
+        c = self.counters
+        text = "Export report [%s] : %s , %d packs , %d NOPs , %d parameter words , %d bytes" % (self.mesh_name , " ".join(stages) , c.get('packs' , 0) , c.get('nops' , 0) , c.get('params' , 0) , c.get('mesh_bytes' , 0) + c.get('texture_bytes' , 0))
+        if (c.has_key('compressed_bytes')) : text += " , CallList compressed into %d bytes" % (c['compressed_bytes'])
+        return ( text )
+
+
+# a _nds_mesh_snapshot copies out of Blender everything the encoder needs : the
+# export options and the face-corner attributes. It holds no Blender data, so
+# it can be sent to another process to be encoded there.
+class _nds_mesh_snapshot (object) :
+    __slots__ = 'options' , 'quads' , 'triangles' , 'stats' , 'position_range' , 'quad_groups' , 'triangle_groups'
 
     def __init__(self,mesh_options):
+        if (mesh_options.material_lists) : mesh_options.list_materials()
+        self.options = mesh_options.get_snapshot()
+        self.quads = _nds_mesh_attributes()
+        self.triangles = _nds_mesh_attributes()
+        self.quad_groups = []
+        self.triangle_groups = []
+        self.position_range = None
+        self.stats = _nds_export_stats(mesh_options.export_report , mesh_options.mesh_name)
+        self.stats.start('faces')
+        self.get_faces(mesh_options.mesh_data)
+        if (mesh_options.material_lists) : self.get_face_groups(mesh_options)
+        self.stats.stop('faces')
+        self.stats.add('quads' , len(self.quads) / 4)
+        self.stats.add('triangles' , len(self.triangles) / 3)
+        self.stats.add('skipped_faces' , len(mesh_options.mesh_data.faces) - len(self.quads) / 4 - len(self.triangles) / 3)
+
+    def get_faces(self,blender_mesh):
+        for face in blender_mesh.faces :
+            #we process the face only if this is a quad
+            if (len(face) == 4) :
+                self.quads.append_face(face , self.options)
+            #we process the face only if this is a triangle
+            elif (len(face) == 3) :
+                self.triangles.append_face(face , self.options)
+
+    def get_face_groups(self,mesh_options):
+        """Index in material_groups of every quad and triangle"""
+        material_images = mesh_options.get_material_images()
+        groups = {}
+        for i in range( len(mesh_options.material_groups) ) :
+            groups[ mesh_options.material_groups[i][:2] ] = i
+        for face in mesh_options.mesh_data.faces :
+            if (len(face) == 4) :
+                self.quad_groups.append( groups[ mesh_options.get_face_key(face , material_images) ] )
+            elif (len(face) == 3) :
+                self.triangle_groups.append( groups[ mesh_options.get_face_key(face , material_images) ] )
+
+    def update_hash(self,h):
+        self.quads.update_hash(h)
+        self.triangles.update_hash(h)
+        if (self.options.material_lists) : h.update( repr( (self.quad_groups , self.triangle_groups) ) )
+
+    def get_chunk(self,quad_faces,triangle_faces):
+        """Snapshot of the quads and triangles listed in quad_faces and triangle_faces"""
+        snapshot = object.__new__(_nds_mesh_snapshot)
+        snapshot.options = self.options
+        snapshot.quads = self.quads.get_subset(quad_faces , 4)
+        snapshot.triangles = self.triangles.get_subset(triangle_faces , 3)
+        snapshot.stats = _nds_export_stats(self.stats.enabled)
+        snapshot.position_range = self.get_position_range()
+        return ( snapshot )
+
+    def get_frame(self,positions,normals):
+        """Snapshot of the same faces, with the positions and normals of each corner taken from the (corners,3) arrays positions and normals"""
+        nb_quad_corners = len(self.quads)
+        snapshot = object.__new__(_nds_mesh_snapshot)
+        snapshot.options = self.options
+        snapshot.quads = self.quads.get_frame(positions[:nb_quad_corners] , normals[:nb_quad_corners])
+        snapshot.triangles = self.triangles.get_frame(positions[nb_quad_corners:] , normals[nb_quad_corners:])
+        snapshot.stats = _nds_export_stats(self.stats.enabled)
+        snapshot.position_range = self.position_range
+        return ( snapshot )
+
+    def get_position_range(self):
+        """(offset , scale) fitting the whole mesh into the 4.12 range, None without range fitting"""
+        if (self.options.range_fit and self.position_range == None) :
+            bounds = [ f.get_bounds() for f in (self.quads , self.triangles) if len(f) > 0 ]
+            if (len(bounds) > 0) :
+                low , high = merge_bounds(bounds)
+                self.position_range = fit_position_range(low , high , self.options.get_fit_limit())
+        return ( self.position_range )
+
+
+class _nds_mesh (object) :
+    __slots__ = 'name', 'quads' , 'triangles' , 'texture' , 'cmdpack_list' , 'cmdpack_count' , 'options', 'final_cmdpack' , 'gpu_state' , 'vertex_packer' , 'stats' , 'position_range' , 'quantization'
+
+
+    def __init__(self,mesh_options,snapshot=None):
         print mesh_options
         self.options = mesh_options
-        self.quads = []
-        self.triangles = []
         self.cmdpack_list = _nds_cmdpack_list()
         print self.cmdpack_list
         self.cmdpack_count = 0
+        self.gpu_state = _nds_gpu_state(mesh_options.state_elision)
+        self.vertex_packer = _nds_vertex_packer(mesh_options.vertex_packing , mesh_options.vertex_tolerance)
         
 
         self.name = mesh_options.mesh_name
-        self.get_faces(mesh_options.mesh_data)
-        #self.rescale_mesh(mesh_options.mesh_data)
-
+        if (snapshot == None) : snapshot = _nds_mesh_snapshot(mesh_options)
+        self.quads = snapshot.quads
+        self.triangles = snapshot.triangles
+        self.stats = snapshot.stats
+        self.position_range = snapshot.get_position_range()
+        self.quantization = self.get_quantization()
+
+        #all the packed words are computed at once
+        self.stats.start('encode')
+        self.quads.encode(self.options.texture_w , self.options.texture_h , self.position_range , self.quantization , self.options.get_lighting())
+        self.triangles.encode(self.options.texture_w , self.options.texture_h , self.position_range , self.quantization , self.options.get_lighting())
+        self.stats.stop('encode')
+        self.end_quantization()
+
+        self.stats.start('cmdpack')
+        if (self.options.face_reorder) :
+            self.quads = self.reorder_faces(self.quads , 4)
+            self.triangles = self.reorder_faces(self.triangles , 3)
         self.prepare_cmdpack()
-        self.construct_cmdpack()
+        self.stats.stop('cmdpack')
+        self.stats.count_commands(self.cmdpack_list)
 
     def save_tex(self) :
-        try:
-            import PIL.Image
-        except ImportError :
-            print "Python Imaging Library not installed"
-        else :
-            print self.options.texture_data[0].filename
-            print Blender.sys.expandpath(self.options.texture_data[0].filename)
-            if (self.options.texture_data[0].packed ) : self.options.texture_data[0].unpack(Blender.UnpackModes.USE_LOCAL)
-            img = PIL.Image.open(Blender.sys.expandpath(self.options.texture_data[0].getFilename()))
-            img_rgb = img.convert("RGB")
-            img_pal = img_rgb.convert("P",palette=PIL.Image.ADAPTIVE)
-            img_res = img_pal.resize((self.options.texture_w,self.options.texture_h) )
-            img_res.save(self.options.get_final_path_tex())
-
+        self.stats.start('texture')
+        self.options.save_tex()
+        self.stats.stop('texture')
+        self.stats.count_files('texture_bytes' , self.options.get_final_paths_tex())
+
+    def get_quantization(self):
+        """Accumulator of the quantization errors when they are reported, None otherwise"""
+        if (self.options.range_fit or self.stats.enabled) : return ( _nds_quantization_error() )
+        return ( None )
+
+    def end_quantization(self):
+        if (self.quantization == None) : return
+        print self.quantization
+        if (self.stats.enabled) : self.stats.counters['quantization'] = self.quantization.get_report()
+
+    def get_box(self):
+        """BOX_TEST parameters enclosing every vertex sent"""
+        low = []
+        high = []
+        for face_list in (self.quads , self.triangles) :
+            if (len(face_list) == 0) : continue
+            w = face_list.vertex_words
+            xyz = array( [ ((w[:,0] + 0x8000) & 0xFFFF) - 0x8000 , w[:,0] >> 16 , ((w[:,1] + 0x8000) & 0xFFFF) - 0x8000 ] )
+            low.append( minimum.reduce(xyz , 1) )
+            high.append( maximum.reduce(xyz , 1) )
+        if (len(low) == 0) : return ( ( 0 , 0 , 0 ) )
+
+        #FIFO_VERTEX10 may move a vertex by the tolerance allowed
+        margin = self.vertex_packer.tolerance
+        low = minimum.reduce(array(low)) - margin
+        size = maximum.reduce(array(high)) + margin - low
+        x , y , z = [ max(-0x8000 , int(c)) for c in low ]
+        w , h , d = [ min(0x7FFF , int(c)) for c in size ]
+        if (max(size) > 0x7FFF) :
+            print "!!!Warning : a part of %s is too large for BOX_TEST (8.0), its box is clipped : use a smaller chunk size!!!" % (self.name)
+        return ( ( int(VERTEX_PACK(x & 0xFFFF , y)) , int(VERTEX_PACK(z & 0xFFFF , w)) , int(VERTEX_PACK(h , d)) ) )
+
+    def get_matrix(self):
+        """MTX_MULT_4x3 parameters (f32) bringing the fitted coordinates back to the Blender ones"""
+        offset , scale = self.position_range
+        return ( [ scale , 0 , 0 , 0 , scale , 0 , 0 , 0 , scale ] + offset )
+
+    def get_exported(self,face_list):
+        """(normals , texture coordinates , colors) : which attributes of face_list are exported"""
+        #with the lighting baked into the colors, the normals are useless
+        return ( ( self.options.normals_export and not self.options.light_bake ,
+                   self.options.uv_export and len(face_list.uvs) > 0 ,
+                   (self.options.color_export or self.options.light_bake) and len(face_list.colors) > 0 ) )
+
+    def get_columns(self,face_list):
+        """Python lists of the columns of face_list, None for the attributes which are not exported"""
+        normals , uvs , colors = self.get_exported(face_list)
+        columns = {
+            'positions' : face_list.positions.tolist() ,
+            'vertex_words' : face_list.vertex_words.tolist() ,
+            'normals' : None , 'normal_words' : None ,
+            'uvs' : None , 'uv_mask' : None , 'texcoord_words' : None ,
+            'colors' : None , 'color_words' : None
+        }
+        if (normals) :
+            columns['normals'] = face_list.normals.tolist()
+            columns['normal_words'] = face_list.normal_words.tolist()
+        if (uvs) :
+            columns['uvs'] = face_list.uvs.tolist()
+            columns['uv_mask'] = face_list.uv_mask
+            columns['texcoord_words'] = face_list.texcoord_words.tolist()
+        if (colors) :
+            columns['colors'] = face_list.colors.tolist()
+            columns['color_words'] = face_list.color_words.tolist()
+        return ( columns )
+
+    def get_corner_keys(self,columns):
+        """One key per face-corner : two corners with the same key send exactly the same commands"""
+        keys = []
+        vertex_words = columns['vertex_words']
+        normal_words = columns['normal_words']
+        texcoord_words = columns['texcoord_words']
+        uv_mask = columns['uv_mask']
+        color_words = columns['color_words']
+        for i in range( len(vertex_words) ) :
+            key = ( vertex_words[i][0] , vertex_words[i][1] )
+            if ( normal_words != None ) : key += ( normal_words[i] , )
+            if ( texcoord_words != None ) : key += ( texcoord_words[i] if uv_mask[i] else None , )
+            if ( color_words != None ) : key += ( color_words[i] , )
+            keys.append(key)
+        return ( keys )
+
+    def get_state_words(self,face_list):
+        """Lists of the words of the exported normals, texture coordinates and colors of face_list, None for the corners without texture coordinates"""
+        normals , uvs , colors = self.get_exported(face_list)
+        words = []
+        if (normals) : words.append( face_list.normal_words.tolist() )
+        if (uvs) : words.append( [ (w if mask else None) for w , mask in zip(face_list.texcoord_words.tolist() , face_list.uv_mask) ] )
+        if (colors) : words.append( face_list.color_words.tolist() )
+        return ( words )
+
+    def get_face_order(self,face_list,size,words):
+        """Corners of face_list, face after face, in an order where each face starts with the attributes the previous one ends with as often as possible"""
+        if (len(words) > 0) : states = zip(*words)
+        else : states = [ () ] * len(face_list)
+        #faces in the order of the Morton code of their center : the next one when no face goes on with the current attributes
+        spatial = argsort( morton_codes( face_list.get_centroids(size) ) ).tolist()
+        starts = {}
+        for f in spatial :
+            for j in range(size) :
+                starts.setdefault(states[f * size + j] , []).append( (f , j) )
+        for faces in starts.values() :
+            faces.reverse()
+
+        done = [ 0 ] * len(spatial)
+        order = []
+        next_spatial = 0
+        state = None
+        for n in range( len(spatial) ) :
+            start = None
+            faces = starts.get(state)
+            while (faces) :
+                f , j = faces.pop()
+                if (not done[f]) :
+                    start = ( f , j )
+                    break
+            if (start == None) :
+                while (done[spatial[next_spatial]]) : next_spatial += 1
+                start = ( spatial[next_spatial] , 0 )
+            f , j = start
+            done[f] = 1
+            #the corners turn around the face, its winding is kept
+            corners = [ f * size + (j + k) % size for k in range(size) ]
+            order.extend(corners)
+            state = states[corners[-1]]
+        return ( order )
+
+    def count_skippable(self,words):
+        """(attribute commands a state elision can skip , attribute commands) for the corners in the order of words"""
+        skippable = 0
+        total = 0
+        for column in words :
+            #the corners without texture coordinates send nothing
+            column = [ w for w in column if w != None ]
+            skippable += len( [ 1 for previous , w in zip(column , column[1:]) if w == previous ] )
+            total += len(column)
+        return ( ( skippable , total ) )
+
+    def reorder_faces(self,face_list,size):
+        """face_list with its faces reordered, or face_list itself when its own order already skips more attribute commands"""
+        if (len(face_list) == 0) : return ( face_list )
+        words = self.get_state_words(face_list)
+        before , total = self.count_skippable(words)
+        order = self.get_face_order(face_list , size , words)
+        after , total = self.count_skippable( [ [ column[i] for i in order ] for column in words ] )
+        if (after > before) : face_list = face_list.get_reordered(order)
+        else : after = before
+        if (total > 0) : print "Face order : %d%% of the attribute commands can be skipped instead of %d%%" % (100 * after / total , 100 * before / total)
+        self.stats.add('attribute_commands' , total)
+        self.stats.add('skippable_attribute_commands' , after)
+        self.stats.add('skippable_attribute_commands_unordered' , before)
+        return ( face_list )
+
+    def count_words(self,columns,lists):
+        """Parameter words (command packs included) needed to send each list of corners between BEGIN/END"""
+        nb_commands = 2 * len(lists)
+        nb_vals = len(lists)
+        per_corner = 1 + ( columns['normal_words'] != None ) + ( columns['color_words'] != None )
+        for corners in lists :
+            for i in corners :
+                nb_commands += per_corner
+                nb_vals += per_corner + 1
+                if ( columns['texcoord_words'] != None and columns['uv_mask'][i] ) :
+                    nb_commands += 1
+                    nb_vals += 1
+        return ( (nb_commands + 3) / 4 + nb_vals )
+
+    def prepare_primitive_list(self,begin_opt,columns,corners):
+        #Begin the primitive list
+        self.cmdpack_list.add( _nds_cmdpack_begin(begin_opt) )
+        self.vertex_packer.reset()
+
+        self.prepare_corners(columns,corners)
+
+        #End the primitive list
+        self.cmdpack_list.add( _nds_cmdpack_end() )
+
+    def prepare_corners(self,columns,corners):
+        positions = columns['positions']
+        vertex_words = columns['vertex_words']
+        normals = columns['normals']
+        normal_words = columns['normal_words']
+        uvs = columns['uvs']
+        uv_mask = columns['uv_mask']
+        texcoord_words = columns['texcoord_words']
+        colors = columns['colors']
+        color_words = columns['color_words']
+        state = self.gpu_state
+
+        for i in corners :
+
+            if ( color_words != None and state.changed(FIFO_COLOR , color_words[i]) ) :
+                self.cmdpack_list.add( _nds_cmdpack_color(colors[i] , color_words[i]) )
+
+            if ( texcoord_words != None and uv_mask[i] and state.changed(FIFO_TEX_COORD , texcoord_words[i]) ) :
+                self.cmdpack_list.add( _nds_cmdpack_texture(uvs[i] , texcoord_words[i]) )
+
+            if ( normal_words != None and state.changed(FIFO_NORMAL , normal_words[i]) ) :
+                self.cmdpack_list.add( _nds_cmdpack_normal(normals[i] , normal_words[i]) )
+
+            self.cmdpack_list.add( self.vertex_packer.command(positions[i] , vertex_words[i]) )
+
+    def prepare_primitives(self,face_list,size,list_opt,strip_opt):
+        columns = self.get_columns(face_list)
+        corners = range( len(face_list) )
+
+        if (not self.options.strip_export) :
+            self.prepare_primitive_list(list_opt , columns , corners)
+            return
 
-    def add_nds_mesh_vertex(self,face,face_list):
-        for i, v in enumerate(face.v):
-            nds_mesh_vertex = _nds_mesh_vertex()
-            #we copy vertex's coordinates information
-            nds_mesh_vertex.vertex = _nds_cmdpack_vertex(v.co)
-            #we copy vertex's normals information
-            nds_mesh_vertex.normal = _nds_cmdpack_normal(v.no)
-            #we copy vertex's UV coordinates information only if there is UV layer for the current mesh
-            if (self.options.uv_export) :
-                if (face.uv[i].x >= 0 and face.uv[i].y >= 0):
-                    nds_mesh_vertex.uv = _nds_cmdpack_texture( ( face.uv[i].x * self.options.texture_w , (1-face.uv[i].y) * self.options.texture_h))
-            #we copy vertex's color only if there is Color Layer for the current mesh
-            if (self.options.color_export) :
-                nds_mesh_vertex.color = _nds_cmdpack_color( (face.col[i].r * 32 / 256 , face.col[i].g * 32 / 256, face.col[i].b * 32 / 256) )
-            #finally, we append the nds_mesh_vertex in the quads list
-            face_list.append(nds_mesh_vertex)
+        stripifier = _nds_stripifier(self.get_corner_keys(columns) , size)
+        for strip in stripifier.strips :
+            self.prepare_primitive_list(strip_opt , columns , strip)
+        if ( len(stripifier.leftovers) > 0 ) :
+            self.prepare_primitive_list(list_opt , columns , stripifier.leftovers)
 
-    def get_faces(self,blender_mesh):
-        for face in blender_mesh.faces :
-            #we process the face only if this is a quad
-            if (len(face) == 4) :
-                self.add_nds_mesh_vertex(face,self.quads)
-            #we process the face only if this is a triangle
-            elif (len(face) == 3) :
-                self.add_nds_mesh_vertex(face,self.triangles)
-
-    """TODO : I think there is a need to rescale the mesh because the range in the NDS is [-8.0, 8.0[ but I need to do some tests before"""
-    def rescale_mesh(self,blender_mesh):
-        max_x=max_y=max_z=min_x=min_y=min_z=max_l=0
-        for v in blender_mesh.verts:
-            if v.co[0]>max_x : max_x = v.co[0]
-            elif v.co[0]<min_x : min_x = v.co[0]
-            if v.co[1]>max_y : max_y = v.co[1]
-            elif v.co[1]<min_y : min_y = v.co[1]
-            if v.co[2]>max_z : max_z = v.co[2]
-            elif v.co[2]<min_z : min_z = v.co[2]
-        if (abs(max_x-min_x) > max_l) : max_l = abs(max_x-min_x)
-        if (abs(max_y-min_y) > max_l) : max_l = abs(max_y-min_y)
-        if (abs(max_z-min_z) > max_l) : max_l = abs(max_z-min_z)
-
-        if (len(self.quads)>0):
-            for f in self.quads:
-                v=f.vertex
-                f.vertex.x = v.x/max_l
-                f.vertex.y = v.y/max_l
-                f.vertex.z = v.z/max_l
-        if (len(self.triangles)>0):
-            for f in self.triangles:
-                v=f.vertex
-                f.vertex.x = v.x/max_l
-                f.vertex.y = v.y/max_l
-                f.vertex.z = v.z/max_l
-        print "longueur max = %s" % (max_l)
+        strip_lists = stripifier.strips[:]
+        if ( len(stripifier.leftovers) > 0 ) : strip_lists.append(stripifier.leftovers)
+        print "%s : %d strips (%d faces) + %d faces in %s, %d words instead of %d with %s only" % (strip_opt , len(stripifier.strips) , stripifier.nb_strip_faces , len(stripifier.leftovers) / size , list_opt , self.count_words(columns , strip_lists) , self.count_words(columns , [ corners ]) , list_opt)
 
     def prepare_cmdpack(self):
+        if (self.options.pack_schedule) : self.cmdpack_list = _nds_cmdpack_scheduler(self.cmdpack_list)
+
         #If there is at least 1 quad
         if ( len(self.quads) > 0 ) :
-            #Begin Quads list
-            self.cmdpack_list.add( _nds_cmdpack_begin('GL_QUADS') )
+            self.prepare_primitives(self.quads , 4 , 'GL_QUADS' , 'GL_QUAD_STRIP')
 
-            for i in range( len(self.quads) ) :
+        #If there is at least 1 triangle
+        if ( len(self.triangles) > 0 ) :
+            self.prepare_primitives(self.triangles , 3 , 'GL_TRIANGLES' , 'GL_TRIANGLE_STRIP')
 
-                v = self.quads[i]
+        #Fill the remaining cmd slots with NOP commands
+        self.stats.add('nops' , self.cmdpack_list.terminate())
+        self.end_schedule()
+
+        if (self.gpu_state.enabled) : print self.gpu_state
+        if (self.vertex_packer.enabled) : print self.vertex_packer
+
+    def end_schedule(self):
+        """Report what the pack scheduler saved and give back the packs it filled"""
+        if (not self.options.pack_schedule) : return
+        scheduler = self.cmdpack_list
+        print scheduler
+        self.stats.add('scheduled_words_saved' , scheduler.get_saved_words())
+        self.stats.add('schedule_mismatches' , scheduler.mismatches)
+        self.cmdpack_list = scheduler.target
+
+    def construct_cmdpack(self,out=None):
+        """Write the whole CallList into the file object out, or into final_cmdpack when out is None"""
+        self.stats.start('write')
+        writer = _nds_cmdpack_writer(out)
+        emitter = self.options.get_emitter()
+        nb_params = self.cmdpack_list.get_nb_params()
+
+        emitter.begin(writer , self.options.mesh_name , nb_params)
+        self.cmdpack_list.write_pack(emitter , writer)
+        emitter.end(writer , self.options.mesh_name)
+        if (self.position_range != None) : emitter.write_matrix(writer , self.options.mesh_name , self.get_matrix())
+
+        self.final_cmdpack = writer.getvalue()
+        self.stats.stop('write')
+        self.stats.add('params' , nb_params)
+        self.stats.add('mesh_bytes' , writer.size)
+
+    def save(self,report=1) :
+        f = open(self.options.get_path_mesh(),"w")
+        try:
+            self.construct_cmdpack(f)
+        finally:
+            f.close()
+        #the text formats are compiled into the game : only the binary CallList is compressed
+        if (self.options.format == EXPORT_OPTIONS['FORMAT_BINARY']) : self.compress_files([ self.options.get_path_mesh() ])
 
-                if ( self.options.color_export and v.color != None ) :
-                    self.cmdpack_list.add(v.color)
+        if (self.options.texfile_export) : self.save_tex()
+        if (report) : self.save_report()
 
-                if (self.options.uv_export and v.uv != None) :
-                    self.cmdpack_list.add(v.uv)
+    def compress_files(self,paths):
+        if (not self.options.lz_compression) : return
+        self.stats.start('compress')
+        self.options.compress_files(paths)
+        self.stats.stop('compress')
+        self.stats.count_files('compressed_bytes' , self.options.get_lz_paths(paths))
 
-                if (self.options.normals_export and v.normal != None):
-                    self.cmdpack_list.add(v.normal)
+    def save_report(self):
+        if (not self.stats.enabled) : return
+        self.stats.save(self.options.get_final_path_report())
+        print self.stats
 
-                if (v.vertex != None) :
-                    self.cmdpack_list.add(v.vertex)
-            #End Quads list
-            self.cmdpack_list.add( _nds_cmdpack_end() )
+    def __str__(self):
+        return "NDS Mesh [%s], Faces = %d (Quads=%d, Triangles=%d), Texture=%s" % (self.name,len(self.quads)/4+len(self.triangles)/3,len(self.quads)/4,len(self.triangles)/3,repr((self.options.get_final_path_tex(), self.options.texture_w,self.options.texture_h)) )
 
-        #If there is at least 1 triangle
-        if ( len(self.triangles) > 0 ) :
-            #Begin Triangles list
-            self.cmdpack_list.add( _nds_cmdpack_begin('GL_TRIANGLES') )
 
-            for i in range( len(self.triangles) ) :
+# a _nds_mesh_stream exports a mesh in bounded memory : the faces are read from
+# Blender chunk_size faces at a time, each chunk is encoded and turned into
+# commands which go through a _nds_cmdpack_stream straight into the file. The
+# parameter count is written last, over the placeholder written by the emitter.
+# With strips, faces are only joined inside a chunk.
+class _nds_mesh_stream (_nds_mesh) :
+    __slots__ = 'chunk_size' , 'nb_faces'
 
-                v = self.triangles[i]
+    def __init__(self,mesh_options,chunk_size=4096):
+        print mesh_options
+        self.options = mesh_options
+        self.name = mesh_options.mesh_name
+        self.chunk_size = chunk_size
+        self.nb_faces = { 4 : 0 , 3 : 0 }
+        self.stats = _nds_export_stats(mesh_options.export_report , mesh_options.mesh_name)
+        self.position_range = None
+
+    def get_face_chunks(self,size):
+        """Generator of the corners of the faces having size corners, chunk_size faces at a time"""
+        self.stats.start('faces')
+        chunk = _nds_mesh_attributes()
+        for face in self.options.mesh_data.faces :
+            if (len(face) != size) : continue
+            chunk.append_face(face , self.options)
+            if (len(chunk) == size * self.chunk_size) :
+                self.stats.stop('faces')
+                yield chunk
+                self.stats.start('faces')
+                chunk = _nds_mesh_attributes()
+        self.stats.stop('faces')
+        if (len(chunk) > 0) : yield chunk
+
+    def update_hash(self,h):
+        for size in (4 , 3) :
+            for chunk in self.get_face_chunks(size) :
+                chunk.update_hash(h)
+
+    def get_position_range(self):
+        """(offset , scale) fitting the whole mesh into the 4.12 range, found by a first pass over the faces"""
+        if (not self.options.range_fit) : return ( None )
+        bounds = [ chunk.get_bounds() for size in (4 , 3) for chunk in self.get_face_chunks(size) ]
+        if (len(bounds) == 0) : return ( None )
+        low , high = merge_bounds(bounds)
+        return ( fit_position_range(low , high , self.options.get_fit_limit()) )
+
+    def stream_primitives(self,size,list_opt,strip_opt):
+        started = 0
+        for chunk in self.get_face_chunks(size) :
+            self.nb_faces[size] += len(chunk) / size
+            self.stats.start('encode')
+            chunk.encode(self.options.texture_w , self.options.texture_h , self.position_range , self.quantization , self.options.get_lighting())
+            self.stats.stop('encode')
+
+            self.stats.start('cmdpack')
+            if (self.options.face_reorder) : chunk = self.reorder_faces(chunk , size)
+            if (self.options.strip_export) :
+                self.prepare_primitives(chunk , size , list_opt , strip_opt)
+            else :
+                #a single list for all the chunks, as _nds_mesh does
+                if (not started) :
+                    self.cmdpack_list.add( _nds_cmdpack_begin(list_opt) )
+                    self.vertex_packer.reset()
+                    started = 1
+                self.prepare_corners(self.get_columns(chunk) , range( len(chunk) ))
+            self.stats.stop('cmdpack')
+
+        if (started) : self.cmdpack_list.add( _nds_cmdpack_end() )
+
+    def construct_cmdpack(self,out=None):
+        """Read, encode and write the whole CallList into the file object out, or into final_cmdpack when out is None"""
+        writer = _nds_cmdpack_writer(out)
+        emitter = self.options.get_emitter()
+        self.cmdpack_list = _nds_cmdpack_stream(emitter , writer , self.stats)
+        if (self.options.pack_schedule) : self.cmdpack_list = _nds_cmdpack_scheduler(self.cmdpack_list)
+        self.gpu_state = _nds_gpu_state(self.options.state_elision)
+        self.vertex_packer = _nds_vertex_packer(self.options.vertex_packing , self.options.vertex_tolerance)
+        self.nb_faces = { 4 : 0 , 3 : 0 }
+        self.position_range = self.get_position_range()
+        self.quantization = self.get_quantization()
+
+        emitter.begin(writer , self.options.mesh_name , 0 , COUNT_WIDTH)
+        self.stream_primitives(4 , 'GL_QUADS' , 'GL_QUAD_STRIP')
+        self.stream_primitives(3 , 'GL_TRIANGLES' , 'GL_TRIANGLE_STRIP')
+        self.stats.add('nops' , self.cmdpack_list.terminate())
+        self.end_schedule()
+        self.end_quantization()
+
+        self.stats.start('write')
+        emitter.end(writer , self.options.mesh_name)
+        if (self.position_range != None) : emitter.write_matrix(writer , self.options.mesh_name , self.get_matrix())
+        nb_params = self.cmdpack_list.get_nb_params()
+        writer.patch_count( emitter.format_count(nb_params , COUNT_WIDTH) )
+        self.final_cmdpack = writer.getvalue()
+        self.stats.stop('write')
+
+        self.stats.add('quads' , self.nb_faces[4])
+        self.stats.add('triangles' , self.nb_faces[3])
+        self.stats.add('skipped_faces' , len(self.options.mesh_data.faces) - self.nb_faces[4] - self.nb_faces[3])
+        self.stats.add('params' , nb_params)
+        self.stats.add('mesh_bytes' , writer.size)
+
+        if (self.gpu_state.enabled) : print self.gpu_state
+        if (self.vertex_packer.enabled) : print self.vertex_packer
 
-                if ( self.options.color_export and v.color != None ) :
-                    self.cmdpack_list.add(v.color)
+    def __str__(self):
+        return "NDS Mesh [%s], Faces = %d (Quads=%d, Triangles=%d), Texture=%s" % (self.name,self.nb_faces[4]+self.nb_faces[3],self.nb_faces[4],self.nb_faces[3],repr((self.options.get_final_path_tex(), self.options.texture_w,self.options.texture_h)) )
 
-                if (self.options.uv_export and v.uv != None) :
-                    self.cmdpack_list.add(v.uv)
 
-                if (self.options.normals_export and v.normal != None):
-                    self.cmdpack_list.add(v.normal)
+# a _nds_mesh_chunks splits a mesh into spatial chunks of at most chunk_faces
+# faces : the faces are halved along the longest axis of their centers until
+# every part fits (a k-d tree whose leaves are the chunks). Each chunk is a
+# _nds_mesh of its own, with the bounds of its vertices packed as the 3
+# parameters of the BOX_TEST command, so that the game can skip the chunks out
+# of the view frustum. The emitter writes the CallLists and their index in a
+# single file.
+class _nds_mesh_chunks (_nds_mesh) :
+    __slots__ = 'chunks' , 'boxes'
 
-                if (v.vertex != None) :
-                    self.cmdpack_list.add(v.vertex)
-            #End Quads list
-            self.cmdpack_list.add( _nds_cmdpack_end() )
+    def __init__(self,mesh_options,snapshot=None):
+        print mesh_options
+        self.options = mesh_options
+        self.name = mesh_options.mesh_name
+        if (snapshot == None) : snapshot = _nds_mesh_snapshot(mesh_options)
+        self.quads = snapshot.quads
+        self.triangles = snapshot.triangles
+        self.stats = snapshot.stats
+        self.position_range = snapshot.get_position_range()
+        self.quantization = self.get_quantization()
+
+        self.stats.start('cmdpack')
+        nb_quads = len(self.quads) / 4
+        centroids = concatenate( ( self.quads.get_centroids(4) , self.triangles.get_centroids(3) ) )
+        self.chunks = []
+        self.boxes = []
+        for faces in self.split_faces(centroids , arange(len(centroids)) , max(1 , mesh_options.chunk_faces)) :
+            faces = sort(faces)
+            is_quad = less(faces , nb_quads)
+            chunk = snapshot.get_chunk( compress(is_quad , faces).tolist() , (compress(1 - is_quad , faces) - nb_quads).tolist() )
+            mesh = self.add_part(mesh_options , chunk)
+            self.chunks.append(mesh)
+            self.boxes.append(mesh.get_box())
+        self.stats.stop('cmdpack')
+        self.stats.add('chunks' , len(self.chunks))
+        self.end_quantization()
+
+    def split_faces(self,centroids,faces,budget):
+        """Split the Numeric array of face indexes faces into parts of at most budget faces, in space order"""
+        parts = []
+        stack = [ faces ]
+        while (len(stack) > 0) :
+            faces = stack.pop()
+            if (len(faces) <= budget) :
+                parts.append(faces)
+                continue
+            c = take(centroids , faces)
+            axis = argmax( maximum.reduce(c) - minimum.reduce(c) )
+            faces = take( faces , argsort(c[:,axis]) )
+            half = len(faces) / 2
+            stack.append(faces[half:])
+            stack.append(faces[:half])
+        return ( parts )
+
+    def add_part(self,mesh_options,snapshot):
+        """_nds_mesh of one part of the export, its commands, NOPs and quantization errors added to the whole"""
+        mesh = _nds_mesh(mesh_options , snapshot)
+        self.stats.count_commands(mesh.cmdpack_list)
+        self.stats.add('nops' , mesh.stats.counters.get('nops' , 0))
+        if (mesh.quantization != None) : self.quantization.merge(mesh.quantization)
+        return ( mesh )
+
+    def get_chunk_list(self):
+        """(name , BOX_TEST words , parameter count , pack list) of every chunk, as the emitters write them"""
+        chunks = []
+        for i in range( len(self.chunks) ) :
+            cmdpacks = self.chunks[i].cmdpack_list
+            chunks.append( ( "%s_%d" % (self.name , i) , self.boxes[i] , cmdpacks.get_nb_params() , cmdpacks ) )
+        return ( chunks )
+
+    def construct_cmdpack(self,out=None):
+        """Write the index and the CallList of every chunk into the file object out, or into final_cmdpack when out is None"""
+        self.stats.start('write')
+        writer = _nds_cmdpack_writer(out)
+        emitter = self.options.get_emitter()
+        chunks = self.get_chunk_list()
+        nb_params = 0
+        for chunk in chunks :
+            nb_params += chunk[2]
+        emitter.write_chunks(writer , self.name , chunks)
+        if (self.position_range != None) : emitter.write_matrix(writer , self.name , self.get_matrix())
+        self.final_cmdpack = writer.getvalue()
+        self.stats.stop('write')
+        self.stats.add('params' , nb_params)
+        self.stats.add('mesh_bytes' , writer.size)
 
-        #Fill the remaining cmd slots with NOP commands
-        self.cmdpack_list.terminate()
+    def __str__(self):
+        return "%s in %d chunks" % (_nds_mesh.__str__(self) , len(self.chunks))
 
-    def construct_cmdpack(self):
 
-        self.final_cmdpack = ""
+# a _nds_mesh_materials writes one CallList per material and image of the mesh,
+# indexed as the spatial chunks are, each one with the texture coordinates scaled
+# to its own texture. The texture number of each CallList follows the index (-1
+# without texture) : the game binds its TEXIMAGE_PARAM (and material) before
+# calling it. The CallLists come in the order of material_groups, where every
+# texture is bound once.
+class _nds_mesh_materials (_nds_mesh_chunks) :
+    __slots__ = 'textures'
 
-        if (self.options.format == EXPORT_OPTIONS['FORMAT_TEXT']) :
-            s = "u32 %s[] = {\n%d,\n%s" % ( self.options.mesh_name , self.cmdpack_list.get_nb_params() , self.cmdpack_list.get_pack(self.options.format) )
-            self.final_cmdpack += s[0:-2]
-            self.final_cmdpack += "\n};\n"
-        elif (self.options.format == EXPORT_OPTIONS['FORMAT_BINARY']) :
-            self.final_cmdpack += pack( '<i' , self.cmdpack_list.get_nb_params())
-            self.final_cmdpack += self.cmdpack_list.get_pack(self.options.format)
+    def __init__(self,mesh_options,snapshot=None):
+        print mesh_options
+        self.options = mesh_options
+        self.name = mesh_options.mesh_name
+        if (snapshot == None) : snapshot = _nds_mesh_snapshot(mesh_options)
+        self.quads = snapshot.quads
+        self.triangles = snapshot.triangles
+        self.stats = snapshot.stats
+        self.position_range = snapshot.get_position_range()
+        self.quantization = self.get_quantization()
+
+        self.stats.start('cmdpack')
+        groups = snapshot.options.material_groups
+        names = snapshot.options.get_texture_names()
+        quad_faces = [ [] for g in groups ]
+        triangle_faces = [ [] for g in groups ]
+        for f in range( len(snapshot.quad_groups) ) :
+            quad_faces[ snapshot.quad_groups[f] ].append(f)
+        for f in range( len(snapshot.triangle_groups) ) :
+            triangle_faces[ snapshot.triangle_groups[f] ].append(f)
+        self.chunks = []
+        self.boxes = []
+        self.textures = []
+        for i in range( len(groups) ) :
+            material , name , w , h = groups[i]
+            options = mesh_options.copy()
+            options.texture_w = w
+            options.texture_h = h
+            mesh = self.add_part(options , snapshot.get_chunk(quad_faces[i] , triangle_faces[i]))
+            self.chunks.append(mesh)
+            self.boxes.append(mesh.get_box())
+            if (name == None) : self.textures.append(-1)
+            else : self.textures.append( names.index(name) )
+        self.stats.stop('cmdpack')
+        self.stats.add('material_lists' , len(self.chunks))
+        self.stats.add('texture_switches' , count_switches(self.textures))
+        self.end_quantization()
+
+    def construct_cmdpack(self,out=None):
+        """Write the index and the CallList of every material then their texture numbers into the file object out, or into final_cmdpack when out is None"""
+        self.stats.start('write')
+        writer = _nds_cmdpack_writer(out)
+        emitter = self.options.get_emitter()
+        chunks = self.get_chunk_list()
+        nb_params = 0
+        for chunk in chunks :
+            nb_params += chunk[2]
+        emitter.write_chunks(writer , self.name , chunks)
+        emitter.write_textures(writer , self.name , self.textures)
+        if (self.position_range != None) : emitter.write_matrix(writer , self.name , self.get_matrix())
+        self.final_cmdpack = writer.getvalue()
+        self.stats.stop('write')
+        self.stats.add('params' , nb_params)
+        self.stats.add('mesh_bytes' , writer.size)
 
-        #print self.final_cmdpack
+    def __str__(self):
+        return "%s in %d material CallLists" % (_nds_mesh.__str__(self) , len(self.chunks))
+
+
+# Levels of detail : a level is used once its error, seen from the distance
+# where it starts, is smaller than one pixel of a gluPerspective(LOD_FOV,...)
+# view on the LOD_SCREEN_HEIGHT lines of the DS screen.
+LOD_SCREEN_HEIGHT = 192
+LOD_FOV = 70.0
+#the quadrics of the planes across the border edges weigh this much more than the faces
+LOD_BORDER_WEIGHT = 10.0
+#collapses leaving a vertex in more faces than this are refused, unless one of the two already was
+LOD_MAX_VALENCE = 12
+
+def parse_lod_targets(text) :
+    """[ ('faces' , n) or ('error' , e) ] for each comma separated target of text : a polygon count, or e followed by an error in Blender units"""
+    targets = []
+    for target in text.split(',') :
+        target = target.strip()
+        if (target == "") : continue
+        if (target[0] in "eE") : targets.append( ('error' , float(target[1:])) )
+        else : targets.append( ('faces' , int(target)) )
+    return ( targets )
+
+def lod_distance(error) :
+    """Distance (f32) from which error, in Blender units, is smaller than one pixel"""
+    d = error * LOD_SCREEN_HEIGHT / (2 * tan(radians(LOD_FOV) / 2))
+    return ( min(0x7FFFFFFF , int(d * (1<<12) + .5)) )
+
+def plane_quadric(n,d,w=1.0) :
+    """The 10 distinct terms of the quadric of the plane n.p + d = 0, times w"""
+    a , b , c = n
+    return ( [ w * a * a , w * a * b , w * a * c , w * a * d , w * b * b , w * b * c , w * b * d , w * c * c , w * c * d , w * d * d ] )
+
+def quadric_cost(q,p) :
+    aa , ab , ac , ad , bb , bc , bd , cc , cd , dd = q
+    x , y , z = p
+    return ( max(0.0 , aa*x*x + 2*ab*x*y + 2*ac*x*z + 2*ad*x + bb*y*y + 2*bc*y*z + 2*bd*y + cc*z*z + 2*cd*z + dd) )
+
+def triangle_normal(a,b,c) :
+    u = [ b[i] - a[i] for i in range(3) ]
+    v = [ c[i] - a[i] for i in range(3) ]
+    return ( [ u[1]*v[2] - u[2]*v[1] , u[2]*v[0] - u[0]*v[2] , u[0]*v[1] - u[1]*v[0] ] )
+
+# a _nds_decimator simplifies a mesh by edge collapses ranked with the quadric
+# error metric (Garland and Heckbert). The corners are welded into vertices by
+# position and each vertex gets the sum of the quadrics of the planes of its
+# faces, plus planes across the border edges so that the borders stay in
+# place. The collapse which moves the surface the least comes out of a heap,
+# ties going to the vertices in the fewest faces ; edges holds the entry
+# ranking each edge and the position of its collapse, the other entries are
+# stale and skipped. After a collapse, only
+# the edges around the new vertex whose cost changed are pushed again.
+# Collapses which would flip a face, or leave a vertex in too many faces (on
+# flat parts every collapse costs nothing and would pile up on one vertex),
+# are refused until a collapse next to them ranks them again. Quads are split into two
+# triangles. Faces keep the normal, texture coordinates and color of their
+# corners, only the positions move, inside the box of the mesh.
+class _nds_decimator (object):
+    __slots__ = 'corners' , 'faces' , 'positions' , 'quadrics' , 'face_vertices' , 'vertex_faces' , 'edges' , 'heap' , 'nb_faces' , 'error' , 'low' , 'high'
+
+    def __init__(self,snapshot):
+        self.corners = _nds_mesh_attributes()
+        for column in ('positions' , 'normals' , 'uvs' , 'uv_mask' , 'colors') :
+            setattr( self.corners , column , list(getattr(snapshot.quads , column)) + list(getattr(snapshot.triangles , column)) )
+        nb_quad_corners = len(snapshot.quads)
+        self.faces = [ [ b , b + 1 , b + 2 ] for b in range(0 , nb_quad_corners , 4) ] + [ [ b , b + 2 , b + 3 ] for b in range(0 , nb_quad_corners , 4) ]
+        self.faces += [ [ b , b + 1 , b + 2 ] for b in range(nb_quad_corners , len(self.corners) , 3) ]
+
+        #corners at the same position are the same vertex
+        index = {}
+        self.positions = []
+        corner_vertex = []
+        for p in self.corners.positions :
+            p = tuple(p)
+            if (not index.has_key(p)) :
+                index[p] = len(self.positions)
+                self.positions.append(list(p))
+            corner_vertex.append(index[p])
+        self.face_vertices = [ [ corner_vertex[c] for c in f ] for f in self.faces ]
+        self.vertex_faces = [ {} for p in self.positions ]
+        self.nb_faces = 0
+        for f in range( len(self.faces) ) :
+            fv = self.face_vertices[f]
+            if (fv[0] == fv[1] or fv[1] == fv[2] or fv[2] == fv[0]) :
+                self.face_vertices[f] = None
+                continue
+            for v in fv :
+                self.vertex_faces[v][f] = 1
+            self.nb_faces += 1
+        self.edges = {}
+        self.error = 0.0
+        self.low = [ min([ p[k] for p in self.positions ] or [ 0.0 ]) for k in range(3) ]
+        self.high = [ max([ p[k] for p in self.positions ] or [ 0.0 ]) for k in range(3) ]
+        self.get_quadrics()
+
+        self.heap = []
+        for u in range( len(self.positions) ) :
+            for v in self.neighbours(u) :
+                if (u < v) : self.push(u , v)
+
+    def get_quadrics(self):
+        """Sum of the quadrics of the planes of the faces around each vertex, and across its border edges"""
+        self.quadrics = [ [ 0.0 ] * 10 for p in self.positions ]
+        if (len(self.positions) == 0) : return
+        faces = [ f for f in self.face_vertices if f != None ]
+        P = array(self.positions , Float)
+        p0 = take(P , [ f[0] for f in faces ])
+        e1 = take(P , [ f[1] for f in faces ]) - p0
+        e2 = take(P , [ f[2] for f in faces ]) - p0
+        n = transpose( array( [ e1[:,1] * e2[:,2] - e1[:,2] * e2[:,1] , e1[:,2] * e2[:,0] - e1[:,0] * e2[:,2] , e1[:,0] * e2[:,1] - e1[:,1] * e2[:,0] ] ) )
+        length = sqrt( add.reduce(n * n , 1) )
+        n = n / where( greater(length , 0.0) , length , 1.0 )[:,NewAxis]
+        d = -add.reduce(n * p0 , 1)
+        a , b , c = n[:,0] , n[:,1] , n[:,2]
+        face_quadrics = transpose( array( [ a*a , a*b , a*c , a*d , b*b , b*c , b*d , c*c , c*d , d*d ] ) ).tolist()
+        normals = n.tolist()
+
+        edges = {}
+        for i in range( len(faces) ) :
+            q = face_quadrics[i]
+            for v in faces[i] :
+                vq = self.quadrics[v]
+                for k in range(10) :
+                    vq[k] += q[k]
+            for u , v in ( (faces[i][0] , faces[i][1]) , (faces[i][1] , faces[i][2]) , (faces[i][2] , faces[i][0]) ) :
+                key = ( min(u , v) , max(u , v) )
+                if (edges.has_key(key)) : edges[key] = None
+                else : edges[key] = i
+
+        for (u , v) , i in edges.items() :
+            if (i == None) : continue
+            pu , pv = self.positions[u] , self.positions[v]
+            e = [ pv[k] - pu[k] for k in range(3) ]
+            m = triangle_normal( [ 0.0 , 0.0 , 0.0 ] , e , normals[i] )
+            length = sqrt( m[0]*m[0] + m[1]*m[1] + m[2]*m[2] )
+            if (length == 0.0) : continue
+            m = [ x / length for x in m ]
+            q = plane_quadric(m , -(m[0]*pu[0] + m[1]*pu[1] + m[2]*pu[2]) , LOD_BORDER_WEIGHT)
+            for w in (u , v) :
+                for k in range(10) :
+                    self.quadrics[w][k] += q[k]
+
+    def neighbours(self,u):
+        vertices = {}
+        for f in self.vertex_faces[u].keys() :
+            for v in self.face_vertices[f] :
+                if (v != u) : vertices[v] = 1
+        return ( vertices.keys() )
+
+    def get_collapse(self,q,pu,pv):
+        """Cheapest (cost , position) for the vertex replacing an edge from pu to pv, q being the sum of their quadrics"""
+        candidates = [ pu , pv , [ (pu[k] + pv[k]) / 2 for k in range(3) ] ]
+        aa , ab , ac , ad , bb , bc , bd , cc , cd , dd = q
+        det = aa * (bb*cc - bc*bc) - ab * (ab*cc - bc*ac) + ac * (ab*bc - bb*ac)
+        #the minimum of the quadric, when it is well defined
+        if (abs(det) > 1e-6 * (aa + bb + cc) ** 3) :
+            x = ( -ad * (bb*cc - bc*bc) + ab * (bd*cc - bc*cd) - ac * (bd*bc - bb*cd) ) / det
+            y = ( aa * (-bd*cc + bc*cd) + ad * (ab*cc - bc*ac) + ac * (ab*-cd + bd*ac) ) / det
+            z = ( aa * (-bb*cd + bd*bc) - ab * (-ab*cd + bd*ac) - ad * (ab*bc - bb*ac) ) / det
+            #outside of the box of the mesh, it would make the BOX_TEST of the levels grow out of the 4.12 range
+            if (self.low[0] <= x <= self.high[0] and self.low[1] <= y <= self.high[1] and self.low[2] <= z <= self.high[2]) :
+                candidates.append( [ x , y , z ] )
+        return ( min([ ( quadric_cost(q , p) , p ) for p in candidates ]) )
+
+    def push(self,u,v):
+        """Rank the collapse of the edge u v, unless it keeps the cost it is ranked with"""
+        if (u > v) : u , v = v , u
+        q = [ a + b for a , b in zip(self.quadrics[u] , self.quadrics[v]) ]
+        cost , p = self.get_collapse(q , self.positions[u] , self.positions[v])
+        ranked = self.edges.get( (u , v) )
+        if (ranked != None and ranked[0][0] == cost) :
+            self.edges[u , v] = ( ranked[0] , p )
+            return
+        entry = ( cost , len(self.vertex_faces[u]) + len(self.vertex_faces[v]) , u , v )
+        self.edges[u , v] = ( entry , p )
+        heappush(self.heap , entry)
+
+    def crowds(self,u,v):
+        """True if the vertex replacing u and v would be in more than LOD_MAX_VALENCE faces, and in more than each of them"""
+        fu , fv = self.vertex_faces[u] , self.vertex_faces[v]
+        n = len(fu) + len(fv) - 2 * len([ f for f in fu.keys() if fv.has_key(f) ])
+        return ( n > LOD_MAX_VALENCE and n > max(len(fu) , len(fv)) )
+
+    def flips(self,u,v,p):
+        """True if moving u and v to p turns a face around them upside down"""
+        for w in (u , v) :
+            for f in self.vertex_faces[w].keys() :
+                fv = self.face_vertices[f]
+                if (u in fv and v in fv) : continue
+                points = [ self.positions[x] for x in fv ]
+                before = triangle_normal(*points)
+                points[fv.index(w)] = p
+                after = triangle_normal(*points)
+                if (before[0]*after[0] + before[1]*after[1] + before[2]*after[2] < 0.0) : return ( True )
+        return ( False )
+
+    def collapse(self,u,v,p,cost):
+        """Move u to p and replace v by u in every face, the faces having both disappear"""
+        for w in self.neighbours(v) :
+            self.edges.pop( ( min(v , w) , max(v , w) ) , None )
+        self.positions[u] = p
+        self.quadrics[u] = [ a + b for a , b in zip(self.quadrics[u] , self.quadrics[v]) ]
+        for f in self.vertex_faces[v].keys() :
+            fv = self.face_vertices[f]
+            if (u in fv) :
+                for w in fv :
+                    if (w != v) : del self.vertex_faces[w][f]
+                self.face_vertices[f] = None
+                self.nb_faces -= 1
+            else :
+                fv[fv.index(v)] = u
+                self.vertex_faces[u][f] = 1
+        self.vertex_faces[v] = None
+        self.error = max(self.error , cost)
+        for w in self.neighbours(u) :
+            self.push(u , w)
+
+    def decimate(self,nb_faces=0,max_error=None):
+        """Collapse edges until there are at most nb_faces faces, or until the next collapse moves the surface by more than max_error"""
+        while (self.nb_faces > nb_faces and len(self.heap) > 0) :
+            entry = heappop(self.heap)
+            cost , valence , u , v = entry
+            ranked = self.edges.get( (u , v) )
+            if (ranked == None or ranked[0] is not entry) : continue
+            #an edge ranked before its faces went away
+            if (self.vertex_faces[u] == None or self.vertex_faces[v] == None) : continue
+            if (max_error != None and cost > max_error * max_error) :
+                heappush(self.heap , entry)
+                break
+            del self.edges[u , v]
+            p = ranked[1]
+            if (self.crowds(u , v) or self.flips(u , v , p)) : continue
+            self.collapse(u , v , p , cost)
+
+    def get_error(self):
+        """Largest move of the surface so far, in Blender units"""
+        return ( sqrt(self.error) )
+
+    def get_level(self,snapshot):
+        """Snapshot of the remaining faces, as triangles"""
+        level = object.__new__(_nds_mesh_snapshot)
+        level.options = snapshot.options
+        level.quads = _nds_mesh_attributes()
+        level.triangles = _nds_mesh_attributes()
+        level.stats = _nds_export_stats(snapshot.stats.enabled)
+        level.position_range = None
+        faces = [ f for f in range( len(self.faces) ) if self.face_vertices[f] != None ]
+        corners = [ c for f in faces for c in self.faces[f] ]
+        level.triangles.positions = [ tuple(self.positions[v]) for f in faces for v in self.face_vertices[f] ]
+        level.triangles.normals = [ self.corners.normals[c] for c in corners ]
+        if (len(self.corners.uvs) > 0) :
+            level.triangles.uvs = [ self.corners.uvs[c] for c in corners ]
+            level.triangles.uv_mask = [ self.corners.uv_mask[c] for c in corners ]
+        if (len(self.corners.colors) > 0) :
+            level.triangles.colors = [ self.corners.colors[c] for c in corners ]
+        return ( level )
+
+
+# a _nds_mesh_lods exports the levels of detail of a mesh, from the mesh itself
+# to the coarsest level, each one simplified from the previous one by a
+# _nds_decimator down to its target : a polygon count, or an error. The
+# CallLists are indexed as the spatial chunks are, then come the distances
+# (f32) from which each level can be used, the first one being 0.
+class _nds_mesh_lods (_nds_mesh_chunks) :
+    __slots__ = 'distances'
+
+    def __init__(self,mesh_options,snapshot=None):
+        print mesh_options
+        self.options = mesh_options
+        self.name = mesh_options.mesh_name
+        if (snapshot == None) : snapshot = _nds_mesh_snapshot(mesh_options)
+        self.quads = snapshot.quads
+        self.triangles = snapshot.triangles
+        self.stats = snapshot.stats
+
+        self.stats.start('lod')
+        #the first level is the mesh itself, with statistics of its own as every level
+        nb_polygons = len(self.quads) / 4 + len(self.triangles) / 3
+        levels = [ snapshot.get_chunk( range(len(self.quads) / 4) , range(len(self.triangles) / 3) ) ]
+        errors = [ 0.0 ]
+        decimator = _nds_decimator(snapshot)
+        for kind , value in parse_lod_targets(mesh_options.lod_targets) :
+            if (kind == 'faces') : decimator.decimate(value)
+            else : decimator.decimate(0 , value)
+            #the quads are split into triangles : until there are fewer of them than polygons in the mesh, the level is the mesh
+            if (decimator.nb_faces >= nb_polygons) :
+                levels.append( snapshot.get_chunk( range(len(self.quads) / 4) , range(len(self.triangles) / 3) ) )
+                errors.append( 0.0 )
+                continue
+            levels.append( decimator.get_level(snapshot) )
+            errors.append( decimator.get_error() )
+        self.stats.stop('lod')
+        self.distances = [ lod_distance(e) for e in errors ]
+
+        #the same range for all the levels
+        self.position_range = None
+        if (mesh_options.range_fit) :
+            bounds = [ f.get_bounds() for level in levels for f in (level.quads , level.triangles) if len(f) > 0 ]
+            if (len(bounds) > 0) :
+                low , high = merge_bounds(bounds)
+                self.position_range = fit_position_range(low , high , mesh_options.get_fit_limit())
+        self.quantization = self.get_quantization()
+
+        self.stats.start('cmdpack')
+        self.chunks = []
+        self.boxes = []
+        for level , error in zip(levels , errors) :
+            level.position_range = self.position_range
+            nb_faces = len(level.quads) / 4 + len(level.triangles) / 3
+            print "LOD %d : %d faces , error %f , from %f" % (len(self.chunks) , nb_faces , error , lod_distance(error) / 4096.0)
+            mesh = self.add_part(mesh_options , level)
+            self.chunks.append(mesh)
+            self.boxes.append(mesh.get_box())
+            if (self.stats.enabled) : self.stats.counters.setdefault('lods' , []).append( { 'faces' : nb_faces , 'error' : error } )
+        self.stats.stop('cmdpack')
+        self.end_quantization()
+
+    def construct_cmdpack(self,out=None):
+        """Write the index and the CallList of every level then the distances into the file object out, or into final_cmdpack when out is None"""
+        self.stats.start('write')
+        writer = _nds_cmdpack_writer(out)
+        emitter = self.options.get_emitter()
+        chunks = self.get_chunk_list()
+        nb_params = 0
+        for chunk in chunks :
+            nb_params += chunk[2]
+        emitter.write_chunks(writer , self.name , chunks)
+        emitter.write_distances(writer , self.name , self.distances)
+        if (self.position_range != None) : emitter.write_matrix(writer , self.name , self.get_matrix())
+        self.final_cmdpack = writer.getvalue()
+        self.stats.stop('write')
+        self.stats.add('params' , nb_params)
+        self.stats.add('mesh_bytes' , writer.size)
 
-    def save(self) :
-        f = open(self.options.get_final_path_mesh(),"w")
-        f.write(self.final_cmdpack)
-        f.close();
+    def __str__(self):
+        return "%s in %d levels of detail" % (_nds_mesh.__str__(self) , len(self.chunks))
+
+
+# a _nds_mesh_animation exports the frames anim_start to anim_end of a mesh
+# deformed by its object (armature, shape keys, ...). The positions and normals
+# of the vertices are read once per frame into (frames,vertices,3) arrays, the
+# faces, texture coordinates and colors are shared by every frame.
+# With ANIM_LISTS, each frame is a CallList of its own, indexed as the spatial
+# chunks are, with its BOX_TEST bounds. With ANIM_DELTAS, only the CallList of
+# the first frame is written, with a FIFO_VERTEX16 and a FIFO_NORMAL for every
+# corner, and <mesh>.anim tells the game where their parameters are and how
+# the vertices move, in the fixed-point units of these parameters :
+#   int32 nb_frames , nb_vertices , nb_position_patches , nb_normal_patches
+#   int32 word offset in the CallList (0 is the parameter count) and vertex, for each position then normal patch
+#   int16 x , y , z of every vertex at the first frame, then int16 x , y , z of its normal if there are normal patches
+#   for each next frame : int32 nb_moved , uint16 index of each vertex moved , int16 dx , dy , dz of each one,
+#   then int16 dx , dy , dz of its normal if there are normal patches, padded to 4 bytes
+# The deltas are added modulo 2^16 to the values of the previous frame.
+# With the lighting bake, the normals are not sent : the frames of ANIM_LISTS are
+# lit with their own normals, but ANIM_DELTAS keeps the colors of the first
+# frame for the whole animation, since the .anim file has no colors.
+# Blender cannot delete a mesh : the frames are read into the mesh
+# ANIM_FRAME_MESH, created once and reused by every export. It has no users, so
+# it is not saved with the .blend.
+ANIM_FRAME_MESH = "nds_export_frame"
+
+class _nds_mesh_animation (_nds_mesh_chunks) :
+    __slots__ = 'corner_vertices' , 'nb_frames' , 'base' , 'frame_positions' , 'frame_normals'
 
-        if (self.options.texfile_export) : self.save_tex()
+    def __init__(self,mesh_options):
+        print mesh_options
+        self.options = mesh_options
+        self.name = mesh_options.mesh_name
+        snapshot = _nds_mesh_snapshot(mesh_options)
+        self.quads = snapshot.quads
+        self.triangles = snapshot.triangles
+        self.stats = snapshot.stats
+        self.corner_vertices = self.get_corner_vertices(mesh_options.mesh_data)
+
+        self.stats.start('faces')
+        positions , normals = self.get_frames()
+        self.stats.stop('faces')
+        self.nb_frames = len(positions)
+        self.stats.add('frames' , self.nb_frames)
+        #a single range for all the frames, the matrix is the same for every one
+        if (mesh_options.range_fit) :
+            low , high = position_bounds( reshape(positions , (-1 , 3)) )
+            snapshot.position_range = fit_position_range(low , high , mesh_options.get_fit_limit())
+        self.position_range = snapshot.position_range
+        self.quantization = self.get_quantization()
+
+        self.stats.start('cmdpack')
+        corners = self.corner_vertices
+        self.base = None
+        if (mesh_options.anim_export == EXPORT_OPTIONS['ANIM_LISTS']) :
+            self.chunks = [ self.add_part(mesh_options , snapshot.get_frame( take(positions[i] , corners) , take(normals[i] , corners) )) for i in range(self.nb_frames) ]
+            self.boxes = [ mesh.get_box() for mesh in self.chunks ]
+        else :
+            #every corner sends its own vertex and normal, in the order of the faces, so that the game can patch them
+            options = mesh_options.copy()
+            options.state_elision = EXPORT_OPTIONS['NO_ELIDE_STATE']
+            options.strip_export = EXPORT_OPTIONS['NO_STRIPS']
+            options.vertex_packing = EXPORT_OPTIONS['VERTEX16']
+            options.face_reorder = EXPORT_OPTIONS['NO_REORDER_FACES']
+            self.base = self.add_part(options , snapshot.get_frame( take(positions[0] , corners) , take(normals[0] , corners) ))
+            self.chunks = [ self.base ]
+            self.boxes = []
+            self.cmdpack_list = self.base.cmdpack_list
+            self.frame_positions , self.frame_normals = self.quantize_frames(positions , normals)
+        self.stats.stop('cmdpack')
+        self.end_quantization()
+
+    def get_corner_vertices(self,blender_mesh):
+        """Numeric array of the vertex index of every corner, quads then triangles as in the snapshot"""
+        quads = []
+        triangles = []
+        for face in blender_mesh.faces :
+            if (len(face) == 4) : quads.extend( [ v.index for v in face.v ] )
+            elif (len(face) == 3) : triangles.extend( [ v.index for v in face.v ] )
+        return ( array(quads + triangles , Int) )
+
+    def get_frames(self):
+        """Positions and normals of every vertex at each frame, as two (frames,vertices,3) Numeric arrays"""
+        verts = self.options.mesh_data.verts
+        current = Blender.Get('curframe')
+        frame_mesh = self.get_frame_mesh()
+        positions = []
+        normals = []
+        try:
+            for frame in range(self.options.anim_start , self.options.anim_end + 1) :
+                Blender.Set('curframe' , frame)
+                frame_mesh.getFromObject(self.options.mesh_object)
+                if (len(frame_mesh.verts) != len(verts)) :
+                    print "!!!Warning : %s has %d vertices at frame %d instead of %d : a modifier changes the faces, the animation stops there!!!" % (self.name , len(frame_mesh.verts) , frame , len(verts))
+                    break
+                positions.append( [ tuple(v.co) for v in frame_mesh.verts ] )
+                normals.append( [ tuple(v.no) for v in frame_mesh.verts ] )
+        finally:
+            Blender.Set('curframe' , current)
+
+        if (len(positions) == 0) :
+            positions.append( [ tuple(v.co) for v in verts ] )
+            normals.append( [ tuple(v.no) for v in verts ] )
+        return ( ( array(positions , Float) , array(normals , Float) ) )
+
+    def get_frame_mesh(self):
+        """The scratch mesh ANIM_FRAME_MESH, created by the first export"""
+        try:
+            frame_mesh = Blender.Mesh.Get(ANIM_FRAME_MESH)
+        except NameError :
+            frame_mesh = None
+        if (frame_mesh == None) : frame_mesh = Blender.Mesh.New(ANIM_FRAME_MESH)
+        return ( frame_mesh )
+
+    def quantize_frames(self,positions,normals):
+        """The (frames,vertices,3) arrays of positions and normals as they are sent : Int32 v16 and v10 values"""
+        if (self.position_range != None) : fitted = fit_positions(positions , self.position_range)
+        else : fitted = positions
+        frame_positions = floattov16_array(fitted)
+        frame_normals = floattov10_array(normals)
+        if (self.quantization != None and len(positions) > 1) :
+            #the first frame is measured on the corners of the CallList
+            sent = frame_positions[1:] / 4096.0
+            if (self.position_range != None) :
+                offset , scale = self.position_range
+                sent = sent * (scale / 4096.0) + array(offset , Float) / 4096.0
+            self.quantization.add('position' , sent - positions[1:])
+            self.quantization.add('normal' , frame_normals[1:] / 512.0 - normals[1:])
+        return ( ( frame_positions , frame_normals ) )
+
+    def get_patches(self):
+        """(word offset , vertex) of the parameters of every FIFO_VERTEX16 and every FIFO_NORMAL of the first frame CallList"""
+        vertices = self.corner_vertices.tolist()
+        position_patches = []
+        normal_patches = []
+        #the parameter count comes first
+        offset = 1
+        for cp in self.cmdpack_list.list :
+            offset += 1
+            for c in cp.commands :
+                if (c.cmd == FIFO_VERTEX16) : position_patches.append( ( offset , vertices[len(position_patches)] ) )
+                elif (c.cmd == FIFO_NORMAL) : normal_patches.append( ( offset , vertices[len(normal_patches)] ) )
+                offset += c.get_nb_val()
+        return ( ( position_patches , normal_patches ) )
+
+    def save_deltas(self):
+        position_patches , normal_patches = self.get_patches()
+        columns = [ self.frame_positions ]
+        if (len(normal_patches) > 0) : columns.append(self.frame_normals)
+        nb_vertices = self.frame_positions.shape[1]
+        if (nb_vertices > 0x10000) : print "!!!Warning : %s has more than 65536 vertices, their indexes overflow the .anim file!!!" % (self.name)
+
+        path = self.options.get_path_anim()
+        f = open(path , "wb")
+        try:
+            f.write( pack( '<4i' , self.nb_frames , nb_vertices , len(position_patches) , len(normal_patches) ) )
+            for patches in (position_patches , normal_patches) :
+                if (len(patches) > 0) : f.write( pack( '<%di' % (2 * len(patches)) , *ravel(array(patches)).tolist() ) )
+            f.write( "".join([ le16_string(c[0]) for c in columns ]) )
+            for i in range(1 , self.nb_frames) :
+                deltas = [ c[i] - c[i - 1] for c in columns ]
+                moved = nonzero( sometrue( not_equal( concatenate(deltas , 1) , 0 ) , 1 ) )
+                data = le16_string(moved) + "".join([ le16_string( take(d , moved) ) for d in deltas ])
+                f.write( pack( '<i' , len(moved) ) )
+                f.write( data + "\0" * (-len(data) % 4) )
+        finally:
+            f.close()
+        self.stats.count_files('anim_bytes' , [ path ])
+        self.compress_files([ path ])
+
+    def construct_cmdpack(self,out=None):
+        """Write the CallList of every frame, or the CallList of the first one, into the file object out, or into final_cmdpack when out is None"""
+        if (self.base == None) : _nds_mesh_chunks.construct_cmdpack(self , out)
+        else : _nds_mesh.construct_cmdpack(self , out)
+
+    def save(self,report=1) :
+        _nds_mesh.save(self , 0)
+        if (self.base != None) : self.save_deltas()
+        if (report) : self.save_report()
 
     def __str__(self):
-        return "NDS Mesh [%s], Faces = %d (Quads=%d, Triangles=%d), Texture=%s" % (self.name,len(self.quads)/4+len(self.triangles)/3,len(self.quads)/4,len(self.triangles)/3,repr((self.options.get_final_path_tex(), self.options.texture_w,self.options.texture_h)) )
+        return "%s , %d frames" % (_nds_mesh.__str__(self) , self.nb_frames)
 
 
 class _menu_nds_export (object) :
     __slots__ = 'nb_meshes', 'mesh_options','selected_menu_mesh','popup_elm','button' , 'texID'
 
-    def __init__(self,dir_path):
-        self.nds_list_meshes(dir_path)
-
-    def nds_list_meshes(self,dir_path) :
-        print "Get current selected Meshes"
+    def __init__(self,dir_path,all_meshes=0):
+        self.nds_list_meshes(dir_path,all_meshes)
 
+    def nds_list_meshes(self,dir_path,all_meshes=0) :
         scene = Blender.Scene.GetCurrent()
 
-        objects = Blender.Object.GetSelected()
+        if (all_meshes) :
+            print "Get all the Meshes of the current scene"
+            objects = list(scene.objects)
+        else :
+            print "Get current selected Meshes"
+            objects = Blender.Object.GetSelected()
 
+        context = scene.getRenderingContext()
         self.nb_meshes = 0
         self.mesh_options = []
         for cur_obj in objects :
             if (cur_obj.getType()=="Mesh") :
-                self.mesh_options.append( _mesh_options( cur_obj.getData(name_only=False,mesh=True) , dir_path) )
+                options = _mesh_options( cur_obj.getData(name_only=False,mesh=True) , dir_path , cur_obj)
+                options.anim_start = context.startFrame()
+                options.anim_end = context.endFrame()
+                self.mesh_options.append(options)
                 self.nb_meshes += 1
 
         button = []
@@ -691,7 +3280,7 @@ class _menu_nds_export (object) :
         glRasterPos2d(5, 200 + 15 )
         Draw.Text( "Mesh to export : %s" % (self.mesh_options[0].mesh_name) )
         glRasterPos2d(5, 200 + 15 -15)
-        Draw.Text( "Save Format : %s" % ("C-Style Format" if (self.mesh_options[0].format) else "NDS Binary CallList" ) )
+        Draw.Text( "Save Format : %s" % self.mesh_options[0].get_emitter().description )
         glRasterPos2d(5, 200 + 15 -30)
         #Draw.Text( "Save Mesh into file : %s" % (Blender.sys.join(self.mesh_options[0].dir_path,self.mesh_options[0].mesh_name + (".h" if (self.mesh_options[0].format) else ".bin")) ) )
         Draw.Text( "Save Mesh into file : %s" % self.mesh_options[0].get_final_path_mesh())
@@ -703,11 +3292,40 @@ class _menu_nds_export (object) :
             Draw.Text( "No Texture export" )
 
         Draw.PushButton("GO!! Export!!" , 99 , 5 , 200 + 15 - 75 ,128, 20)
+        if (self.nb_meshes > 1) :
+            Draw.PushButton("Export the %d selected meshes" % (self.nb_meshes) , 98 , 5 + 128 + 5 , 200 + 15 - 75 , 256 , 20)
 
-        Draw.Toggle( "C-Style File"   , 1 , 5 , 5 + 0  + 2 , 128 , 20 , self.mesh_options[0].format)
+        Draw.Toggle( "C-Style File"   , 1 , 5 , 5 + 0  + 2 , 128 , 20 , 1 if self.mesh_options[0].format==EXPORT_OPTIONS['FORMAT_TEXT'] else 0)
         Draw.Toggle( "Texture"        , 2 , 5 , 5 + 20 + 4 , 128 , 20 , self.mesh_options[0].uv_export )
         Draw.Toggle( "Normals"        , 3 , 5 , 5 + 40 + 6 , 128 , 20 , self.mesh_options[0].normals_export)
         Draw.Toggle( "Colors "        , 4 , 5 , 5 + 60 + 8 , 128 , 20 , self.mesh_options[0].color_export)
+        Draw.Toggle( "GNU as File"    , 5 , 5 , 5 + 80 + 10 , 128 , 20 , 1 if self.mesh_options[0].format==EXPORT_OPTIONS['FORMAT_ASM'] else 0)
+        Draw.Toggle( "C Hex File"     , 35 , 5 , 5 + 100 + 12 , 128 , 20 , 1 if self.mesh_options[0].format in (EXPORT_OPTIONS['FORMAT_HEX'] , EXPORT_OPTIONS['FORMAT_HEX_COMMENTS']) else 0)
+        if (self.mesh_options[0].format in (EXPORT_OPTIONS['FORMAT_HEX'] , EXPORT_OPTIONS['FORMAT_HEX_COMMENTS'])) :
+            Draw.Toggle( "Comments"   , 36 , 360 + 128 + 5 , 5 + 80 + 10 , 128 , 20 , 1 if self.mesh_options[0].format==EXPORT_OPTIONS['FORMAT_HEX_COMMENTS'] else 0)
+
+        Draw.Toggle( "Skip Repeats"   , 6 , 360 , 5 + 0  + 2 , 128 , 20 , self.mesh_options[0].state_elision)
+        Draw.Toggle( "Strips"         , 7 , 360 , 5 + 20 + 4 , 128 , 20 , self.mesh_options[0].strip_export)
+        Draw.Toggle( "Small Vertices" , 8 , 360 , 5 + 40 + 6 , 128 , 20 , self.mesh_options[0].vertex_packing)
+        self.button = {}
+        Draw.Toggle( "Report"         , 15 , 360 , 5 + 100 + 12 , 128 , 20 , self.mesh_options[0].export_report)
+        Draw.Toggle( "Streaming"      , 16 , 360 + 128 + 5 , 5 + 0 + 2 , 128 , 20 , self.mesh_options[0].stream_export)
+        Draw.Toggle( "Pack Schedule"  , 17 , 360 + 128 + 5 , 5 + 20 + 4 , 128 , 20 , self.mesh_options[0].pack_schedule)
+        Draw.Toggle( "Fit Range"      , 19 , 360 + 128 + 5 , 5 + 60 + 8 , 128 , 20 , self.mesh_options[0].range_fit)
+        self.button[18] = Draw.Number( "Chunk faces " , 18 , 360 + 128 + 5 , 5 + 40 + 6 , 128 , 20 , self.mesh_options[0].chunk_faces , 0 , 65536 , "Faces per spatial chunk with its own CallList and BOX_TEST bounds (0 : a single CallList)")
+        anims = [ (v , k) for k , v in EXPORT_OPTIONS.items() if k.startswith('ANIM_') ]
+        anims.sort()
+        self.button[31] = Draw.Menu( "Animation %t|" + "|".join([ "%s %%x%d" % (k , v) for v , k in anims ]) , 31 , 360 + 2 * (128 + 5) , 5 + 0 + 2 , 128 , 20 , self.mesh_options[0].anim_export)
+        self.button[32] = Draw.Number( "Start " , 32 , 360 + 2 * (128 + 5) , 5 + 20 + 4 , 128 , 20 , self.mesh_options[0].anim_start , 1 , 30000 , "First frame of the animation")
+        self.button[33] = Draw.Number( "End " , 33 , 360 + 2 * (128 + 5) , 5 + 40 + 6 , 128 , 20 , self.mesh_options[0].anim_end , 1 , 30000 , "Last frame of the animation")
+        self.button[34] = Draw.String( "LOD " , 34 , 360 + 2 * (128 + 5) , 5 + 60 + 8 , 128 , 20 , self.mesh_options[0].lod_targets , 64 , "Polygon counts, or e and an error, of the levels of detail : 500,200,e0.05 (empty : none)")
+        Draw.Toggle( "Bake Lights"    , 37 , 360 + 2 * (128 + 5) , 5 + 80 + 10 , 128 , 20 , self.mesh_options[0].light_bake)
+        Draw.Toggle( "Material Lists" , 39 , 360 + 3 * (128 + 5) , 5 + 20 + 4 , 128 , 20 , self.mesh_options[0].material_lists)
+        Draw.Toggle( "Reorder Faces"  , 38 , 360 + 3 * (128 + 5) , 5 + 0 + 2 , 128 , 20 , self.mesh_options[0].face_reorder)
+        compressions = [ (v , k) for k , v in EXPORT_OPTIONS.items() if k.startswith('LZ_') ]
+        compressions.sort()
+        self.button[40] = Draw.Menu( "Compression %t|" + "|".join([ "%s %%x%d" % (k , v) for v , k in compressions ]) , 40 , 360 + 3 * (128 + 5) , 5 + 40 + 6 , 128 , 20 , self.mesh_options[0].lz_compression)
+        self.button[9] = Draw.Number( "Vtx10 error " , 9 , 360 , 5 + 60 + 8 , 128 , 20 , self.mesh_options[0].vertex_tolerance , 0.0 , 1.0 , "Error allowed on each coordinate to send a vertex with FIFO_VERTEX10")
 
 
         glBegin(GL_LINE_LOOP)
@@ -755,6 +3373,9 @@ class _menu_nds_export (object) :
                     glTexCoord2f(0,-1)
                     glVertex2i( 5 + 128 + 5 + 5 + 0   , 5 + 128 - self.mesh_options[0].texture_h )
                     glEnd()
+                    formats = [ (v , k) for k , v in TEXTURE_FORMAT_ENUM.items() ]
+                    formats.sort()
+                    self.button[30] = Draw.Menu( "Texture Format %t|" + "|".join([ "%s %%x%d" % (k , v) for v , k in formats ]) , 30 , 360 , 5 + 80 + 10 , 128 , 20 , TEXTURE_FORMAT_ENUM[self.mesh_options[0].texture_format])
                     self.mesh_options[0].texfile_export = 1
                 else :
                     glRasterPos2d(5 + 128 + 5 + 5 , 5 + 64 )
@@ -778,22 +3399,59 @@ class _menu_nds_export (object) :
         Draw.Redraw(1)
 
     def _menu_event_button(self,evt) :
-        if   evt==1 : self.mesh_options[0].format = 1 - self.mesh_options[0].format
+        if   evt==1 : self.mesh_options[0].format = EXPORT_OPTIONS['FORMAT_BINARY'] if self.mesh_options[0].format==EXPORT_OPTIONS['FORMAT_TEXT'] else EXPORT_OPTIONS['FORMAT_TEXT']
         elif evt==2 : self.mesh_options[0].uv_export = 1 - self.mesh_options[0].uv_export
         elif evt==3 : self.mesh_options[0].normals_export = 1 - self.mesh_options[0].normals_export
         elif evt==4 : self.mesh_options[0].color_export = 1 - self.mesh_options[0].color_export
+        elif evt==5 : self.mesh_options[0].format = EXPORT_OPTIONS['FORMAT_BINARY'] if self.mesh_options[0].format==EXPORT_OPTIONS['FORMAT_ASM'] else EXPORT_OPTIONS['FORMAT_ASM']
+        elif evt==6 : self.mesh_options[0].state_elision = 1 - self.mesh_options[0].state_elision
+        elif evt==7 : self.mesh_options[0].strip_export = 1 - self.mesh_options[0].strip_export
+        elif evt==8 : self.mesh_options[0].vertex_packing = 1 - self.mesh_options[0].vertex_packing
+        elif evt==9 : self.mesh_options[0].vertex_tolerance = self.button[9].val
         elif evt==10 : self.mesh_options[0].texture_w = 128
         elif evt==11 : self.mesh_options[0].texture_w = 64
         elif evt==12 : self.mesh_options[0].texture_w = 32
         elif evt==13 : self.mesh_options[0].texture_w = 16
         elif evt==14 : self.mesh_options[0].texture_w = 8
+        elif evt==15 : self.mesh_options[0].export_report = 1 - self.mesh_options[0].export_report
+        elif evt==16 : self.mesh_options[0].stream_export = 1 - self.mesh_options[0].stream_export
+        elif evt==17 : self.mesh_options[0].pack_schedule = 1 - self.mesh_options[0].pack_schedule
+        elif evt==18 : self.mesh_options[0].chunk_faces = self.button[18].val
+        elif evt==19 : self.mesh_options[0].range_fit = 1 - self.mesh_options[0].range_fit
         elif evt==20 : self.mesh_options[0].texture_h = 128
         elif evt==21 : self.mesh_options[0].texture_h = 64
         elif evt==22 : self.mesh_options[0].texture_h = 32
         elif evt==23 : self.mesh_options[0].texture_h = 16
         elif evt==24 : self.mesh_options[0].texture_h = 8
+        elif evt==98 :
+            for options in self.mesh_options[1:] :
+                options.copy_export_flags(self.mesh_options[0])
+                options.texfile_export = self.mesh_options[0].texfile_export and options.uv_export and (len(options.texture_data) > 0 or options.material_lists)
+            DSexport_batch(self.mesh_options)
+            Draw.Exit()
+            return
+        elif evt==30 :
+            for k , v in TEXTURE_FORMAT_ENUM.items() :
+                if (v == self.button[30].val) : self.mesh_options[0].texture_format = k
+        elif evt==31 : self.mesh_options[0].anim_export = self.button[31].val
+        elif evt==32 : self.mesh_options[0].anim_start = self.button[32].val
+        elif evt==33 : self.mesh_options[0].anim_end = self.button[33].val
+        elif evt==34 : self.mesh_options[0].lod_targets = self.button[34].val
+        elif evt==40 : self.mesh_options[0].lz_compression = self.button[40].val
+        elif evt==39 : self.mesh_options[0].material_lists = 1 - self.mesh_options[0].material_lists
+        elif evt==38 : self.mesh_options[0].face_reorder = 1 - self.mesh_options[0].face_reorder
+        elif evt==37 : self.mesh_options[0].light_bake = 1 - self.mesh_options[0].light_bake
+        elif evt==35 : self.mesh_options[0].format = EXPORT_OPTIONS['FORMAT_BINARY'] if self.mesh_options[0].format in (EXPORT_OPTIONS['FORMAT_HEX'] , EXPORT_OPTIONS['FORMAT_HEX_COMMENTS']) else EXPORT_OPTIONS['FORMAT_HEX']
+        elif evt==36 : self.mesh_options[0].format = EXPORT_OPTIONS['FORMAT_HEX'] if self.mesh_options[0].format==EXPORT_OPTIONS['FORMAT_HEX_COMMENTS'] else EXPORT_OPTIONS['FORMAT_HEX_COMMENTS']
         elif evt==99 :
-            nds_export = _nds_mesh(self.mesh_options[0])
+            #the lights are only read for the mesh exported, once the bake is chosen
+            if (self.mesh_options[0].light_bake) : self.mesh_options[0].list_lights( Blender.Scene.GetCurrent() )
+            if (self.mesh_options[0].anim_export) : nds_export = _nds_mesh_animation(self.mesh_options[0])
+            elif (self.mesh_options[0].lod_targets) : nds_export = _nds_mesh_lods(self.mesh_options[0])
+            elif (self.mesh_options[0].material_lists) : nds_export = _nds_mesh_materials(self.mesh_options[0])
+            elif (self.mesh_options[0].chunk_faces) : nds_export = _nds_mesh_chunks(self.mesh_options[0])
+            elif (self.mesh_options[0].stream_export) : nds_export = _nds_mesh_stream(self.mesh_options[0])
+            else : nds_export = _nds_mesh(self.mesh_options[0])
             nds_export.save()
             print nds_export
             Draw.Exit()                 # exit when user presses ESC
@@ -819,11 +3477,349 @@ def DSexport(dir_path):
     Draw.Register(menu._menu_gui, menu._menu_event, menu._menu_event_button)
 
 
+def get_encoder_key() :
+    """Hash of the source of the encoder : this script and nds_lz.py, or only the version of the
+    script when it is run from a Blender text without a file"""
+    h = hashlib.md5()
+    h.update(__version__)
+    for module_path in ( globals().get('__file__') , getattr(nds_lz , '__file__' , None) ) :
+        if (module_path == None) : continue
+        #the source, not the .pyc compiled from it
+        path = os.path.splitext(module_path)[0] + ".py"
+        if (not os.path.isfile(path)) : continue
+        f = open(path , "rb")
+        try:
+            h.update( f.read() )
+        finally:
+            f.close()
+    return ( h.hexdigest() )
+
+
+# a _nds_export_cache keeps a copy of every exported file in a directory, named
+# after a hash of everything used to build it (mesh attributes and export flags
+# for CallLists, image file and size for textures), and of the source of the
+# encoder so that a new exporter never hands out files of the previous one. A
+# file whose hash is already in the cache is copied from there instead of being
+# built again. The least recently used files are evicted when the cache grows
+# over max_size bytes.
+class _nds_export_cache (object) :
+    __slots__ = 'path' , 'max_size' , 'manifest' , 'encoder_key'
+
+    def __init__(self,path,max_size=64*1024*1024):
+        self.path = path
+        self.max_size = max_size
+        self.manifest = []
+        self.encoder_key = get_encoder_key()
+        if (not os.path.isdir(path)) : os.makedirs(path)
+
+    def mesh_key(self,snapshot):
+        h = hashlib.md5()
+        h.update( repr( (self.encoder_key , snapshot.options.get_export_flags()) ) )
+        snapshot.update_hash(h)
+        return ( h.hexdigest() )
+
+    def texture_key(self,mesh_options):
+        h = hashlib.md5()
+        h.update( repr( (self.encoder_key , mesh_options.texture_format , mesh_options.lz_compression) ) )
+        for image , w , h_size in mesh_options.get_textures() :
+            h.update( repr( (w , h_size) ) )
+            f = open(mesh_options.get_texture_filename(image) , "rb")
+            try:
+                data = f.read(1<<20)
+                while (data) :
+                    h.update(data)
+                    data = f.read(1<<20)
+            finally:
+                f.close()
+        return ( h.hexdigest() )
+
+    def get_entry(self,key,target):
+        return ( os.path.join(self.path , key + os.path.splitext(target)[1]) )
+
+    def fetch(self,key,targets):
+        """Put the cached files for key at targets, return False if they are not all in the cache"""
+        for target in targets :
+            if (not os.path.isfile(self.get_entry(key , target))) : return ( False )
+
+        for target in targets :
+            entry = self.get_entry(key , target)
+            os.utime(entry , None)
+            if (os.path.isfile(target) and filecmp.cmp(entry , target , 0)) :
+                self.manifest.append( ("unchanged" , key , target) )
+            else :
+                shutil.copyfile(entry , target)
+                self.manifest.append( ("cached" , key , target) )
+        return ( True )
+
+    def store(self,key,targets):
+        """Keep a copy of the freshly built targets"""
+        for target in targets :
+            shutil.copyfile(target , self.get_entry(key , target))
+            self.manifest.append( ("rebuilt" , key , target) )
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path) :
+            entry = os.path.join(self.path , name)
+            if (os.path.isfile(entry)) :
+                st = os.stat(entry)
+                entries.append( (st.st_mtime , st.st_size , entry) )
+                total += st.st_size
+        entries.sort()
+        for mtime , size , entry in entries :
+            if (total <= self.max_size) : break
+            os.remove(entry)
+            total -= size
+
+    def save_manifest(self,path):
+        """Write one line per exported file : rebuilt, cached (copied from the cache) or unchanged"""
+        f = open(path , "w")
+        try:
+            for status , key , target in self.manifest :
+                f.write( "%s %s %s\n" % (status , key , target) )
+        finally:
+            f.close()
+
+    def __str__(self):
+        counts = {}
+        for status , key , target in self.manifest :
+            counts[status] = counts.get(status , 0) + 1
+        return "Export cache : %d rebuilt , %d copied from the cache , %d unchanged" % (counts.get("rebuilt" , 0) , counts.get("cached" , 0) , counts.get("unchanged" , 0))
+
+
+def _nds_batch_encode(snapshot):
+    """Encode and save one mesh from its snapshot, run by the batch worker processes"""
+    if (snapshot.options.lod_targets) : nds_export = _nds_mesh_lods(snapshot.options , snapshot)
+    elif (snapshot.options.material_lists) : nds_export = _nds_mesh_materials(snapshot.options , snapshot)
+    elif (snapshot.options.chunk_faces) : nds_export = _nds_mesh_chunks(snapshot.options , snapshot)
+    else : nds_export = _nds_mesh(snapshot.options , snapshot)
+    #the report is written once the texture is saved by the main process
+    nds_export.save(0)
+    return ( str(nds_export) , nds_export.stats )
+
+def DSexport_batch(mesh_options,jobs=None,cache=None,archive=None):
+    """Export every mesh of mesh_options without GUI, encoding them in parallel worker processes,
+    then pack the exported files into the archive file archive if there is one"""
+    #Blender data can only be read from this process : take everything the encoder needs up front
+    #streamed meshes are too big to be copied : they are exported from here, one by one
+    #animations are read frame by frame through Blender : they are exported from here too, never cached
+    snapshots = []
+    streams = []
+    animations = []
+    keys = {}
+    for options in mesh_options :
+        if (options.anim_export) :
+            animations.append(options)
+            continue
+        if (options.stream_export and not options.chunk_faces and not options.lod_targets and not options.material_lists) : snapshot = _nds_mesh_stream(options)
+        else : snapshot = _nds_mesh_snapshot(options)
+        if (cache != None) :
+            keys[options.mesh_name] = key = cache.mesh_key(snapshot)
+            if (cache.fetch(key , [ options.get_final_path_mesh() ])) : continue
+        if (isinstance(snapshot , _nds_mesh_stream)) : streams.append(snapshot)
+        else : snapshots.append(snapshot)
+
+    #one pool of worker processes encodes the meshes, then converts the textures
+    pool = None
+    nb_textures = len([ options for options in mesh_options if options.texfile_export ])
+    if (jobs != 1 and len(snapshots) + nb_textures > 1) :
+        try:
+            import multiprocessing
+        except ImportError :
+            print "multiprocessing module not available (Python >= 2.6), meshes are exported one by one"
+        else :
+            pool = multiprocessing.Pool(jobs)
+
+    try:
+        #the meshes are queued first, the textures read through Blender meanwhile are queued after them
+        encoded = None
+        if (pool != None) : encoded = pool.map_async(_nds_batch_encode , snapshots , 1)
+
+        textures = _nds_texture_queue(pool)
+        texture_keys = {}
+        for options in mesh_options :
+            if (not options.texfile_export) : continue
+            if (cache != None) :
+                key = cache.texture_key(options)
+                if (cache.fetch(key , options.get_final_paths_tex())) : continue
+                texture_keys[options.mesh_name] = key
+            textures.submit(options)
+
+        results = None
+        if (encoded != None) :
+            try:
+                results = encoded.get()
+            except Exception , e :
+                print "Cannot export meshes in worker processes (%s), meshes are exported one by one" % (e)
+        if (results == None) :
+            results = map(_nds_batch_encode , snapshots)
+
+        for stream in streams :
+            stream.save(0)
+            results.append( (str(stream) , stream.stats) )
+        snapshots.extend(streams)
+
+        for options in animations :
+            animation = _nds_mesh_animation(options)
+            animation.save(0)
+            results.append( (str(animation) , animation.stats) )
+
+        textures.join()
+    finally:
+        if (pool != None) :
+            pool.close()
+            pool.join()
+
+    reports = {}
+    for text , stats in results :
+        print text
+        reports[stats.mesh_name] = stats
+
+    for options in mesh_options :
+        if (not options.texfile_export) : continue
+        if (cache != None and not texture_keys.has_key(options.mesh_name)) : continue
+        stats = reports.get(options.mesh_name , _nds_export_stats(0))
+        stats.add_time('texture' , textures.get_time(options.mesh_name))
+        stats.count_files('texture_bytes' , options.get_final_paths_tex())
+        if (cache != None) : cache.store(texture_keys[options.mesh_name] , options.get_final_paths_tex())
+
+    for options in [ snapshot.options for snapshot in snapshots ] + animations :
+        if (options.export_report) :
+            reports[options.mesh_name].save(options.get_final_path_report())
+            print reports[options.mesh_name]
+
+    if (cache != None) :
+        for snapshot in snapshots :
+            cache.store(keys[snapshot.options.mesh_name] , [ snapshot.options.get_final_path_mesh() ])
+        cache.evict()
+        if (len(mesh_options) > 0) : cache.save_manifest( Blender.sys.join(mesh_options[0].dir_path , "nds_export_manifest.txt") )
+        print cache
+
+    if (archive != None) :
+        paths = []
+        for options in mesh_options :
+            paths.extend( options.get_final_paths() )
+        nds_archive.write_archive_files(archive , paths)
+        print "Archive %s : %d files" % (archive , len(paths))
+
+BATCH_USAGE = """usage : blender -b <file.blend> -P nds_3d_export.py -- [options] <directory>
+    --all             export every mesh of the scene instead of the selected ones
+    --format=FORMAT   bin (default), h, s or x (C-style array of the words as hex literals)
+    --materials       export one CallList per material and image, with its own texture
+                      coordinates scale, and the texture number of each one after the index
+    --archive=FILE    also pack the exported files into the archive FILE (nds_archive.py), in the
+                      directory
+    --lz=10|11        compress the binary CallLists, animations and textures in the LZ77 format
+                      of the BIOS (10) or in the extended one (11), with nds_lz.py, into <file>.lz
+    --reorder         order the faces so that consecutive corners share their attributes
+    --bake-lights     send the lighting of the Sun lamps, the world ambient light and the material
+                      as vertex colors, without normals
+    --comments        with --format=x, write the command names next to the words of each pack
+    --jobs=N          number of worker processes (default : one per core)
+    --no-normals      do not export normals
+    --textures        export the textures of textured meshes
+    --skip-repeats    skip attributes equal to the previous ones
+    --strips          join faces into strips
+    --small-vertices  send vertices with the cheapest vertex command
+    --vertex-error=E  error allowed to use FIFO_VERTEX10
+    --tex-format=F    PCX (default) or a DS texture format : GL_RGB4, GL_RGB16, GL_RGB256,
+                      GL_RGB32_A3, GL_RGB8_A5, GL_COMPRESSED or GL_RGBA
+    --cache=DIR       only rebuild the files which changed since they were cached in DIR
+    --cache-size=MB   size of the cache (default : 64)
+    --report          write the timings and counters of each mesh export in <mesh>.report.json
+    --stream          write the faces as they are read, in bounded memory, in this process
+    --schedule        leave out the END and BEGIN commands the GPU does not need
+    --chunk-faces=N   split meshes into spatial chunks of at most N faces, each one with
+                      its own CallList and BOX_TEST bounds, indexed in the same file
+    --fit-range       scale meshes into the 4.12 range and export the matrix giving them back
+    --anim=MODE       export the animation of the meshes : deltas (first frame CallList and
+                      vertex deltas in <mesh>.anim) or lists (one CallList per frame)
+    --frames=S:E      frames of the animation (default : the frame range of the scene)
+    --lod=T1,T2,...   export levels of detail simplified down to each target : a polygon count,
+                      or e and an error in Blender units (e0.05), with their switch distances"""
+
+def DSexport_batch_args(args):
+    """Headless entry point : parse the arguments given after '--' on Blender command line"""
+    import getopt
+    if ('--' in args) : args = args[args.index('--') + 1:]
+    try:
+        opts , dirs = getopt.getopt(args , "" , ['all' , 'format=' , 'jobs=' , 'no-normals' , 'textures' , 'skip-repeats' , 'strips' , 'small-vertices' , 'vertex-error=' , 'cache=' , 'cache-size=' , 'tex-format=' , 'report' , 'stream' , 'schedule' , 'chunk-faces=' , 'fit-range' , 'anim=' , 'frames=' , 'lod=' , 'comments' , 'bake-lights' , 'reorder' , 'materials' , 'archive=' , 'lz='])
+    except getopt.GetoptError , e :
+        print e
+        print BATCH_USAGE
+        return
+    if (len(dirs) != 1) :
+        print BATCH_USAGE
+        return
+
+    opts = dict(opts)
+    formats = { 'bin' : EXPORT_OPTIONS['FORMAT_BINARY'] , 'h' : EXPORT_OPTIONS['FORMAT_TEXT'] , 's' : EXPORT_OPTIONS['FORMAT_ASM'] , 'x' : EXPORT_OPTIONS['FORMAT_HEX'] }
+    menu = _menu_nds_export(dirs[0] , opts.has_key('--all'))
+    print "Mesh count = %d" % (menu.nb_meshes)
+
+    for options in menu.mesh_options :
+        options.format = formats[opts.get('--format' , 'bin')]
+        if (opts.has_key('--comments') and options.format == EXPORT_OPTIONS['FORMAT_HEX']) : options.format = EXPORT_OPTIONS['FORMAT_HEX_COMMENTS']
+        if (opts.has_key('--no-normals')) : options.normals_export = EXPORT_OPTIONS['NO_NORMALS']
+        if (opts.has_key('--materials')) : options.material_lists = EXPORT_OPTIONS['MATERIAL_LISTS']
+        if (opts.has_key('--textures')) : options.texfile_export = (len(options.texture_data) > 0 or options.material_lists) and options.uv_export
+        if (opts.has_key('--skip-repeats')) : options.state_elision = EXPORT_OPTIONS['ELIDE_STATE']
+        if (opts.has_key('--strips')) : options.strip_export = EXPORT_OPTIONS['STRIPS']
+        if (opts.has_key('--small-vertices')) : options.vertex_packing = EXPORT_OPTIONS['VERTEX_SMALLEST']
+        if (opts.has_key('--vertex-error')) : options.vertex_tolerance = float(opts['--vertex-error'])
+        if (opts.has_key('--tex-format')) : options.texture_format = opts['--tex-format']
+        if (opts.has_key('--report')) : options.export_report = EXPORT_OPTIONS['REPORT']
+        if (opts.has_key('--stream')) : options.stream_export = EXPORT_OPTIONS['STREAM']
+        if (opts.has_key('--schedule')) : options.pack_schedule = EXPORT_OPTIONS['SCHEDULE']
+        if (opts.has_key('--chunk-faces')) : options.chunk_faces = int(opts['--chunk-faces'])
+        if (opts.has_key('--fit-range')) : options.range_fit = EXPORT_OPTIONS['FIT_RANGE']
+        if (opts.has_key('--anim')) : options.anim_export = EXPORT_OPTIONS.get('ANIM_' + opts['--anim'].upper() , -1)
+        if (opts.has_key('--reorder')) : options.face_reorder = EXPORT_OPTIONS['REORDER_FACES']
+        if (opts.has_key('--bake-lights')) : options.light_bake = EXPORT_OPTIONS['BAKE_LIGHTS']
+        if (opts.has_key('--lod')) : options.lod_targets = opts['--lod']
+        if (opts.has_key('--lz')) : options.lz_compression = EXPORT_OPTIONS.get('LZ_' + opts['--lz'] , -1)
+        if (opts.has_key('--frames')) : options.anim_start , options.anim_end = [ int(f) for f in opts['--frames'].split(':') ]
+        if (options.anim_export not in (EXPORT_OPTIONS['ANIM_NONE'] , EXPORT_OPTIONS['ANIM_DELTAS'] , EXPORT_OPTIONS['ANIM_LISTS'])) :
+            print "Unknown animation mode %s" % (opts['--anim'])
+            print BATCH_USAGE
+            return
+        if (options.lz_compression not in (EXPORT_OPTIONS['LZ_NONE'] , EXPORT_OPTIONS['LZ_10'] , EXPORT_OPTIONS['LZ_11'])) :
+            print "Unknown compression %s" % (opts['--lz'])
+            print BATCH_USAGE
+            return
+        if (not TEXTURE_FORMAT_ENUM.has_key(options.texture_format)) :
+            print "Unknown texture format %s" % (options.texture_format)
+            print BATCH_USAGE
+            return
+        if (options.light_bake) : options.list_lights( Blender.Scene.GetCurrent() )
+
+    jobs = None
+    if (opts.has_key('--jobs')) : jobs = int(opts['--jobs'])
+    cache = None
+    if (opts.has_key('--cache')) : cache = _nds_export_cache(opts['--cache'] , int(float(opts.get('--cache-size' , 64)) * 1024 * 1024))
+    archive = None
+    if (opts.has_key('--archive')) :
+        if (nds_archive == None) :
+            print "nds_archive.py not found next to nds_3d_export.py : cannot write %s" % (opts['--archive'])
+            return
+        archive = Blender.sys.join(dirs[0] , opts['--archive'])
+    if (opts.has_key('--lz') and nds_lz == None) :
+        print "nds_lz.py not found next to nds_3d_export.py : cannot compress the files"
+        return
+    DSexport_batch(menu.mesh_options , jobs , cache , archive)
+
+
 def my_callback(filename):
 #   if filename.find('/', -2) <= 0: filename += '.h' # add '.h' if the user didn't
     #print Blender.sys.dirname(filename)
     DSexport(Blender.sys.dirname(filename))
 
 
-fname = Blender.sys.makename(ext = "")
-Blender.Window.FileSelector(my_callback, "Select a directory","")
+if (Blender == None) :
+    pass
+elif (Blender.mode == 'background') :
+    DSexport_batch_args(argv)
+else :
+    fname = Blender.sys.makename(ext = "")
+    Blender.Window.FileSelector(my_callback, "Select a directory","")
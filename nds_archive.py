@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+#    Nintendo DS CallList Exporter for Blender - asset archives
+#    Copyright (C) 2008, 2009 Kevin Roy <kiniou_AT_gmail_DOT_com>
+#
+#    Nintendo DS CallList Exporter for Blender is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""One file holding many CallLists, textures and palettes, loaded as is by the game.
+
+Everything is little-endian. The file starts with a 32 bytes header :
+
+    char magic[4]         "NDSA"
+    u16  version          1
+    u16  align            alignment of the payloads (32)
+    u32  nb_entries
+    u32  toc_offset       table of contents, after the payloads
+    u32  nb_buckets       size of the hash table, a power of two
+    u32  names_offset     the entry names, NUL terminated
+    u32  file_size
+    u32  reserved
+
+The table of contents is a hash table of nb_buckets u32 (index + 1 of an
+entry, 0 for an empty bucket), then the entries, 24 bytes each :
+
+    u32  hash             FNV-1a (32 bits) of the name
+    u32  name             offset of the name from names_offset
+    u32  offset           offset of the payload from the start of the file
+    u32  size             size of the payload in bytes
+    u32  type             ENTRY_TYPES
+    u32  flags            ENTRY_COMPRESSED : an LZ10/LZ11 payload (nds_lz.py)
+
+The type of a compressed file (ship.bin.lz) is the one of the raw file
+(ship.bin), its entry keeps the name with the suffix. A name is found at bucket hash & (nb_buckets - 1), or at the next ones,
+wrapping around, until an empty bucket. The payloads start on 32 bytes
+boundaries, so that they can be DMA'd straight from the loaded file.
+
+Appending entries writes their payloads where the table of contents was,
+then a new table of contents : an archive grows without being rebuilt.
+
+    python nds_archive.py list assets.nda
+    python nds_archive.py add assets.nda ship.bin ship.tex ship.pal
+    python nds_archive.py extract assets.nda <directory>
+"""
+
+import sys
+import os
+import mmap
+from struct import pack , unpack_from , calcsize
+
+ARCHIVE_MAGIC = "NDSA"
+ARCHIVE_VERSION = 1
+ARCHIVE_ALIGN = 32
+ARCHIVE_HEADER = '<4sHHIIIIII'
+ARCHIVE_ENTRY = '<6I'
+
+ENTRY_TYPES = {
+    'DATA'          : 0 ,
+    'CALLLIST'      : 1 ,
+    'TEXTURE'       : 2 ,
+    'PALETTE'       : 3 ,
+    'PALETTE_INDEX' : 4 ,
+    'ANIMATION'     : 5
+}
+
+# flags of an entry
+ENTRY_COMPRESSED = 1
+
+# suffix of the files compressed by nds_lz.py
+COMPRESSED_SUFFIX = ".lz"
+
+# entry type of the files written by the exporter, by extension
+EXTENSION_TYPES = {
+    '.bin'  : ENTRY_TYPES['CALLLIST'] ,
+    '.tex'  : ENTRY_TYPES['TEXTURE'] ,
+    '.pcx'  : ENTRY_TYPES['TEXTURE'] ,
+    '.pal'  : ENTRY_TYPES['PALETTE'] ,
+    '.pidx' : ENTRY_TYPES['PALETTE_INDEX'] ,
+    '.anim' : ENTRY_TYPES['ANIMATION']
+}
+
+def name_hash(name) :
+    """FNV-1a hash (32 bits) of the string name"""
+    h = 0x811C9DC5
+    for c in name :
+        h = ((h ^ ord(c)) * 0x01000193) & 0xFFFFFFFF
+    return ( h )
+
+def align(offset,alignment) :
+    return ( (offset + alignment - 1) & ~(alignment - 1) )
+
+def file_type(path) :
+    """Entry type of the file path, from its extension, or from the one before the suffix of a compressed file"""
+    if (file_flags(path) & ENTRY_COMPRESSED) : path = path[:-len(COMPRESSED_SUFFIX)]
+    return ( EXTENSION_TYPES.get( os.path.splitext(path)[1].lower() , ENTRY_TYPES['DATA'] ) )
+
+def file_flags(path) :
+    """Entry flags of the file path : ENTRY_COMPRESSED for a compressed file"""
+    if (path.lower().endswith(COMPRESSED_SUFFIX)) : return ( ENTRY_COMPRESSED )
+    return ( 0 )
+
+def hash_table(hashes) :
+    """Buckets (index + 1 of an entry, 0 when empty) of the entries with these name hashes"""
+    nb_buckets = 1
+    while (nb_buckets < 2 * len(hashes)) :
+        nb_buckets *= 2
+    buckets = [ 0 ] * nb_buckets
+    for i in range( len(hashes) ) :
+        b = hashes[i] & (nb_buckets - 1)
+        while (buckets[b] != 0) :
+            b = (b + 1) & (nb_buckets - 1)
+        buckets[b] = i + 1
+    return ( buckets )
+
+def toc_string(entries) :
+    """Hash table, entries and names of the table of contents, entries being (name , type , offset , size , flags)
+    tuples, and the offset of the names from the start of the table"""
+    hashes = [ name_hash(name) for name , type , offset , size , flags in entries ]
+    buckets = hash_table(hashes)
+    names = []
+    name_offset = 0
+    records = []
+    for i in range( len(entries) ) :
+        name , type , offset , size , flags = entries[i]
+        records.append( pack( ARCHIVE_ENTRY , hashes[i] , name_offset , offset , size , type , flags ) )
+        names.append( name + "\0" )
+        name_offset += len(name) + 1
+    table = pack( '<%dI' % len(buckets) , *buckets ) + "".join(records)
+    return ( ( table + "".join(names) , len(table) , len(buckets) ) )
+
+def header_string(nb_entries,toc_offset,nb_buckets,names_offset,file_size) :
+    return ( pack( ARCHIVE_HEADER , ARCHIVE_MAGIC , ARCHIVE_VERSION , ARCHIVE_ALIGN , nb_entries , toc_offset , nb_buckets , names_offset , file_size , 0 ) )
+
+def write_archive(path,entries) :
+    """Write the archive path with the (name , data) entries, the type and flags of each one taken from its name"""
+    f = open(path , "wb")
+    try:
+        offset = align( calcsize(ARCHIVE_HEADER) , ARCHIVE_ALIGN )
+        f.write( "\0" * offset )
+        toc = []
+        for name , data in entries :
+            f.write( data )
+            toc.append( (name , file_type(name) , offset , len(data) , file_flags(name)) )
+            end = align( offset + len(data) , ARCHIVE_ALIGN )
+            f.write( "\0" * (end - offset - len(data)) )
+            offset = end
+        table , names_offset , nb_buckets = toc_string(toc)
+        f.write( table )
+        f.seek(0)
+        f.write( header_string(len(toc) , offset , nb_buckets , offset + names_offset , offset + len(table)) )
+    finally:
+        f.close()
+
+def write_archive_files(path,files) :
+    """Write the archive path with the files listed in files, named after their base name"""
+    entries = []
+    for file_path in files :
+        f = open(file_path , "rb")
+        try:
+            entries.append( ( os.path.basename(file_path) , f.read() ) )
+        finally:
+            f.close()
+    write_archive(path , entries)
+
+
+# a _nds_archive maps an archive file in memory : payloads are returned as
+# buffers on the mapping, without copy. Opened writable, entries can be
+# appended to it in place.
+class _nds_archive (object) :
+    __slots__ = 'path' , 'file' , 'map' , 'entries' , 'index' , 'nb_buckets' , 'toc_offset' , 'writable'
+
+    def __init__(self,path,writable=0):
+        self.path = path
+        self.writable = writable
+        if (writable) : self.file = open(path , "r+b")
+        else : self.file = open(path , "rb")
+        self.map = None
+        self.load()
+
+    def load(self):
+        if (self.writable) : self.map = mmap.mmap(self.file.fileno() , 0 , access=mmap.ACCESS_WRITE)
+        else : self.map = mmap.mmap(self.file.fileno() , 0 , access=mmap.ACCESS_READ)
+        magic , version , alignment , nb_entries , self.toc_offset , self.nb_buckets , names_offset , file_size , reserved = unpack_from(ARCHIVE_HEADER , self.map , 0)
+        if (magic != ARCHIVE_MAGIC) : raise ValueError("%s is not an archive" % (self.path))
+        if (version != ARCHIVE_VERSION) : raise ValueError("%s : unknown archive version %d" % (self.path , version))
+        if (file_size != len(self.map)) : raise ValueError("%s : %d bytes instead of %d" % (self.path , len(self.map) , file_size))
+        #entries : (name , type , offset , size , hash , flags)
+        self.entries = []
+        self.index = {}
+        start = self.toc_offset + 4 * self.nb_buckets
+        for i in range(nb_entries) :
+            h , name_offset , offset , size , type , flags = unpack_from(ARCHIVE_ENTRY , self.map , start + i * calcsize(ARCHIVE_ENTRY))
+            name_start = names_offset + name_offset
+            name = self.map[name_start:self.map.find("\0" , name_start)]
+            if (offset % alignment != 0 or offset + size > self.toc_offset) : raise ValueError("%s : bad payload for %s" % (self.path , name))
+            self.entries.append( (name , type , offset , size , h , flags) )
+            self.index[name] = i
+
+    def find(self,name):
+        """Index of the entry name, looked up in the hash table as the game does, None if there is none"""
+        h = name_hash(name)
+        b = h & (self.nb_buckets - 1)
+        #there is always an empty bucket : the table is at most half full
+        while (1) :
+            i , = unpack_from('<I' , self.map , self.toc_offset + 4 * b)
+            if (i == 0) : return ( None )
+            if (self.entries[i - 1][4] == h and self.entries[i - 1][0] == name) : return ( i - 1 )
+            b = (b + 1) & (self.nb_buckets - 1)
+
+    def names(self):
+        return ( [ e[0] for e in self.entries ] )
+
+    def get(self,name):
+        """Payload of the entry name, a buffer on the mapped file"""
+        i = self.find(name)
+        if (i == None) : raise KeyError(name)
+        name , type , offset , size , h , flags = self.entries[i]
+        return ( buffer(self.map , offset , size) )
+
+    def append(self,entries):
+        """Add the (name , data) entries : their payloads are written where the table of contents was, then
+        the new table of contents. An entry replaces the one of the same name, whose payload is left unused."""
+        if (not self.writable) : raise IOError("%s is opened read only" % (self.path))
+        toc = [ e[:4] + e[5:] for e in self.entries ]
+        index = dict(self.index)
+        offset = self.toc_offset
+        payloads = []
+        for name , data in entries :
+            payloads.append( (offset , data) )
+            entry = (name , file_type(name) , offset , len(data) , file_flags(name))
+            if (index.has_key(name)) : toc[index[name]] = entry
+            else :
+                index[name] = len(toc)
+                toc.append(entry)
+            offset = align( offset + len(data) , ARCHIVE_ALIGN )
+        table , names_offset , nb_buckets = toc_string(toc)
+        file_size = offset + len(table)
+
+        #grow the file, then write everything through a new mapping of it
+        self.map.close()
+        self.file.truncate(file_size)
+        self.map = mmap.mmap(self.file.fileno() , 0 , access=mmap.ACCESS_WRITE)
+        end = self.toc_offset
+        for start , data in payloads :
+            self.map[end:start] = "\0" * (start - end)
+            self.map[start:start + len(data)] = data
+            end = start + len(data)
+        self.map[end:offset] = "\0" * (offset - end)
+        self.map[offset:file_size] = table
+        header = header_string(len(toc) , offset , nb_buckets , offset + names_offset , file_size)
+        self.map[0:len(header)] = header
+        self.map.flush()
+        self.map.close()
+        self.load()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __str__(self):
+        lines = [ "%s : %d entries , %d bytes" % (self.path , len(self.entries) , len(self.map)) ]
+        types = dict([ (v , k) for k , v in ENTRY_TYPES.items() ])
+        for name , type , offset , size , h , flags in self.entries :
+            type = "%s" % (types.get(type , type))
+            if (flags & ENTRY_COMPRESSED) : type += " (LZ)"
+            lines.append( "  %-32s %-18s offset %8d , %8d bytes , hash 0x%08X" % (name , type , offset , size , h) )
+        return ( "\n".join(lines) )
+
+def open_archive(path,writable=0) :
+    return ( _nds_archive(path , writable) )
+
+
+def main(args) :
+    if (len(args) < 2 or args[0] not in ('list' , 'add' , 'extract')) :
+        print __doc__
+        return ( 1 )
+    command , path = args[0] , args[1]
+    if (command == 'add') :
+        if (not os.path.isfile(path)) : write_archive(path , [])
+        archive = open_archive(path , 1)
+        entries = []
+        for file_path in args[2:] :
+            f = open(file_path , "rb")
+            try:
+                entries.append( ( os.path.basename(file_path) , f.read() ) )
+            finally:
+                f.close()
+        archive.append(entries)
+    else :
+        archive = open_archive(path)
+    try:
+        if (command == 'extract') :
+            directory = "."
+            if (len(args) > 2) : directory = args[2]
+            for name in archive.names() :
+                f = open(os.path.join(directory , name) , "wb")
+                try:
+                    f.write( archive.get(name) )
+                finally:
+                    f.close()
+        print archive
+    finally:
+        archive.close()
+    return ( 0 )
+
+if __name__ == '__main__' :
+    sys.exit( main(sys.argv[1:]) )
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+
+#    Nintendo DS CallList Exporter for Blender - encoder benchmarks
+#    Copyright (C) 2008, 2009 Kevin Roy <kiniou_AT_gmail_DOT_com>
+#
+#    Nintendo DS CallList Exporter for Blender is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark of the CallList encoder on synthetic meshes, without Blender.
+
+Every case (mesh kind, face count, output format) runs in its own process so
+that its peak memory can be measured. Results are written as JSON and can be
+compared with the results of another version :
+
+    python nds_benchmark.py --output=new.json
+    python nds_benchmark.py --output=new.json --compare=old.json
+
+The default sizes go from 100 to 100000 faces. A mesh of 1000000 faces takes
+minutes and gigabytes of memory per case : add it on demand :
+
+    python nds_benchmark.py --sizes=100,1000,10000,100000,1000000 --output=new.json
+
+Results are only compared with the results of the same mesh, size, format
+and optimizations.
+"""
+
+import sys
+import os
+import time
+import math
+import random
+import getopt
+import subprocess
+import json
+
+import nds_3d_export as nds
+
+
+# Stand-ins for the Blender mesh objects, with only what _nds_mesh_snapshot reads
+
+class _Vertex (object) :
+    __slots__ = 'co' , 'no'
+
+    def __init__(self,co,no):
+        self.co = co
+        self.no = no
+
+class _UV (object) :
+    __slots__ = 'x' , 'y'
+
+    def __init__(self,x,y):
+        self.x = x
+        self.y = y
+
+class _Color (object) :
+    __slots__ = 'r' , 'g' , 'b'
+
+    def __init__(self,r,g,b):
+        self.r = r
+        self.g = g
+        self.b = b
+
+class _Face (object) :
+    __slots__ = 'v' , 'uv' , 'col'
+
+    def __init__(self,v,uv,col):
+        self.v = v
+        self.uv = uv
+        self.col = col
+
+    def __len__(self):
+        return ( len(self.v) )
+
+class _Mesh (object) :
+    __slots__ = 'name' , 'faces' , 'faceUV' , 'vertexColors' , 'materials'
+
+    def __init__(self,name,faces):
+        self.name = name
+        self.faces = faces
+        self.faceUV = 1
+        self.vertexColors = 1
+        self.materials = []
+
+
+def normalize(v) :
+    l = math.sqrt(v[0] * v[0] + v[1] * v[1] + v[2] * v[2]) or 1.0
+    return ( (v[0] / l , v[1] / l , v[2] / l) )
+
+def make_face(vertices,uvs,color) :
+    return ( _Face(vertices , [ _UV(u , v) for u , v in uvs ] , [ _Color(*color) for i in vertices ]) )
+
+def make_grid(nb_faces) :
+    """Flat shaded square grid of quads, the most strip-friendly case"""
+    n = max(1 , int(math.sqrt(nb_faces)))
+    verts = {}
+    for i in range(n + 1) :
+        for j in range(n + 1) :
+            verts[i , j] = _Vertex( (i * 7.0 / n - 3.5 , j * 7.0 / n - 3.5 , 0.0) , (0.0 , 0.0 , 1.0) )
+    faces = []
+    for i in range(n) :
+        for j in range(n) :
+            ids = ( (i , j) , (i + 1 , j) , (i + 1 , j + 1) , (i , j + 1) )
+            faces.append( make_face([ verts[k] for k in ids ] , [ (float(a) / n , float(b) / n) for a , b in ids ] , (128 , 128 , 128)) )
+    return ( faces )
+
+def make_sphere(nb_faces) :
+    """Smooth UV sphere : quads with a fan of triangles at each pole"""
+    rings = max(3 , int(math.sqrt(nb_faces / 2)))
+    segments = 2 * rings
+    verts = {}
+    for i in range(rings + 1) :
+        for j in range(segments) :
+            t = math.pi * i / rings
+            p = 2 * math.pi * j / segments
+            no = ( math.sin(t) * math.cos(p) , math.sin(t) * math.sin(p) , math.cos(t) )
+            verts[i , j] = _Vertex( (no[0] * 3.0 , no[1] * 3.0 , no[2] * 3.0) , no )
+    faces = []
+    for i in range(rings) :
+        for j in range(segments) :
+            k = (j + 1) % segments
+            ids = [ (i , j) , (i + 1 , j) , (i + 1 , k) , (i , k) ]
+            if (i == 0) : del ids[3]
+            elif (i == rings - 1) : del ids[2]
+            faces.append( make_face([ verts[x] for x in ids ] , [ (float(b) / segments , float(a) / rings) for a , b in ids ] , (255 , 255 , 255)) )
+    return ( faces )
+
+def make_soup(nb_faces) :
+    """Random triangles and quads sharing nothing, the worst case"""
+    rnd = random.Random(nb_faces)
+    faces = []
+    for f in range(nb_faces) :
+        vertices = []
+        for i in range(3 + (f % 2)) :
+            co = ( rnd.uniform(-4.0 , 4.0) , rnd.uniform(-4.0 , 4.0) , rnd.uniform(-4.0 , 4.0) )
+            vertices.append( _Vertex(co , normalize(co)) )
+        faces.append( make_face(vertices , [ (rnd.random() , rnd.random()) for v in vertices ] , (rnd.randrange(256) , rnd.randrange(256) , rnd.randrange(256))) )
+    return ( faces )
+
+MESHES = {
+    'grid'   : make_grid ,
+    'sphere' : make_sphere ,
+    'soup'   : make_soup
+}
+
+FORMATS = {
+    'bin' : nds.EXPORT_OPTIONS['FORMAT_BINARY'] ,
+    'h'   : nds.EXPORT_OPTIONS['FORMAT_TEXT']
+}
+
+# benchmark switches -> (_mesh_options attribute , value)
+OPTIONS = {
+    'skip-repeats'   : ('state_elision' , nds.EXPORT_OPTIONS['ELIDE_STATE']) ,
+    'strips'         : ('strip_export' , nds.EXPORT_OPTIONS['STRIPS']) ,
+    'small-vertices' : ('vertex_packing' , nds.EXPORT_OPTIONS['VERTEX_SMALLEST'])
+}
+
+
+def peak_memory() :
+    """Peak resident memory of this process in kB, None where it cannot be known"""
+    try:
+        import resource
+    except ImportError :
+        return ( None )
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on Mac OS X and in kB elsewhere
+    if (sys.platform == 'darwin') : peak /= 1024
+    return ( peak )
+
+def run_case(kind,nb_faces,format,options) :
+    """Run one case in this process and return its results"""
+    faces = MESHES[kind](nb_faces)
+    mesh = _Mesh("%s_%d" % (kind , nb_faces) , faces)
+    mesh_options = nds._mesh_options(mesh , ".")
+    mesh_options.format = FORMATS[format]
+    mesh_options.texture_w = mesh_options.texture_h = 128
+    for name in options :
+        attribute , value = OPTIONS[name]
+        setattr(mesh_options , attribute , value)
+
+    #time the vectorized encoding apart from the command-pack building which calls it
+    timings = { 'encode' : 0.0 }
+    encode = nds._nds_mesh_attributes.encode
+    def timed_encode(*args) :
+        t = time.time()
+        encode(*args)
+        timings['encode'] += time.time() - t
+    nds._nds_mesh_attributes.encode = timed_encode
+
+    t = time.time()
+    snapshot = nds._nds_mesh_snapshot(mesh_options)
+    timings['get_faces'] = time.time() - t
+
+    t = time.time()
+    nds_mesh = nds._nds_mesh(mesh_options , snapshot)
+    timings['prepare_cmdpack'] = time.time() - t - timings['encode']
+
+    t = time.time()
+    nds_mesh.construct_cmdpack()
+    timings['construct_cmdpack'] = time.time() - t
+
+    nb_triangles = len(snapshot.triangles) / 3 + 2 * (len(snapshot.quads) / 4)
+    nb_commands = nb_nops = 0
+    for cp in nds_mesh.cmdpack_list.list :
+        for c in cp.commands :
+            nb_commands += 1
+            if (c.cmd == nds.FIFO_NOP) : nb_nops += 1
+
+    return ( {
+        'mesh' : kind ,
+        'faces' : len(faces) ,
+        'triangles' : nb_triangles ,
+        'format' : format ,
+        'options' : options ,
+        'times' : timings ,
+        'peak_memory_kb' : peak_memory() ,
+        'bytes' : len(nds_mesh.final_cmdpack) ,
+        'bytes_per_triangle' : float(len(nds_mesh.final_cmdpack)) / max(1 , nb_triangles) ,
+        'params' : nds_mesh.cmdpack_list.get_nb_params() ,
+        'nop_ratio' : float(nb_nops) / max(1 , nb_commands)
+    } )
+
+def run_all(kinds,sizes,formats,options) :
+    """Run every case in a child process, return the list of results"""
+    results = []
+    for kind in kinds :
+        for nb_faces in sizes :
+            for format in formats :
+                args = [ sys.executable , os.path.abspath(__file__) , "--case=%s,%d,%s" % (kind , nb_faces , format) ]
+                if (len(options) > 0) : args.append("--options=%s" % (",".join(options)))
+                child = subprocess.Popen(args , stdout=subprocess.PIPE , stderr=open(os.devnull , "w"))
+                out = child.communicate()[0]
+                if (child.returncode != 0) :
+                    print >> sys.stderr , "case %s %d %s failed" % (kind , nb_faces , format)
+                    continue
+                result = json.loads(out)
+                t = result['times']
+                print >> sys.stderr , "%-6s %8d faces %-3s : get_faces %7.3fs encode %7.3fs prepare_cmdpack %7.3fs construct_cmdpack %7.3fs , %s kB peak , %.1f bytes/triangle , %.1f%% NOP" % (kind , result['faces'] , format , t['get_faces'] , t['encode'] , t['prepare_cmdpack'] , t['construct_cmdpack'] , result['peak_memory_kb'] , result['bytes_per_triangle'] , 100.0 * result['nop_ratio'])
+                results.append(result)
+    return ( results )
+
+def case_key(result) :
+    """What a result measures : runs with other optimizations are not compared"""
+    return ( ( result['mesh'] , result['faces'] , result['format'] , tuple( sorted(result['options']) ) ) )
+
+def compare(results,reference) :
+    """Print the time and size ratios of results against the reference results"""
+    old = {}
+    for r in reference['results'] :
+        old[case_key(r)] = r
+    for r in results :
+        o = old.get( case_key(r) )
+        if (o == None) : continue
+        ratios = []
+        for stage in ('get_faces' , 'encode' , 'prepare_cmdpack' , 'construct_cmdpack') :
+            if (o['times'].get(stage)) : ratios.append( "%s x%.2f" % (stage , r['times'][stage] / o['times'][stage]) )
+        if (o['peak_memory_kb']) : ratios.append( "memory x%.2f" % (float(r['peak_memory_kb']) / o['peak_memory_kb']) )
+        if (o['bytes']) : ratios.append( "bytes x%.2f" % (float(r['bytes']) / o['bytes']) )
+        print >> sys.stderr , "%-6s %8d faces %-3s : %s" % (r['mesh'] , r['faces'] , r['format'] , " , ".join(ratios))
+
+USAGE = """usage : python nds_benchmark.py [options]
+    --meshes=LIST     mesh kinds among grid, sphere, soup (default : all)
+    --sizes=LIST      face counts (default : 100,1000,10000,100000 ; add 1000000 for the largest
+                      meshes, which take minutes and gigabytes of memory per case)
+    --formats=LIST    output formats among bin, h (default : both)
+    --options=LIST    exporter optimizations among skip-repeats, strips, small-vertices
+    --output=FILE     JSON file of the results (default : nds_benchmark.json)
+    --compare=FILE    JSON results of another version to compare with"""
+
+def main(args) :
+    try:
+        opts , rest = getopt.getopt(args , "" , ['meshes=' , 'sizes=' , 'formats=' , 'options=' , 'output=' , 'compare=' , 'case='])
+    except getopt.GetoptError , e :
+        print >> sys.stderr , e
+        print >> sys.stderr , USAGE
+        return ( 2 )
+    opts = dict(opts)
+
+    options = [ o for o in opts.get('--options' , '').split(',') if o ]
+    for o in options :
+        if (not OPTIONS.has_key(o)) :
+            print >> sys.stderr , "Unknown option %s" % (o)
+            print >> sys.stderr , USAGE
+            return ( 2 )
+
+    if (opts.has_key('--case')) :
+        kind , nb_faces , format = opts['--case'].split(',')
+        #the encoder prints its progress : keep stdout for the results
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            result = run_case(kind , int(nb_faces) , format , options)
+        finally:
+            sys.stdout = stdout
+        print json.dumps(result)
+        return ( 0 )
+
+    kinds = opts.get('--meshes' , 'grid,sphere,soup').split(',')
+    sizes = [ int(n) for n in opts.get('--sizes' , '100,1000,10000,100000').split(',') ]
+    formats = opts.get('--formats' , 'bin,h').split(',')
+    results = run_all(kinds , sizes , formats , options)
+
+    f = open(opts.get('--output' , 'nds_benchmark.json') , "w")
+    try:
+        json.dump( { 'version' : nds.__version__ , 'python' : sys.version , 'options' : options , 'results' : results } , f , indent=1 )
+    finally:
+        f.close()
+
+    if (opts.has_key('--compare')) :
+        f = open(opts['--compare'])
+        try:
+            compare(results , json.load(f))
+        finally:
+            f.close()
+    return ( 0 )
+
+if __name__ == '__main__' :
+    sys.exit( main(sys.argv[1:]) )
@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+
+#    Nintendo DS CallList Exporter for Blender - CallList checker
+#    Copyright (C) 2008, 2009 Kevin Roy <kiniou_AT_gmail_DOT_com>
+#
+#    Nintendo DS CallList Exporter for Blender is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Decode, check and cost the binary CallLists (.bin) written by the exporter, without Blender.
+
+A file is a single CallList or the index of chunks, levels of detail, frames
+or materials followed by their CallLists, in words :
+
+    N , N words of packs [, matrix]
+    K , K x (3 BOX_TEST words , byte offset of the CallList) , K x (N , N words of packs) [, table] [, matrix]
+
+The table has one word per CallList : the distance (f32) from which each level
+of detail is used, the first one being 0, or the texture number of each
+material CallList, -1 without texture. The matrix is written with range
+fitting : the 12 f32 parameters of MTX_MULT_4x3, a scale on the diagonal then
+the offset. A file is read as a single CallList when its parameter count
+leaves room for nothing else, or for a matrix, else as an index : the
+CallLists must follow it and each other, and only a table and a matrix may
+come after them.
+
+A compressed file (ship.bin.lz, or an LZ10/LZ11 header where a CallList is
+expected) is decompressed first, with nds_lz.py.
+
+Every pack is walked and checked : known commands, parameters inside the
+list, BEGIN types, no vertex before the first BEGIN, whole polygons in every
+primitive, VTX_16 padding, and every vertex inside the BOX_TEST box of its
+CallList for indexed files (a coordinate out of the 4.12 range wraps around
+and lands outside of it). The polygons and vertices are then counted against
+the polygon and vertex RAM of the DS, with the GXFIFO words and an estimate
+of the geometry engine cycles :
+
+    python nds_calllist.py ship.bin level.bin
+    python nds_calllist.py --max-polygons=1500 --max-cycles=400000 --json=budget.json *.bin
+
+The exit status is 1 when a file is invalid or over a budget, for build checks.
+"""
+
+import sys
+import time
+import getopt
+try:
+    import json
+except ImportError :
+    #Python < 2.6 : --json is written by the json_string of the exporter
+    json = None
+
+import nds_3d_export as nds
+from Numeric import *
+
+POLYGON_RAM = 2048
+VERTEX_RAM = 6144
+
+# parameter words of each command
+COMMAND_PARAMS = {
+    nds.FIFO_NOP         : 0 ,
+    nds.FIFO_COLOR       : 1 ,
+    nds.FIFO_NORMAL      : 1 ,
+    nds.FIFO_TEX_COORD   : 1 ,
+    nds.FIFO_VERTEX16    : 2 ,
+    nds.FIFO_VERTEX10    : 1 ,
+    nds.FIFO_VERTEX_XY   : 1 ,
+    nds.FIFO_VERTEX_XZ   : 1 ,
+    nds.FIFO_VERTEX_YZ   : 1 ,
+    nds.FIFO_DIFF : 1 ,
+    nds.FIFO_BEGIN       : 1 ,
+    nds.FIFO_END         : 0
+}
+
+COMMAND_NAMES = {
+    nds.FIFO_NOP         : "NOP" ,
+    nds.FIFO_COLOR       : "COLOR" ,
+    nds.FIFO_NORMAL      : "NORMAL" ,
+    nds.FIFO_TEX_COORD   : "TEXCOORD" ,
+    nds.FIFO_VERTEX16    : "VTX_16" ,
+    nds.FIFO_VERTEX10    : "VTX_10" ,
+    nds.FIFO_VERTEX_XY   : "VTX_XY" ,
+    nds.FIFO_VERTEX_XZ   : "VTX_XZ" ,
+    nds.FIFO_VERTEX_YZ   : "VTX_YZ" ,
+    nds.FIFO_DIFF : "VTX_DIFF" ,
+    nds.FIFO_BEGIN       : "BEGIN_VTXS" ,
+    nds.FIFO_END         : "END_VTXS"
+}
+
+# geometry engine cycles of each command (GBATEK), NORMAL takes one more per enabled light
+COMMAND_CYCLES = {
+    nds.FIFO_NOP         : 0 ,
+    nds.FIFO_COLOR       : 1 ,
+    nds.FIFO_NORMAL      : 9 ,
+    nds.FIFO_TEX_COORD   : 1 ,
+    nds.FIFO_VERTEX16    : 9 ,
+    nds.FIFO_VERTEX10    : 8 ,
+    nds.FIFO_VERTEX_XY   : 8 ,
+    nds.FIFO_VERTEX_XZ   : 8 ,
+    nds.FIFO_VERTEX_YZ   : 8 ,
+    nds.FIFO_DIFF : 8 ,
+    nds.FIFO_BEGIN       : 1 ,
+    nds.FIFO_END         : 1
+}
+
+PRIMITIVE_NAMES = [ "GL_TRIANGLES" , "GL_QUADS" , "GL_TRIANGLE_STRIP" , "GL_QUAD_STRIP" ]
+
+# slack of the BOX_TEST check : the rounding of FIFO_VERTEX10
+BOX_SLACK = 1 << 6
+
+# words of the MTX_MULT_4x3 matrix written after the CallLists with range fitting
+MATRIX_WORDS = 12
+
+# compressed files (nds_lz.py) : the suffix of their names and the types of their headers
+LZ_SUFFIX = ".lz"
+LZ10 = 0x10
+LZ11 = 0x11
+
+def primitive_cost(type,nb_vertices) :
+    """(polygons , vertex RAM entries , error) of nb_vertices sent after a BEGIN of type"""
+    if (type == 0) :
+        return ( ( nb_vertices / 3 , nb_vertices - nb_vertices % 3 , nb_vertices % 3 != 0 ) )
+    if (type == 1) :
+        return ( ( nb_vertices / 4 , nb_vertices - nb_vertices % 4 , nb_vertices % 4 != 0 ) )
+    #the vertices of a strip are stored once, shared by its polygons
+    if (type == 2) :
+        if (nb_vertices < 3) : return ( ( 0 , 0 , nb_vertices != 0 ) )
+        return ( ( nb_vertices - 2 , nb_vertices , 0 ) )
+    if (nb_vertices < 4) : return ( ( 0 , 0 , nb_vertices != 0 ) )
+    return ( ( (nb_vertices - 2) / 2 , nb_vertices - nb_vertices % 2 , nb_vertices % 2 != 0 ) )
+
+def pack_params(header) :
+    """Parameter words of the commands of the pack header, None if one of them is unknown"""
+    n = 0
+    for shift in (0 , 8 , 16 , 24) :
+        c = (header >> shift) & 0xFF
+        if (not COMMAND_PARAMS.has_key(c)) : return ( None )
+        n += COMMAND_PARAMS[c]
+    return ( n )
+
+def params_table() :
+    table = zeros(256 , Int)
+    for c , n in COMMAND_PARAMS.items() :
+        table[c] = n
+    return ( table )
+
+def sign16(n) :
+    return ( ((n + 0x8000) & 0xFFFF) - 0x8000 )
+
+def box_bounds(box) :
+    """(low , high) corners of the BOX_TEST words box, in v16 units"""
+    low = ( sign16(box[0]) , box[0] >> 16 , sign16(box[1]) )
+    size = ( box[1] >> 16 , sign16(box[2]) , box[2] >> 16 )
+    return ( ( low , [ low[i] + size[i] for i in range(3) ] ) )
+
+
+class _nds_decoded_command (object) :
+    """Command with the interface the exporter's _nds_gpu_simulator runs"""
+    __slots__ = 'cmd' , 'words'
+
+    def __init__(self,cmd,words):
+        self.cmd = cmd
+        self.words = words
+
+    def get_words(self):
+        return ( self.words )
+
+
+# a _nds_calllist decodes one CallList, words[start:end] being its packs. The
+# packs are walked one header at a time, the number of parameters of each
+# header kept in a dictionary, then the commands and their parameter offsets
+# are laid out in Numeric arrays for the checks and the counts.
+class _nds_calllist (object) :
+    __slots__ = 'name' , 'words' , 'word_list' , 'start' , 'end' , 'box' , 'errors' , 'ops' , 'positions' , 'counters'
+
+    def __init__(self,name,words,word_list,start,end,box=None):
+        self.name = name
+        self.words = words
+        self.word_list = word_list
+        self.start = start
+        self.end = end
+        self.box = box
+        self.errors = []
+        self.counters = {}
+        self.decode()
+
+    def error(self,word,text):
+        """Record the error text about the word at index word of the file"""
+        self.errors.append( "%s , byte %d : %s" % (self.name , 4 * word , text) )
+
+    def walk_packs(self):
+        """Index of the header of every pack"""
+        words = self.word_list
+        params = {}
+        headers = []
+        i = self.start
+        while (i < self.end) :
+            h = words[i]
+            n = params.get(h , -1)
+            if (n == -1) : n = params[h] = pack_params(h)
+            if (n == None) :
+                self.error(i , "unknown command in the pack 0x%08X" % (h & 0xFFFFFFFF))
+                break
+            headers.append(i)
+            i += 1 + n
+        if (i > self.end) : self.error(headers[-1] , "the last pack needs %d words more than the list has" % (i - self.end))
+        return ( headers )
+
+    def decode(self):
+        headers = array(self.walk_packs() , Int)
+        self.counters = { 'packs' : len(headers) , 'words' : self.end - self.start }
+        if (len(self.errors) > 0) : return
+        ops = reshape( transpose( array( [ (take(self.words , headers) >> shift) & 0xFF for shift in (0 , 8 , 16 , 24) ] ) ) , (-1 , 4) )
+        counts = take(params_table() , ops)
+        #parameters of each command : after the header and the parameters of the commands before it in the pack
+        offsets = headers[:,NewAxis] + 1 + add.accumulate(counts , 1) - counts
+        self.ops = ravel(ops)
+        self.positions = ravel(offsets)
+        self.check()
+
+    def count(self,cmd):
+        return ( int( add.reduce( equal(self.ops , cmd) ) ) )
+
+    def get_params(self,cmd,word=0):
+        """The parameter word of index word of every cmd command"""
+        return ( take(self.words , compress( equal(self.ops , cmd) , self.positions ) + word) )
+
+    def check(self):
+        ops = self.ops
+        commands = {}
+        for c , name in COMMAND_NAMES.items() :
+            commands[name] = self.count(c)
+        self.counters['commands'] = commands
+
+        #VERTEX_PACK(z,0) : the high half of the second word of VTX_16 is always 0
+        high = self.get_params(nds.FIFO_VERTEX16 , 1) >> 16
+        bad = nonzero(high)
+        if (len(bad) > 0) : self.error( int(compress( equal(ops , nds.FIFO_VERTEX16) , self.positions )[bad[0]]) , "%d VTX_16 with a z out of 16 bits" % (len(bad)) )
+
+        is_vertex = logical_and( greater_equal(ops , nds.FIFO_VERTEX16) , less_equal(ops , nds.FIFO_DIFF) )
+        begins = nonzero( equal(ops , nds.FIFO_BEGIN) )
+        types = self.get_params(nds.FIFO_BEGIN).tolist()
+        vertices = add.accumulate(is_vertex)
+        nb_vertices = 0
+        if (len(vertices) > 0) : nb_vertices = int(vertices[-1])
+        if (nb_vertices > 0 and (len(begins) == 0 or vertices[begins[0]] > 0)) :
+            self.error(self.start , "vertices before the first BEGIN")
+
+        #a primitive goes on until the next BEGIN : END does nothing on the DS
+        polygons = 0
+        ram = 0
+        primitives = [ 0 , 0 , 0 , 0 ]
+        ends = [ int(vertices[b]) for b in begins[1:] ] + [ nb_vertices ]
+        for k in range( len(begins) ) :
+            n = ends[k] - int(vertices[begins[k]])
+            if (types[k] < 0 or types[k] > 3) :
+                self.error(int(self.positions[begins[k]]) , "BEGIN of the unknown type %d" % (types[k]))
+                continue
+            p , v , incomplete = primitive_cost(types[k] , n)
+            if (incomplete) : self.error(int(self.positions[begins[k]]) , "%s with %d vertices : a polygon is not complete" % (PRIMITIVE_NAMES[types[k]] , n))
+            primitives[types[k]] += 1
+            polygons += p
+            ram += v
+        self.counters['primitives'] = dict( zip(PRIMITIVE_NAMES , primitives) )
+        self.counters['polygons'] = polygons
+        self.counters['vertices'] = nb_vertices
+        self.counters['vertex_ram'] = ram
+        if (self.box != None) : self.check_box(is_vertex)
+
+    def get_cycles(self,lights):
+        """Geometry engine cycles of the list, with lights lights enabled"""
+        cycles = 0
+        for c , name in COMMAND_NAMES.items() :
+            n = self.counters['commands'][name]
+            cycles += n * COMMAND_CYCLES[c]
+            if (c == nds.FIFO_NORMAL) : cycles += n * lights
+        return ( cycles )
+
+    def check_box(self,is_vertex):
+        """Decode the position of every vertex, in v16 units, and check it is inside the BOX_TEST box"""
+        words = self.word_list
+        low , high = box_bounds(self.box)
+        x0 , y0 , z0 = [ v - BOX_SLACK for v in low ]
+        x1 , y1 , z1 = [ v + BOX_SLACK for v in high ]
+        x = y = z = 0
+        outside = 0
+        first = None
+        for c , p in zip( compress(is_vertex , self.ops).tolist() , compress(is_vertex , self.positions).tolist() ) :
+            w = words[p]
+            if (c == nds.FIFO_VERTEX16) :
+                x , y , z = ((w & 0xFFFF) ^ 0x8000) - 0x8000 , w >> 16 , ((words[p + 1] & 0xFFFF) ^ 0x8000) - 0x8000
+            elif (c == nds.FIFO_VERTEX_XY) :
+                x , y = ((w & 0xFFFF) ^ 0x8000) - 0x8000 , w >> 16
+            elif (c == nds.FIFO_VERTEX_XZ) :
+                x , z = ((w & 0xFFFF) ^ 0x8000) - 0x8000 , w >> 16
+            elif (c == nds.FIFO_VERTEX_YZ) :
+                y , z = ((w & 0xFFFF) ^ 0x8000) - 0x8000 , w >> 16
+            else :
+                a , b , d = [ (((w >> s) & 0x3FF) ^ 0x200) - 0x200 for s in (0 , 10 , 20) ]
+                if (c == nds.FIFO_VERTEX10) : x , y , z = a << 6 , b << 6 , d << 6
+                else : x , y , z = x + a , y + b , z + d
+            if (not (x0 <= x <= x1 and y0 <= y <= y1 and z0 <= z <= z1)) :
+                if (first == None) : first = (p , (x , y , z))
+                outside += 1
+        if (outside > 0) :
+            self.error(first[0] , "%d vertices outside of the BOX_TEST box , the first one at %s : a coordinate out of the 4.12 range?" % (outside , repr(first[1])))
+
+    def get_polygons(self):
+        """Polygons drawn by the list, decoded by the GPU simulator of the exporter"""
+        words = self.word_list
+        simulator = nds._nds_gpu_simulator()
+        for c , p in zip(self.ops.tolist() , self.positions.tolist()) :
+            simulator.run( _nds_decoded_command(c , words[p:p + COMMAND_PARAMS[c]]) )
+        return ( simulator.polygons )
+
+
+def is_compressed(path,data) :
+    """True if data, read from the file path, is LZ compressed : a .lz file, or an LZ10/LZ11 header
+    where the first words are not those of a CallList or of an index"""
+    if (path.endswith(LZ_SUFFIX)) : return ( True )
+    if (len(data) < 8 or len(data) % 4 != 0 or ord(data[0]) not in (LZ10 , LZ11)) : return ( False )
+    n = len(data) / 4
+    count , = nds.unpack('<i' , data[:4])
+    if (count in (n - 1 , n - 1 - MATRIX_WORDS)) : return ( False )
+    if (n >= 5 and 1 + 4 * count <= n and nds.unpack('<i' , data[16:20])[0] == 4 + 16 * count) : return ( False )
+    return ( True )
+
+def read_words(path) :
+    """The little-endian 32 bits words of the file path, as a Numeric array, decompressed first when the file is"""
+    f = open(path , "rb")
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    if (is_compressed(path , data)) :
+        if (nds.nds_lz == None) : raise ValueError("%s : compressed, and nds_lz.py is not found next to nds_calllist.py" % (path))
+        try:
+            data = nds.nds_lz.decompress(data)
+        except ValueError , e :
+            raise ValueError("%s : %s" % (path , e))
+    if (len(data) % 4 != 0) : raise ValueError("%s : %d bytes , not a whole number of words" % (path , len(data)))
+    words = fromstring(data , Int32)
+    if (sys.byteorder == 'big') : words = words.byteswapped()
+    return ( words )
+
+def is_matrix(words) :
+    """True if words are the MTX_MULT_4x3 parameters of range fitting : the same positive scale on the diagonal"""
+    scale = words[0]
+    return ( scale > 0 and words[0:9] == [ scale , 0 , 0 , 0 , scale , 0 , 0 , 0 , scale ] )
+
+def is_table(words) :
+    """True if words are LOD distances (0 then increasing) or texture numbers (-1 without texture)"""
+    if (len(words) > 0 and words[0] == 0 and words == sorted(words)) : return ( True )
+    return ( min(words + [ 0 ]) >= -1 )
+
+def read_lists(path) :
+    """(lists , errors) of the file path : a single CallList, or the CallLists of an index"""
+    words = read_words(path)
+    n = len(words)
+    if (n == 0) : return ( ( [] , [ "%s : empty file" % (path) ] ) )
+    word_list = words.tolist()
+    count = word_list[0]
+    if (count == n - 1) : return ( ( [ _nds_calllist(path , words , word_list , 1 , n) ] , [] ) )
+    if (count == n - 1 - MATRIX_WORDS and count >= 0) :
+        if (is_matrix(word_list[n - MATRIX_WORDS:])) : return ( ( [ _nds_calllist(path , words , word_list , 1 , n - MATRIX_WORDS) ] , [] ) )
+        return ( ( [] , [ "%s : the %d words after the CallList are not the matrix of range fitting" % (path , MATRIX_WORDS) ] ) )
+
+    #an index : the number of lists, then the 3 BOX_TEST words and the byte offset of each one
+    nb_lists = count
+    if (nb_lists <= 0 or 1 + 4 * nb_lists > n) :
+        return ( ( [] , [ "%s : the parameter count %d does not match the %d words of the file" % (path , nb_lists , n - 1) ] ) )
+    lists = []
+    end = 1 + 4 * nb_lists
+    for k in range(nb_lists) :
+        box = word_list[1 + 4 * k:4 + 4 * k]
+        offset = word_list[4 + 4 * k]
+        #the CallLists follow the index, one after the other
+        if (offset != 4 * end or end >= n or end + 1 + word_list[end] > n or word_list[end] < 0) :
+            return ( ( lists , [ "%s : bad offset %d for the CallList %d of the index" % (path , offset , k) ] ) )
+        lists.append( _nds_calllist("%s[%d]" % (path , k) , words , word_list , end + 1 , end + 1 + word_list[end] , box) )
+        end += 1 + word_list[end]
+
+    rest = word_list[end:]
+    if (len(rest) >= MATRIX_WORDS and len(rest) in (MATRIX_WORDS , nb_lists + MATRIX_WORDS) and is_matrix(rest[-MATRIX_WORDS:])) : rest = rest[:-MATRIX_WORDS]
+    if (len(rest) == nb_lists and is_table(rest)) : rest = []
+    if (len(rest) > 0) :
+        return ( ( lists , [ "%s : %d words after the CallLists are neither a table of LOD distances or texture numbers nor the matrix of range fitting" % (path , len(rest)) ] ) )
+    return ( ( lists , [] ) )
+
+def check_budgets(counters,budgets) :
+    """Names of the budgets counters are over"""
+    over = []
+    for name , limit in budgets.items() :
+        if (limit != None and counters.get(name , 0) > limit) : over.append( "%s %d > %d" % (name , counters[name] , limit) )
+    return ( over )
+
+def check_file(path,lights,budgets,per_list=0,dump=0) :
+    """Decode and check the file path, return its results"""
+    t = time.time()
+    lists , errors = read_lists(path)
+    totals = { 'lists' : len(lists) , 'packs' : 0 , 'words' : 0 , 'polygons' : 0 , 'vertices' : 0 , 'vertex_ram' : 0 , 'cycles' : 0 }
+    results = []
+    over = []
+    for l in lists :
+        errors.extend(l.errors)
+        if (len(l.errors) > 0) : continue
+        counters = l.counters
+        counters['cycles'] = l.get_cycles(lights)
+        for name in totals.keys() :
+            if (name != 'lists') : totals[name] += counters[name]
+        counters['name'] = l.name
+        results.append(counters)
+        if (per_list) : over.extend([ "%s : %s" % (l.name , o) for o in check_budgets(counters , budgets) ])
+        if (dump) :
+            for polygon in l.get_polygons() :
+                print "%s : %s" % (l.name , repr(polygon))
+    if (not per_list) : over.extend([ "%s : %s" % (path , o) for o in check_budgets(totals , budgets) ])
+    return ( { 'file' : path , 'totals' : totals , 'lists' : results , 'errors' : errors , 'over_budget' : over , 'time' : time.time() - t } )
+
+USAGE = """usage : python nds_calllist.py [options] <file.bin> ...
+    --lights=N        lights enabled when the lists are drawn, for the cost of NORMAL (default : 1)
+    --max-polygons=N  polygons allowed (default : 2048, the size of the polygon RAM)
+    --max-vertices=N  vertex RAM entries allowed (default : 6144, the size of the vertex RAM)
+    --max-words=N     GXFIFO words allowed
+    --max-cycles=N    geometry engine cycles allowed
+    --per-list        apply the budgets to each CallList of an index (levels of detail, frames)
+                      instead of to the whole file
+    --json=FILE       write the results of every file
+    --dump            print the polygons of every list"""
+
+def main(args) :
+    try:
+        opts , files = getopt.getopt(args , "" , ['lights=' , 'max-polygons=' , 'max-vertices=' , 'max-words=' , 'max-cycles=' , 'per-list' , 'json=' , 'dump'])
+    except getopt.GetoptError , e :
+        print >> sys.stderr , e
+        print >> sys.stderr , USAGE
+        return ( 2 )
+    if (len(files) == 0) :
+        print >> sys.stderr , USAGE
+        return ( 2 )
+    opts = dict(opts)
+    budgets = {
+        'polygons' : int(opts.get('--max-polygons' , POLYGON_RAM)) ,
+        'vertex_ram' : int(opts.get('--max-vertices' , VERTEX_RAM)) ,
+        'words' : None ,
+        'cycles' : None
+    }
+    if (opts.has_key('--max-words')) : budgets['words'] = int(opts['--max-words'])
+    if (opts.has_key('--max-cycles')) : budgets['cycles'] = int(opts['--max-cycles'])
+
+    status = 0
+    results = []
+    for path in files :
+        try:
+            result = check_file(path , int(opts.get('--lights' , 1)) , budgets , opts.has_key('--per-list') , opts.has_key('--dump'))
+        except (IOError , ValueError) , e :
+            result = { 'file' : path , 'totals' : {} , 'lists' : [] , 'errors' : [ str(e) ] , 'over_budget' : [] , 'time' : 0.0 }
+        results.append(result)
+        t = result['totals']
+        if (len(t) > 0) :
+            print "%s : %d lists , %d words , %d polygons , %d vertices (%d in vertex RAM) , %d cycles , checked in %.3fs" % (path , t['lists'] , t['words'] , t['polygons'] , t['vertices'] , t['vertex_ram'] , t['cycles'] , result['time'])
+        for e in result['errors'] :
+            print "  error : %s" % (e)
+        for o in result['over_budget'] :
+            print "  over budget : %s" % (o)
+        if (len(result['errors']) > 0 or len(result['over_budget']) > 0) : status = 1
+
+    if (opts.has_key('--json')) :
+        f = open(opts['--json'] , "w")
+        try:
+            report = { 'lights' : int(opts.get('--lights' , 1)) , 'budgets' : budgets , 'files' : results }
+            if (json != None) : json.dump(report , f , indent=1)
+            else : f.write( nds.json_string(report) )
+        finally:
+            f.close()
+    return ( status )
+
+if __name__ == '__main__' :
+    sys.exit( main(sys.argv[1:]) )
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+#    Nintendo DS CallList Exporter for Blender - LZ77 compression
+#    Copyright (C) 2008, 2009 Kevin Roy <kiniou_AT_gmail_DOT_com>
+#
+#    Nintendo DS CallList Exporter for Blender is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""LZ77 compression of exported files, in the formats of the Nintendo DS BIOS.
+
+A compressed file starts with a 32 bits little-endian header : the type in the
+low byte (0x10 for LZ10, 0x11 for LZ11) and the decompressed size in the high
+24 bits (an LZ11 file of 16 MB or more has a 0 size there, followed by the
+size on 32 bits). Then each flag byte tells, from its highest bit, whether
+each of the next 8 blocks is a literal byte (0) or a copy of earlier bytes (1),
+12 bits of distance minus one and a length :
+
+    LZ10 : 2 bytes , length 3-18       LLLLDDDD DDDDDDDD      (L = length - 3)
+    LZ11 : 2 bytes , length 3-16       LLLLDDDD DDDDDDDD      (L = length - 1)
+           3 bytes , length 17-272     0000LLLL LLLLDDDD ...  (L = length - 17)
+           4 bytes , length 273-65808  0001LLLL LLLLLLLL LLLLDDDD ... (L = length - 273)
+
+The DS BIOS decompresses LZ10 with swiDecompressLZSSWram and
+swiDecompressLZSSVram ; LZ11 needs the decompressor of the game (the DSi BIOS
+has one). The copies never start at the previous byte, which the 16 bits writes
+of swiDecompressLZSSVram cannot read back, and the compressed data is padded
+to a multiple of 4 bytes. A compressed file is named after the raw one with
+the .lz suffix (ship.bin.lz), so that neither is taken for the other.
+
+Matches are found through hash chains : the positions of a block of the file
+are sorted by the hash of their first 3 bytes with Numeric, which links each
+one to the previous position with the same hash, then every block is searched
+from the nearest candidates.
+
+    python nds_lz.py compress [--lz11] ship.bin ship.tex
+    python nds_lz.py decompress ship.bin.lz
+    python nds_lz.py verify ship.bin.lz
+"""
+
+import os
+import sys
+import getopt
+from array import array as byte_array
+from struct import pack , unpack
+from Numeric import *
+
+LZ10 = 0x10
+LZ11 = 0x11
+LZ_WINDOW = 0x1000
+LZ_MIN_DISTANCE = 2
+# suffix added to the name of a compressed file
+LZ_SUFFIX = ".lz"
+
+# longest copy of each format
+LZ_MAX_LENGTH = { LZ10 : 18 , LZ11 : 65808 }
+
+# positions linked at once : a position and its block fit in 17 bits of the sort keys
+LZ_BLOCK = 0x10000
+
+def hash_chains(data,start,end) :
+    """(base , links) of the positions start..end of data : links[p - base] is the previous position
+    minus base with the same hash of the 3 bytes at p, -1 for none. base is start - LZ_WINDOW"""
+    base = max(start - LZ_WINDOW , 0)
+    b = fromstring(data[base:end + 2] , UnsignedInt8).astype(Int32)
+    nb = len(b) - 2
+    if (nb <= 0) : return ( ( base , [] ) )
+    h = (b[:nb] << 6) ^ (b[1:nb + 1] << 3) ^ b[2:nb + 2]
+    #sorted by hash, then by position : the previous key of the same hash is the previous position
+    keys = sort( (h << 17) | arange(nb) )
+    same = equal( keys[1:] >> 17 , keys[:-1] >> 17 )
+    links = zeros(nb , Int32) - 1
+    put( links , keys[1:] & 0x1FFFF , where( same , keys[:-1] & 0x1FFFF , -1 ) )
+    return ( ( base , links.tolist() ) )
+
+def match_length(data,i,j,limit) :
+    """Length of the common prefix of data[i:] and data[j:], at most limit"""
+    n = 0
+    step = 4
+    #galloping on slices : long copies cost a few string comparisons
+    while (step > 0) :
+        if (n + step <= limit and data[i + n:i + n + step] == data[j + n:j + n + step]) :
+            n += step
+            if (step < 4096) : step *= 2
+        else :
+            step /= 2
+    return ( n )
+
+def encode_copy(type,length,distance) :
+    d = distance - 1
+    if (type == LZ10) : return ( chr(((length - 3) << 4) | (d >> 8)) + chr(d & 0xFF) )
+    if (length <= 16) : return ( chr(((length - 1) << 4) | (d >> 8)) + chr(d & 0xFF) )
+    if (length <= 272) :
+        l = length - 17
+        return ( chr(l >> 4) + chr(((l & 0xF) << 4) | (d >> 8)) + chr(d & 0xFF) )
+    l = length - 273
+    return ( chr(0x10 | (l >> 12)) + chr((l >> 4) & 0xFF) + chr(((l & 0xF) << 4) | (d >> 8)) + chr(d & 0xFF) )
+
+def header_string(type,size) :
+    if (size < (1 << 24)) : return ( pack('<I' , type | (size << 8)) )
+    if (type == LZ10) : raise ValueError("%d bytes : LZ10 compresses less than 16 MB" % (size))
+    return ( pack('<II' , type , size) )
+
+def compress(data,type=LZ10,max_chain=8) :
+    """data compressed in the format type, looking at max_chain earlier positions for each copy"""
+    n = len(data)
+    out = [ header_string(type , n) ]
+    max_length = LZ_MAX_LENGTH[type]
+    flags = 0
+    blocks = []
+    append = blocks.append
+    nb_blocks = 0
+    block_end = 0
+    i = 0
+    while (i < n) :
+        if (i >= block_end) :
+            block_end = min(i + LZ_BLOCK , n)
+            base , links = hash_chains(data , i , block_end)
+            nb_links = len(links)
+        k = i - base
+        best = 2
+        distance = 0
+        #the last 2 bytes have no hash : they are literals
+        if (k < nb_links) : j = links[k]
+        else : j = -1
+        if (j >= 0 and k - j <= LZ_WINDOW) :
+            limit = n - i
+            if (limit > max_length) : limit = max_length
+            chain = max_chain
+            while (j >= 0 and k - j <= LZ_WINDOW and chain > 0) :
+                #quick check of the byte which would make the copy longer
+                if (k - j >= LZ_MIN_DISTANCE and data[base + j + best] == data[i + best]) :
+                    l = match_length(data , i , base + j , limit)
+                    if (l > best) :
+                        best = l
+                        distance = k - j
+                        if (l == limit) : break
+                j = links[j]
+                chain -= 1
+        flags <<= 1
+        if (distance > 0) :
+            flags |= 1
+            if (type == LZ10) : append( chr(((best - 3) << 4) | ((distance - 1) >> 8)) + chr((distance - 1) & 0xFF) )
+            else : append( encode_copy(type , best , distance) )
+            i += best
+        else :
+            append( data[i] )
+            i += 1
+        nb_blocks += 1
+        if (nb_blocks == 8) :
+            out.append( chr(flags) )
+            out.append( "".join(blocks) )
+            flags = 0
+            blocks = []
+            append = blocks.append
+            nb_blocks = 0
+    if (nb_blocks > 0) :
+        out.append( chr(flags << (8 - nb_blocks)) )
+        out.append( "".join(blocks) )
+    out = "".join(out)
+    return ( out + "\0" * (-len(out) % 4) )
+
+def get_header(data) :
+    """(type , decompressed size , offset of the first flag byte) of the compressed data"""
+    if (len(data) < 4) : raise ValueError("%d bytes : no LZ header" % (len(data)))
+    header , = unpack('<I' , data[:4])
+    type , size = header & 0xFF , header >> 8
+    if (type not in (LZ10 , LZ11)) : raise ValueError("unknown compression type 0x%02X" % (type))
+    if (type == LZ11 and size == 0 and len(data) >= 8) :
+        size , = unpack('<I' , data[4:8])
+        return ( ( type , size , 8 ) )
+    return ( ( type , size , 4 ) )
+
+def decompress(data) :
+    """Decompressed data, as the BIOS does it : ValueError when the data is not valid"""
+    type , size , pos = get_header(data)
+    src = byte_array('B' , data)
+    out = byte_array('B')
+    try:
+        while (len(out) < size) :
+            flags = src[pos]
+            pos += 1
+            for bit in (0x80 , 0x40 , 0x20 , 0x10 , 0x08 , 0x04 , 0x02 , 0x01) :
+                if (len(out) >= size) : break
+                if (not (flags & bit)) :
+                    out.append(src[pos])
+                    pos += 1
+                    continue
+                a = src[pos]
+                if (type == LZ10) :
+                    length = (a >> 4) + 3
+                    pos += 1
+                elif (a >> 4 > 1) :
+                    length = (a >> 4) + 1
+                    pos += 1
+                elif (a >> 4 == 0) :
+                    length = (((a & 0xF) << 4) | (src[pos + 1] >> 4)) + 17
+                    pos += 2
+                else :
+                    length = (((a & 0xF) << 12) | (src[pos + 1] << 4) | (src[pos + 2] >> 4)) + 273
+                    pos += 3
+                distance = (((src[pos - 1] & 0xF) << 8) | src[pos]) + 1
+                pos += 1
+                start = len(out) - distance
+                if (start < 0) : raise ValueError("byte %d : copy from %d bytes before the start" % (pos , -start))
+                if (len(out) + length > size) : raise ValueError("byte %d : copy past the %d bytes of the data" % (pos , size))
+                if (length <= distance) : out.extend( out[start:start + length] )
+                else :
+                    #the copy overlaps the bytes it writes : the pattern repeats
+                    for k in xrange(start , start + length) :
+                        out.append(out[k])
+    except IndexError :
+        raise ValueError("the compressed data ends before its %d bytes" % (size))
+    return ( out.tostring() )
+
+def verify(data,compressed) :
+    """Decompress compressed and compare it to data : ValueError when they differ"""
+    result = decompress(compressed)
+    if (result != data) :
+        i = 0
+        while (i < min(len(data) , len(result)) and data[i] == result[i]) : i += 1
+        raise ValueError("decompressed data differs from byte %d (%d bytes instead of %d)" % (i , len(result) , len(data)))
+
+def read_file(path) :
+    """The bytes of the file path"""
+    f = open(path , "rb")
+    try:
+        return ( f.read() )
+    finally:
+        f.close()
+
+def write_file(path,data) :
+    """Write the bytes data into the file path"""
+    f = open(path , "wb")
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+def compress_file(path,type=LZ10,check=1) :
+    """Compress the file path into path.lz, which replaces it, checking the round trip unless check is 0,
+    return (size , compressed size)"""
+    data = read_file(path)
+    compressed = compress(data , type)
+    if (check) : verify(data , compressed)
+    write_file(path + LZ_SUFFIX , compressed)
+    os.remove(path)
+    return ( ( len(data) , len(compressed) ) )
+
+def decompress_file(path) :
+    """Decompress the file path.lz into path, which replaces it (path is decompressed in place without
+    the suffix), return (type , compressed size , size)"""
+    data = read_file(path)
+    result = decompress(data)
+    if (path.endswith(LZ_SUFFIX)) :
+        write_file(path[:-len(LZ_SUFFIX)] , result)
+        os.remove(path)
+    else :
+        write_file(path , result)
+    return ( ( get_header(data)[0] , len(data) , len(result) ) )
+
+def main(args) :
+    try:
+        opts , args = getopt.gnu_getopt(args , "" , ['lz11'])
+    except getopt.GetoptError , e :
+        print e
+        print __doc__
+        return ( 1 )
+    if (len(args) < 2 or args[0] not in ('compress' , 'decompress' , 'verify')) :
+        print __doc__
+        return ( 1 )
+    type = LZ10
+    if (('--lz11' , '') in opts) : type = LZ11
+    status = 0
+    for path in args[1:] :
+        try:
+            if (args[0] == 'compress') :
+                size , compressed = compress_file(path , type)
+                print "%s%s : %d bytes -> %d bytes" % (path , LZ_SUFFIX , size , compressed)
+                continue
+            if (args[0] == 'decompress') :
+                print "%s : LZ%X , %d bytes -> %d bytes" % ((path ,) + decompress_file(path))
+                continue
+            data = read_file(path)
+            result = decompress(data)
+            print "%s : LZ%X , %d bytes -> %d bytes" % (path , get_header(data)[0] , len(data) , len(result))
+        except (IOError , ValueError) , e :
+            print "%s : %s" % (path , e)
+            status = 1
+    return ( status )
+
+if __name__ == '__main__' :
+    sys.exit( main(sys.argv[1:]) )
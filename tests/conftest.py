@@ -0,0 +1,17 @@
+#    Nintendo DS CallList Exporter for Blender - test setup
+#
+#    The exporter and its tools are Python 2 (Blender 2.4x) : run the tests with
+#        python2 -m pytest tests
+#    Numeric and Blender are taken from tests/shims when they are not installed.
+
+import sys
+import os
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+if (sys.version_info[0] >= 3) :
+    collect_ignore_glob = [ "test_*.py" ]
+else :
+    sys.path.insert(0 , os.path.dirname(HERE))
+    #after the installed modules : the shims only stand in for missing ones
+    sys.path.append(os.path.join(HERE , "shims"))
@@ -0,0 +1,118 @@
+"""Stand-ins for the Blender meshes, built from the synthetic meshes of nds_benchmark"""
+
+import os
+
+import nds_benchmark
+import nds_3d_export as nds
+
+
+class Vertex (object) :
+    __slots__ = 'co' , 'no' , 'index'
+
+    def __init__(self,co,no,index):
+        self.co = co
+        self.no = no
+        self.index = index
+
+class Image (object) :
+    __slots__ = 'name' , 'size' , 'filename' , 'packed'
+
+    def __init__(self,name,size=(64 , 32),filename=None):
+        self.name = name
+        self.size = size
+        self.filename = filename
+        self.packed = 0
+
+    def getFilename(self):
+        return ( self.filename )
+
+    def getName(self):
+        return ( self.name )
+
+    def getSize(self):
+        return ( self.size )
+
+class Face (object) :
+    __slots__ = 'v' , 'uv' , 'col' , 'mat' , 'image'
+
+    def __init__(self,v,uv,col,mat=0,image=None):
+        self.v = v
+        self.uv = uv
+        self.col = col
+        self.mat = mat
+        self.image = image
+
+    def __len__(self):
+        return ( len(self.v) )
+
+class Mesh (object) :
+    __slots__ = 'name' , 'faces' , 'verts' , 'faceUV' , 'vertexColors' , 'materials'
+
+    def __init__(self,name,faces,verts):
+        self.name = name
+        self.faces = faces
+        self.verts = verts
+        self.faceUV = 1
+        self.vertexColors = 1
+        self.materials = []
+
+class AnimatedObject (object) :
+    """Object whose mesh moves a vertex out of two by step along x at each frame"""
+
+    def __init__(self,mesh,step=0.05):
+        self.mesh = mesh
+        self.step = step
+
+    def verts_at(self,frame):
+        verts = []
+        for v in self.mesh.verts :
+            x , y , z = v.co
+            if (v.index % 2 == 0) : x += self.step * frame
+            verts.append( Vertex( (x , y , z) , v.no , v.index ) )
+        return ( verts )
+
+
+def make_mesh(kind,nb_faces,name=None) :
+    """Mesh of the nds_benchmark kind (grid, sphere or soup), its faces split between two materials and images"""
+    if (name == None) : name = "%s_%d" % (kind , nb_faces)
+    images = [ Image("a") , Image("b" , (32 , 32)) ]
+    index = {}
+    verts = []
+    faces = []
+    for f in nds_benchmark.MESHES[kind](nb_faces) :
+        face_verts = []
+        for v in f.v :
+            if (not index.has_key(id(v))) :
+                index[id(v)] = Vertex(v.co , v.no , len(verts))
+                verts.append(index[id(v)])
+            face_verts.append(index[id(v)])
+        k = len(faces) % 3
+        faces.append( Face(face_verts , f.uv , f.col , k % 2 , images[k / 2]) )
+    return ( Mesh(name , faces , verts) )
+
+def get_options(mesh,directory,**flags) :
+    """_mesh_options of mesh exported into directory, with 128x128 texture coordinates and the given attributes"""
+    options = nds._mesh_options(mesh , directory)
+    options.texture_w = options.texture_h = 128
+    for name , value in flags.items() :
+        setattr(options , name , value)
+    return ( options )
+
+def export(mesh,directory,**flags) :
+    """Export mesh into directory with the class the GUI chooses, return its options"""
+    options = get_options(mesh , directory , **flags)
+    if (options.anim_export) : mesh_class = nds._nds_mesh_animation
+    elif (options.lod_targets) : mesh_class = nds._nds_mesh_lods
+    elif (options.material_lists) : mesh_class = nds._nds_mesh_materials
+    elif (options.chunk_faces) : mesh_class = nds._nds_mesh_chunks
+    elif (options.stream_export) : mesh_class = nds._nds_mesh_stream
+    else : mesh_class = nds._nds_mesh
+    mesh_class(options).save()
+    return ( options )
+
+def read(path) :
+    f = open(path , "rb")
+    try:
+        return ( f.read() )
+    finally:
+        f.close()
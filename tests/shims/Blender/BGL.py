@@ -0,0 +1 @@
+"""Stand-in for Blender.BGL : the exporter only uses it in its GUI"""
@@ -0,0 +1,68 @@
+"""Stand-in for the Blender 2.4x module, with what the exporter uses outside of its GUI, for the tests.
+
+The frames of an animation are read from the object given to Mesh.getFromObject :
+its verts_at(frame) method returns the vertices of the mesh at that frame."""
+
+import os
+
+import BGL
+
+# not 'background' : importing the exporter must not start a batch export
+mode = 'interactive'
+
+class _namespace (object) :
+    """Module of Blender whose functions do nothing"""
+
+    def __getattr__(self,name):
+        return ( lambda *args , **kwargs : None )
+
+Texture = _namespace()
+Image = _namespace()
+Material = _namespace()
+Object = _namespace()
+Draw = _namespace()
+Scene = _namespace()
+UnpackModes = _namespace()
+Window = _namespace()
+
+class _sys (object) :
+    join = staticmethod(os.path.join)
+    dirname = staticmethod(os.path.dirname)
+    basename = staticmethod(os.path.basename)
+
+    def expandpath(self,path):
+        return ( path )
+
+    def makename(self,**kwargs):
+        return ( "" )
+
+sys = _sys()
+
+_state = { 'curframe' : 1 }
+
+def Get(name) :
+    return ( _state[name] )
+
+def Set(name,value) :
+    _state[name] = value
+
+class _frame_mesh (object) :
+    def __init__(self,name):
+        self.name = name
+        self.verts = []
+
+    def getFromObject(self,obj):
+        self.verts = obj.verts_at(_state['curframe'])
+
+class _mesh_module (object) :
+    def __init__(self):
+        self.meshes = {}
+
+    def New(self,name):
+        self.meshes[name] = _frame_mesh(name)
+        return ( self.meshes[name] )
+
+    def Get(self,name):
+        return ( self.meshes.get(name) )
+
+Mesh = _mesh_module()
@@ -0,0 +1,78 @@
+"""The part of Numeric used by the exporter, on top of numpy, for the tests"""
+
+import numpy as _np
+
+Float = Float64 = 'float64'
+Float32 = 'float32'
+#Numeric upcasts Int16 arrays combined with Python integers : keep the results exact
+Int16 = 'int64'
+Int = 'int64'
+Int32 = 'int32'
+Int8 = Int0 = 'int8'
+UInt8 = UnsignedInt8 = 'uint8'
+UInt16 = 'uint16'
+UInt32 = 'uint32'
+NewAxis = None
+pi = _np.pi
+
+def array(a , typecode=None , copy=1 , savespace=0) :
+    return ( _np.array(a , dtype=typecode) )
+
+def take(a , indices , axis=0) :
+    return ( _np.take(a , indices , axis=axis) )
+
+def nonzero(a) :
+    return ( _np.nonzero(_np.ravel(a))[0] )
+
+def put(a , indices , values) :
+    _np.put(a , indices , values)
+
+def fromstring(string , typecode) :
+    return ( _np.frombuffer(string , dtype=typecode).copy() )
+
+zeros = _np.zeros
+ones = _np.ones
+where = _np.where
+arange = arrayrange = _np.arange
+concatenate = _np.concatenate
+reshape = _np.reshape
+resize = _np.resize
+ravel = _np.ravel
+transpose = _np.transpose
+repeat = _np.repeat
+compress = _np.compress
+shape = _np.shape
+identity = _np.identity
+sort = _np.sort
+argsort = _np.argsort
+searchsorted = _np.searchsorted
+argmax = _np.argmax
+argmin = _np.argmin
+sum = _np.sum
+cumsum = _np.cumsum
+add = _np.add
+subtract = _np.subtract
+multiply = _np.multiply
+maximum = _np.maximum
+minimum = _np.minimum
+sqrt = _np.sqrt
+absolute = _np.absolute
+floor = _np.floor
+clip = _np.clip
+dot = matrixmultiply = _np.dot
+innerproduct = _np.inner
+less = _np.less
+less_equal = _np.less_equal
+greater = _np.greater
+greater_equal = _np.greater_equal
+equal = _np.equal
+not_equal = _np.not_equal
+logical_and = _np.logical_and
+logical_or = _np.logical_or
+logical_not = _np.logical_not
+bitwise_and = _np.bitwise_and
+bitwise_or = _np.bitwise_or
+left_shift = _np.left_shift
+right_shift = _np.right_shift
+alltrue = _np.all
+sometrue = _np.any
@@ -0,0 +1,69 @@
+import os
+
+import nds_archive
+
+
+def write_files(directory,files) :
+    paths = []
+    for name , data in files :
+        path = directory.join(name)
+        path.write(data , "wb")
+        paths.append( str(path) )
+    return ( paths )
+
+def test_write_and_read(tmpdir) :
+    files = [ ("ship.bin" , "\x10\0\0\0" * 9) , ("ship.tex" , "t" * 100) , ("ship.pal" , "p" * 32) , ("notes.txt" , "") , ("boat.tex.lz" , "\x10\x40\0\0z") ]
+    path = str(tmpdir.join("assets.nda"))
+    nds_archive.write_archive_files(path , write_files(tmpdir , files))
+    archive = nds_archive.open_archive(path)
+    try:
+        assert archive.names() == [ name for name , data in files ]
+        for name , data in files :
+            assert str(archive.get(name)) == data
+        for name , type , offset , size , h , flags in archive.entries :
+            assert offset % nds_archive.ARCHIVE_ALIGN == 0
+            assert type == nds_archive.file_type(name)
+            assert flags == nds_archive.file_flags(name)
+        #a compressed texture
+        name , type , offset , size , h , flags = archive.entries[-1]
+        assert (type , flags) == (nds_archive.ENTRY_TYPES['TEXTURE'] , nds_archive.ENTRY_COMPRESSED)
+        assert archive.find("missing.bin") == None
+    finally:
+        archive.close()
+    assert nds_archive.file_type("ship.bin") == nds_archive.ENTRY_TYPES['CALLLIST']
+    assert nds_archive.file_type("notes.txt") == nds_archive.ENTRY_TYPES['DATA']
+    assert nds_archive.file_type("ship.anim.lz") == nds_archive.ENTRY_TYPES['ANIMATION']
+    assert nds_archive.file_flags("ship.bin") == 0
+
+def test_append_and_extract(tmpdir) :
+    path = str(tmpdir.join("assets.nda"))
+    nds_archive.write_archive_files(path , write_files(tmpdir , [ ("a.bin" , "a" * 40) ]))
+    archive = nds_archive.open_archive(path , 1)
+    try:
+        #a name found again replaces its entry, the others are added
+        archive.append( [ ("a.bin" , "A" * 12) ] + [ ("b%d.tex" % i , chr(65 + i) * (i + 1)) for i in range(20) ] )
+    finally:
+        archive.close()
+
+    archive = nds_archive.open_archive(path)
+    try:
+        assert len(archive.names()) == 21
+        assert str(archive.get("a.bin")) == "A" * 12
+        assert str(archive.get("b19.tex")) == "T" * 20
+    finally:
+        archive.close()
+
+    out = tmpdir.mkdir("out")
+    assert nds_archive.main(["extract" , path , str(out)]) == 0
+    assert out.join("a.bin").read("rb") == "A" * 12
+    assert len(os.listdir(str(out))) == 21
+
+def test_add_creates_the_archive(tmpdir) :
+    path = str(tmpdir.join("new.nda"))
+    assert nds_archive.main(["add" , path] + write_files(tmpdir , [ ("x.anim" , "xyz") ])) == 0
+    archive = nds_archive.open_archive(path)
+    try:
+        assert archive.entries[0][:2] == ("x.anim" , nds_archive.ENTRY_TYPES['ANIMATION'])
+        assert str(archive.get("x.anim")) == "xyz"
+    finally:
+        archive.close()
@@ -0,0 +1,15 @@
+import nds_benchmark
+
+
+def test_run_case() :
+    result = nds_benchmark.run_case('sphere' , 100 , 'bin' , [ 'strips' ])
+    assert result['faces'] == 98
+    assert result['bytes'] == 4 + 4 * result['params']
+
+def test_compare_same_options_only(capsys) :
+    old = nds_benchmark.run_case('grid' , 100 , 'bin' , [])
+    new = nds_benchmark.run_case('grid' , 100 , 'bin' , [ 'strips' ])
+    nds_benchmark.compare([ new ] , { 'results' : [ old ] })
+    assert capsys.readouterr()[1] == ""
+    nds_benchmark.compare([ old ] , { 'results' : [ old ] })
+    assert "bytes x1.00" in capsys.readouterr()[1]
@@ -0,0 +1,447 @@
+import os
+import hashlib
+
+import pytest
+
+import Blender
+import nds_3d_export as nds
+import nds_calllist
+import nds_archive
+import meshes
+
+
+# SHA-1 of the files written by the first version of the exporter (nds_3d_export.py 0.2) for the
+# nds_benchmark meshes with the default options : the optimizations are off by default and must
+# not change them
+REFERENCE = {
+    'grid_100.bin'   : '5f2c4bce4d63a80838635c99c0122a56379cd4da' ,
+    'grid_100.h'     : 'c29b06af82535154c56e0cd75e9a9d8355e8bab6' ,
+    'sphere_200.bin' : '3c5eee81724ad4f508366dd100888f24fe76a303' ,
+    'sphere_200.h'   : '689276429cddead931b35a1469c645dec9818190' ,
+    'soup_60.bin'    : '7c1680babea4608da716c2b54372d6b415abbddd' ,
+    'soup_60.h'      : '93611a97fced5fc42331f5a7feef1985654021fe'
+}
+
+@pytest.mark.parametrize("name" , sorted(REFERENCE.keys()))
+def test_default_output_is_unchanged(tmpdir,name) :
+    base , extension = name.split('.')
+    kind , nb_faces = base.split('_')
+    format = { 'bin' : nds.EXPORT_OPTIONS['FORMAT_BINARY'] , 'h' : nds.EXPORT_OPTIONS['FORMAT_TEXT'] }[extension]
+    options = meshes.export(meshes.make_mesh(kind , int(nb_faces)) , str(tmpdir) , format=format)
+    assert hashlib.sha1( meshes.read(options.get_final_path_mesh()) ).hexdigest() == REFERENCE[name]
+
+def test_in_memory_output(tmpdir) :
+    #the CallList built in memory is the one streamed into the file
+    options = meshes.get_options(meshes.make_mesh('sphere' , 100) , str(tmpdir))
+    mesh = nds._nds_mesh(options)
+    mesh.save()
+    mesh.construct_cmdpack()
+    assert mesh.final_cmdpack == meshes.read(options.get_final_path_mesh())
+
+def words(path) :
+    """The 32 bits words of the binary file path"""
+    data = meshes.read(path)
+    return ( list( nds.unpack('<%dI' % (len(data) / 4) , data) ) )
+
+def export_words(mesh,directory,**flags) :
+    """Words of the binary CallList of mesh exported into directory"""
+    return ( words( meshes.export(mesh , directory , **flags).get_final_path_mesh() ) )
+
+def test_asm_words(tmpdir) :
+    #the .word directives of the GNU as file are the words of the binary file
+    mesh = meshes.make_mesh('sphere' , 100)
+    options = meshes.export(mesh , str(tmpdir) , format=nds.EXPORT_OPTIONS['FORMAT_ASM'])
+    asm = [ int(line.split('@')[0].split()[1] , 0) for line in open(options.get_final_path_mesh()) if line.strip().startswith('.word') ]
+    assert asm == export_words(mesh , str(tmpdir))
+
+
+E = nds.EXPORT_OPTIONS
+
+@pytest.mark.parametrize("kind" , [ 'grid' , 'sphere' ])
+def test_skip_repeats(tmpdir,kind) :
+    #the grid has one normal and one color, the sphere one color
+    mesh = meshes.make_mesh(kind , 150)
+    plain = export_words(mesh , str(tmpdir))
+    skipped = export_words(mesh , str(tmpdir) , state_elision=E['ELIDE_STATE'])
+    assert len(skipped) < len(plain)
+    #texture coordinates are still sent for every corner, the vertices too
+    assert len(skipped) > len(plain) / 2
+
+def test_strips(tmpdir) :
+    #a grid is made of strips : every quad after the first one sends 2 corners instead of 4
+    mesh = meshes.make_mesh('grid' , 100)
+    plain = export_words(mesh , str(tmpdir) , uv_export=0 , color_export=0 , normals_export=0)
+    strips = export_words(mesh , str(tmpdir) , uv_export=0 , color_export=0 , normals_export=0 , strip_export=E['STRIPS'])
+    assert len(strips) < 0.6 * len(plain)
+
+@pytest.mark.parametrize("kind" , [ 'grid' , 'sphere' ])
+def test_small_vertices(tmpdir,kind) :
+    mesh = meshes.make_mesh(kind , 150)
+    flags = { 'uv_export' : 0 , 'color_export' : 0 , 'normals_export' : 0 }
+    plain = export_words(mesh , str(tmpdir) , **flags)
+    exact = export_words(mesh , str(tmpdir) , vertex_packing=E['VERTEX_SMALLEST'] , **flags)
+    close = export_words(mesh , str(tmpdir) , vertex_packing=E['VERTEX_SMALLEST'] , vertex_tolerance=0.01 , **flags)
+    assert len(close) <= len(exact) < len(plain)
+
+def test_small_vertices_header(tmpdir) :
+    #the C output names the vertex commands as libnds does : on a small sphere, the vertices are sent as differences
+    mesh = meshes.make_mesh('sphere' , 150)
+    for v in mesh.verts :
+        v.co = tuple([ c * 0.05 for c in v.co ])
+    options = meshes.export(mesh , str(tmpdir) , format=E['FORMAT_TEXT'] , vertex_packing=E['VERTEX_SMALLEST'])
+    text = open(options.get_final_path_mesh()).read()
+    assert "FIFO_DIFF" in text
+    assert "FIFO_VERTEX_DIFF" not in text
+
+@pytest.mark.parametrize("jobs" , [ 1 , 2 ])
+def test_batch_export(tmpdir,jobs) :
+    #the worker processes write what the GUI export writes
+    mesh_list = [ meshes.make_mesh(kind , 100) for kind in ('grid' , 'sphere' , 'soup') ]
+    batch = tmpdir.mkdir("batch")
+    nds.DSexport_batch([ meshes.get_options(mesh , str(batch) , strip_export=E['STRIPS']) for mesh in mesh_list ] , jobs)
+    for mesh in mesh_list :
+        options = meshes.export(mesh , str(tmpdir) , strip_export=E['STRIPS'])
+        assert batch.join(mesh.name + ".bin").read("rb") == meshes.read(options.get_final_path_mesh())
+
+@pytest.mark.parametrize("jobs" , [ 1 , 2 ])
+def test_batch_textures(tmpdir,jobs) :
+    #the worker processes convert the textures the GUI export converts, a shared image once
+    PIL_Image = pytest.importorskip("PIL.Image")
+    path = str(tmpdir.join("texture.png"))
+    PIL_Image.new("RGB" , (64 , 32) , (200 , 100 , 50)).save(path)
+    image = meshes.Image("texture" , (64 , 32) , path)
+    mesh_list = [ meshes.make_mesh(kind , 100) for kind in ('grid' , 'sphere' , 'soup') ]
+    def get_options(mesh,directory) :
+        options = meshes.get_options(mesh , directory , texfile_export=1 , texture_format='GL_RGB16' , texture_data=[ image ])
+        options.texture_w , options.texture_h = image.size
+        return ( options )
+    batch = tmpdir.mkdir("batch")
+    nds.DSexport_batch([ get_options(mesh , str(batch)) for mesh in mesh_list ] , jobs)
+    for mesh in mesh_list :
+        options = get_options(mesh , str(tmpdir))
+        options.save_tex()
+        paths = options.get_final_paths_tex()
+        assert len(paths) > 0
+        for p in paths :
+            assert batch.join(os.path.basename(p)).read("rb") == meshes.read(p)
+
+def test_cache(tmpdir) :
+    mesh_list = [ meshes.make_mesh(kind , 100) for kind in ('grid' , 'sphere') ]
+    out = tmpdir.mkdir("out")
+    def run(**flags) :
+        cache = nds._nds_export_cache(str(tmpdir.join("cache")))
+        nds.DSexport_batch([ meshes.get_options(mesh , str(out) , **flags) for mesh in mesh_list ] , 1 , cache)
+        return ( [ line.split()[0] for line in out.join("nds_export_manifest.txt").readlines() ] )
+    assert run() == [ "rebuilt" ] * 2
+    assert run() == [ "unchanged" ] * 2
+    #a file removed from the output is copied back from the cache
+    out.join("grid_100.bin").remove()
+    assert sorted(run()) == [ "cached" , "unchanged" ]
+    #other options are other files
+    assert run(strip_export=E['STRIPS']) == [ "rebuilt" ] * 2
+    assert run() == [ "cached" ] * 2
+
+def test_cache_encoder(tmpdir,monkeypatch) :
+    #the files cached by another version of the encoder are built again
+    mesh_list = [ meshes.make_mesh(kind , 100) for kind in ('grid' , 'sphere') ]
+    out = tmpdir.mkdir("out")
+    def run() :
+        cache = nds._nds_export_cache(str(tmpdir.join("cache")))
+        nds.DSexport_batch([ meshes.get_options(mesh , str(out)) for mesh in mesh_list ] , 1 , cache)
+        return ( [ line.split()[0] for line in out.join("nds_export_manifest.txt").readlines() ] )
+    assert run() == [ "rebuilt" ] * 2
+    #the key covers the source of the script, not only its version
+    assert nds.get_encoder_key() != hashlib.md5(nds.__version__).hexdigest()
+    monkeypatch.setattr(nds , 'get_encoder_key' , lambda : "edited encoder")
+    assert run() == [ "rebuilt" ] * 2
+
+# bits per texel and palette colors of the DS texture formats
+TEXTURE_SIZES = {
+    'GL_RGB32_A3'   : (8 , 32) ,
+    'GL_RGB4'       : (2 , 4) ,
+    'GL_RGB16'      : (4 , 16) ,
+    'GL_RGB256'     : (8 , 256) ,
+    'GL_COMPRESSED' : (2 , None) ,
+    'GL_RGB8_A5'    : (8 , 8) ,
+    'GL_RGBA'       : (16 , 0)
+}
+
+@pytest.mark.parametrize("format" , sorted(TEXTURE_SIZES.keys()))
+def test_texture_formats(format) :
+    PIL_Image = pytest.importorskip("PIL.Image")
+    #a gradient with a transparent corner
+    image = PIL_Image.new("RGBA" , (16 , 8))
+    image.putdata([ (x * 16 , y * 32 , 128 , 0 if (x < 4 and y < 4) else 255) for y in range(8) for x in range(16) ])
+    texture = nds._nds_texture(image , format)
+    bits , nb_colors = TEXTURE_SIZES[format]
+    assert len(texture.texels) == 16 * 8 * bits / 8
+    if (nb_colors != None) : assert len(texture.palette) <= 2 * nb_colors
+    if (format in ('GL_RGB4' , 'GL_RGB16' , 'GL_RGB256')) :
+        #the transparent texels use the color 0
+        assert texture.color0_transparent
+        assert ord(texture.texels[0]) == 0
+    if (format == 'GL_COMPRESSED') :
+        #one 16 bits palette index for every 4x4 block
+        assert len(texture.palette_index) == 2 * (16 / 4) * (8 / 4)
+
+@pytest.mark.parametrize("kind" , [ 'grid' , 'sphere' , 'soup' ])
+@pytest.mark.parametrize("chunk_size" , [ 16 , 4096 ])
+def test_stream(tmpdir,kind,chunk_size) :
+    #the faces streamed chunk_size at a time give the CallList of the whole mesh
+    mesh = meshes.make_mesh(kind , 150)
+    flags = { 'state_elision' : E['ELIDE_STATE'] , 'vertex_packing' : E['VERTEX_SMALLEST'] }
+    if (chunk_size > 150) : flags['strip_export'] = E['STRIPS']
+    options = meshes.get_options(mesh , str(tmpdir.mkdir("stream")) , stream_export=E['STREAM'] , **flags)
+    nds._nds_mesh_stream(options , chunk_size).save()
+    assert words(options.get_final_path_mesh()) == export_words(mesh , str(tmpdir) , **flags)
+
+@pytest.mark.parametrize("kind" , [ 'grid' , 'sphere' ])
+def test_schedule(tmpdir,kind) :
+    #the END and repeated BEGIN commands of the strips are left out
+    mesh = meshes.make_mesh(kind , 150)
+    flags = { 'strip_export' : E['STRIPS'] , 'state_elision' : E['ELIDE_STATE'] }
+    scheduled = export_words(mesh , str(tmpdir) , pack_schedule=E['SCHEDULE'] , **flags)
+    assert scheduled[0] == len(scheduled) - 1
+    assert len(scheduled) < len(export_words(mesh , str(tmpdir) , **flags))
+
+def index_lists(w) :
+    """(count , start , end) of every CallList of the index w, and the word after the last one"""
+    lists = []
+    end = 1 + 4 * w[0]
+    for k in range(w[0]) :
+        #each CallList follows the previous one
+        assert w[4 + 4 * k] == 4 * end
+        lists.append( (w[end] , end + 1 , end + 1 + w[end]) )
+        end += 1 + w[end]
+    return ( ( lists , end ) )
+
+@pytest.mark.parametrize("kind" , [ 'grid' , 'sphere' , 'soup' ])
+def test_chunks(tmpdir,kind) :
+    mesh = meshes.make_mesh(kind , 150)
+    w = export_words(mesh , str(tmpdir) , chunk_faces=40)
+    assert w[0] == (len(mesh.faces) + 39) / 40
+    lists , end = index_lists(w)
+    assert end == len(w)
+    #the BOX_TEST sizes : below 8.0, and flat boxes for the flat grid
+    for k in range(w[0]) :
+        sizes = ( w[2 + 4 * k] >> 16 , w[3 + 4 * k] & 0xFFFF , w[3 + 4 * k] >> 16 )
+        assert 0 < max(sizes) <= 0x7FFF
+        if (kind == 'grid') : assert sizes[2] == 0
+
+@pytest.mark.parametrize("kind" , [ 'grid' , 'sphere' , 'soup' ])
+def test_fit_range(tmpdir,kind) :
+    mesh = meshes.make_mesh(kind , 150)
+    w = export_words(mesh , str(tmpdir) , range_fit=E['FIT_RANGE'])
+    #the CallList, then the MTX_MULT_4x3 matrix : a uniform scale and the offset
+    assert w[0] == len(w) - 13
+    scale = w[-12]
+    assert 0 < scale and w[-12:-3] == [ scale , 0 , 0 , 0 , scale , 0 , 0 , 0 , scale ]
+    #the grid spans [-3.5,3.5], the sphere [-3.0,3.0] : scaled up to [-8.0,8.0[
+    half = { 'grid' : 3.5 , 'sphere' : 3.0 , 'soup' : None }[kind]
+    if (half != None) : assert abs(scale - half / 8.0 * 4096) <= 2
+    assert len(w) - 12 == len(export_words(mesh , str(tmpdir)))
+
+def test_animation_frames(tmpdir) :
+    mesh = meshes.make_mesh('sphere' , 100)
+    flags = { 'anim_start' : 1 , 'anim_end' : 4 , 'mesh_object' : meshes.AnimatedObject(mesh) }
+    #one CallList per frame : the commands of the mesh, with the positions of the frame
+    w = export_words(mesh , str(tmpdir) , anim_export=E['ANIM_LISTS'] , **flags)
+    lists , end = index_lists(w)
+    assert end == len(w)
+    assert [ count for count , start , stop in lists ] == [ len(export_words(mesh , str(tmpdir))) - 1 ] * 4
+    assert w[lists[1][1]:lists[1][2]] != w[lists[0][1]:lists[0][2]]
+
+    #the first frame, and the deltas of the others
+    options = meshes.export(mesh , str(tmpdir) , anim_export=E['ANIM_DELTAS'] , **flags)
+    nb_frames , nb_vertices = nds.unpack('<2i' , meshes.read(options.get_final_path_anim())[:8])
+    assert (nb_frames , nb_vertices) == (4 , len(mesh.verts))
+
+@pytest.mark.parametrize("kind" , [ 'grid' , 'sphere' ])
+def test_lods(tmpdir,kind) :
+    mesh = meshes.make_mesh(kind , 500)
+    w = export_words(mesh , str(tmpdir) , lod_targets="200,50")
+    lists , end = index_lists(w)
+    #the mesh itself, then the levels, and one switch distance per level
+    assert len(lists) == 3
+    assert end + 3 == len(w)
+    distances = nds.unpack('<3f' , nds.pack('<3I' , *w[end:]))
+    assert list(distances) == sorted(distances)
+    assert w[lists[0][1]:lists[0][2]] == export_words(mesh , str(tmpdir))[1:]
+    assert lists[0][2] - lists[0][1] > lists[1][2] - lists[1][1] > lists[2][2] - lists[2][1]
+
+@pytest.mark.parametrize("format" , [ 'FORMAT_HEX' , 'FORMAT_HEX_COMMENTS' ])
+def test_hex_words(tmpdir,format) :
+    #the hex literals of the C file are the words of the binary file
+    mesh = meshes.make_mesh('sphere' , 100)
+    options = meshes.export(mesh , str(tmpdir) , format=E[format] , strip_export=1)
+    text = open(options.get_final_path_mesh()).read()
+    literals = text[text.index('{') + 1:text.index('}')].split('\n')
+    hexa = [ int(word , 0) for line in literals for word in line.split('/*')[0].split(',') if word.strip() ]
+    assert hexa == export_words(mesh , str(tmpdir) , strip_export=1)
+
+@pytest.mark.parametrize("kind" , [ 'grid' , 'sphere' ])
+def test_bake_lights(tmpdir,kind) :
+    #the lit colors take the place of the normals : the commands are the ones of an export without normals
+    mesh = meshes.make_mesh(kind , 150)
+    baked = export_words(mesh , str(tmpdir) , light_bake=E['BAKE_LIGHTS'])
+    unlit = export_words(mesh , str(tmpdir) , normals_export=0)
+    assert len(baked) == len(unlit)
+    assert baked != unlit
+
+def test_bake_diffuse(tmpdir) :
+    #each face is lit with the diffuse color of its own material : red for the material 0, blue for the 1
+    mesh = meshes.make_mesh('sphere' , 150)
+    options = meshes.get_options(mesh , str(tmpdir) , light_bake=E['BAKE_LIGHTS'] , color_export=0 , bake_diffuse=[ (1.0 , 0.0 , 0.0) , (0.0 , 0.0 , 1.0) ])
+    nds_mesh = nds._nds_mesh(options)
+    for size , face_list in ((4 , nds_mesh.quads) , (3 , nds_mesh.triangles)) :
+        materials = [ f.mat for f in mesh.faces if len(f) == size ]
+        colors = face_list.colors.tolist()
+        for i in range( len(colors) ) :
+            r , g , b = colors[i]
+            if (materials[i / size] == 0) : assert r > 0 and g == b == 0
+            else : assert b > 0 and r == g == 0
+
+@pytest.mark.parametrize("kind" , [ 'grid' , 'sphere' , 'soup' ])
+def test_reorder_faces(tmpdir,kind) :
+    #the faces are only reordered when it skips more attribute commands
+    mesh = meshes.make_mesh(kind , 150)
+    elision = export_words(mesh , str(tmpdir) , state_elision=E['ELIDE_STATE'])
+    reordered = export_words(mesh , str(tmpdir) , state_elision=E['ELIDE_STATE'] , face_reorder=E['REORDER_FACES'])
+    assert len(reordered) <= len(elision)
+    #on the sphere, the chained faces skip more commands than the original order
+    if (kind == 'sphere') : assert len(reordered) < len(elision)
+
+def test_material_lists(tmpdir) :
+    #faces of the material 0 and image a, 1 and a, 0 and b : one CallList each, then their texture numbers
+    mesh = meshes.make_mesh('sphere' , 150)
+    w = export_words(mesh , str(tmpdir) , material_lists=E['MATERIAL_LISTS'])
+    lists , end = index_lists(w)
+    assert len(lists) == 3
+    assert end + 3 == len(w)
+    textures = nds.unpack('<3i' , nds.pack('<3I' , *w[end:]))
+    #every texture is bound once
+    assert sorted(textures) == [ 0 , 0 , 1 ]
+    assert textures[0] == textures[1] or textures[1] == textures[2]
+
+# exporter options -> the CallLists they write, each one decoded and checked by nds_calllist
+CASES = {
+    'default'        : {} ,
+    'no-attributes'  : { 'uv_export' : 0 , 'color_export' : 0 , 'normals_export' : 0 } ,
+    'skip-repeats'   : { 'state_elision' : E['ELIDE_STATE'] } ,
+    'strips'         : { 'strip_export' : E['STRIPS'] } ,
+    'small-vertices' : { 'vertex_packing' : E['VERTEX_SMALLEST'] , 'vertex_tolerance' : 0.01 } ,
+    'schedule'       : { 'pack_schedule' : E['SCHEDULE'] , 'strip_export' : E['STRIPS'] , 'state_elision' : E['ELIDE_STATE'] } ,
+    'stream'         : { 'stream_export' : E['STREAM'] , 'strip_export' : E['STRIPS'] } ,
+    'chunks'         : { 'chunk_faces' : 40 , 'vertex_packing' : E['VERTEX_SMALLEST'] } ,
+    'reorder'        : { 'face_reorder' : E['REORDER_FACES'] , 'state_elision' : E['ELIDE_STATE'] } ,
+    'bake-lights'    : { 'light_bake' : E['BAKE_LIGHTS'] } ,
+    'materials'      : { 'material_lists' : E['MATERIAL_LISTS'] , 'strip_export' : E['STRIPS'] } ,
+    'all'            : { 'state_elision' : E['ELIDE_STATE'] , 'strip_export' : E['STRIPS'] , 'vertex_packing' : E['VERTEX_SMALLEST'] , 'pack_schedule' : E['SCHEDULE'] , 'face_reorder' : E['REORDER_FACES'] }
+}
+
+def check(path) :
+    budgets = { 'polygons' : None , 'vertex_ram' : None , 'words' : None , 'cycles' : None }
+    result = nds_calllist.check_file(path , 1 , budgets)
+    assert result['errors'] == []
+    return ( result )
+
+@pytest.mark.parametrize("kind" , [ 'grid' , 'sphere' , 'soup' ])
+@pytest.mark.parametrize("case" , sorted(CASES.keys()))
+def test_decode(tmpdir,kind,case) :
+    mesh = meshes.make_mesh(kind , 150)
+    options = meshes.export(mesh , str(tmpdir) , **CASES[case])
+    result = check( options.get_final_path_mesh() )
+    #quads stay quads : every face is one polygon
+    assert result['totals']['polygons'] == len(mesh.faces)
+
+def test_animation_lists(tmpdir) :
+    mesh = meshes.make_mesh('sphere' , 100)
+    options = meshes.export(mesh , str(tmpdir) , anim_export=E['ANIM_LISTS'] , anim_start=1 , anim_end=4 , mesh_object=meshes.AnimatedObject(mesh))
+    result = check( options.get_final_path_mesh() )
+    assert result['totals']['lists'] == 4
+    assert [ l['polygons'] for l in result['lists'] ] == [ len(mesh.faces) ] * 4
+
+def test_animation_deltas(tmpdir) :
+    mesh = meshes.make_mesh('grid' , 64)
+    options = meshes.export(mesh , str(tmpdir) , anim_export=E['ANIM_DELTAS'] , anim_start=1 , anim_end=3 , mesh_object=meshes.AnimatedObject(mesh))
+    result = check( options.get_final_path_mesh() )
+    assert result['totals']['polygons'] == len(mesh.faces)
+    nb_frames , nb_vertices = nds.unpack('<2i' , meshes.read(options.get_final_path_anim())[:8])
+    assert (nb_frames , nb_vertices) == (3 , len(mesh.verts))
+
+def test_animation_frame_mesh(tmpdir) :
+    #the frames of every export are read into the same scratch mesh
+    mesh = meshes.make_mesh('grid' , 16)
+    for anim_export in ('ANIM_LISTS' , 'ANIM_DELTAS' , 'ANIM_LISTS') :
+        meshes.export(mesh , str(tmpdir) , anim_export=E[anim_export] , anim_start=1 , anim_end=2 , mesh_object=meshes.AnimatedObject(mesh))
+    assert Blender.Mesh.meshes.keys() == [ nds.ANIM_FRAME_MESH ]
+
+F = { 'range_fit' : E['FIT_RANGE'] }
+ANIMATION = { 'anim_start' : 1 , 'anim_end' : 3 }
+
+# every layout of the binary file : the CallLists read back, then what follows them
+LAYOUTS = {
+    'plain'          : ({} , 1) ,
+    'plain-fit'      : (F , 1) ,
+    'stream-fit'     : (dict(F , stream_export=E['STREAM']) , 1) ,
+    'chunks'         : ({ 'chunk_faces' : 40 } , 4) ,
+    'chunks-fit'     : (dict(F , chunk_faces=40) , 4) ,
+    'lods'           : ({ 'lod_targets' : "100,50" } , 3) ,
+    'lods-fit'       : (dict(F , lod_targets="100,50") , 3) ,
+    'materials'      : ({ 'material_lists' : E['MATERIAL_LISTS'] } , 3) ,
+    'materials-fit'  : (dict(F , material_lists=E['MATERIAL_LISTS']) , 3) ,
+    'anim-lists'     : (dict(ANIMATION , anim_export=E['ANIM_LISTS']) , 3) ,
+    'anim-lists-fit' : (dict(F , anim_export=E['ANIM_LISTS'] , **ANIMATION) , 3) ,
+    'anim-deltas-fit': (dict(F , anim_export=E['ANIM_DELTAS'] , **ANIMATION) , 1)
+}
+
+@pytest.mark.parametrize("layout" , sorted(LAYOUTS.keys()))
+def test_layouts(tmpdir,layout) :
+    flags , nb_lists = LAYOUTS[layout]
+    mesh = meshes.make_mesh('sphere' , 150)
+    if (flags.has_key('anim_export')) : flags = dict(flags , mesh_object=meshes.AnimatedObject(mesh))
+    options = meshes.export(mesh , str(tmpdir) , **flags)
+    result = check( options.get_final_path_mesh() )
+    assert result['totals']['lists'] == nb_lists
+
+def test_layout_errors(tmpdir) :
+    mesh = meshes.make_mesh('grid' , 16)
+    path = meshes.export(mesh , str(tmpdir) , range_fit=E['FIT_RANGE']).get_final_path_mesh()
+    words = nds.unpack('<%di' % (len(meshes.read(path)) / 4) , meshes.read(path))
+    #a matrix without its scale, and words left after the CallList
+    for bad in ( words[:-12] + (0 , ) * 12 , words + (0 , ) ) :
+        open(path , "wb").write( nds.pack('<%di' % len(bad) , *bad) )
+        lists , errors = nds_calllist.read_lists(path)
+        assert lists == [] and len(errors) == 1
+
+@pytest.mark.parametrize("lz" , [ 'LZ_10' , 'LZ_11' ])
+def test_compressed_files(tmpdir,lz) :
+    mesh = meshes.make_mesh('sphere' , 100)
+    flags = dict(ANIMATION , anim_export=E['ANIM_DELTAS'] , mesh_object=meshes.AnimatedObject(mesh))
+    raw = meshes.export(mesh , str(tmpdir.mkdir("raw")) , **flags)
+    options = meshes.export(mesh , str(tmpdir) , lz_compression=E[lz] , **flags)
+    #the compressed files replace the raw ones, under the .lz suffix
+    paths = options.get_final_paths()
+    assert [ os.path.basename(p) for p in paths ] == [ "sphere_100.bin.lz" , "sphere_100.anim.lz" ]
+    assert sorted(os.listdir(str(tmpdir))) == [ "raw" ] + sorted([ os.path.basename(p) for p in paths ])
+    for path , raw_path in zip(paths , raw.get_final_paths()) :
+        assert nds.nds_lz.decompress(meshes.read(path)) == meshes.read(raw_path)
+    assert check(paths[0])['totals']['polygons'] == len(mesh.faces)
+
+    #the archive keeps the type of the raw files, and flags them as compressed
+    archive_path = str(tmpdir.join("assets.nda"))
+    nds_archive.write_archive_files(archive_path , paths)
+    archive = nds_archive.open_archive(archive_path)
+    try:
+        types = [ (type , flags) for name , type , offset , size , h , flags in archive.entries ]
+    finally:
+        archive.close()
+    assert types == [ (nds_archive.ENTRY_TYPES['CALLLIST'] , nds_archive.ENTRY_COMPRESSED) , (nds_archive.ENTRY_TYPES['ANIMATION'] , nds_archive.ENTRY_COMPRESSED) ]
+
+def test_compressed_file_without_suffix(tmpdir) :
+    options = meshes.export(meshes.make_mesh('grid' , 64) , str(tmpdir) , chunk_faces=20)
+    path = options.get_final_path_mesh()
+    data = meshes.read(path)
+    #an LZ header instead of the layout of a CallList : decompressed first
+    open(path , "wb").write( nds.nds_lz.compress(data) )
+    assert check(path)['totals']['lists'] == 4
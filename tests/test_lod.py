@@ -0,0 +1,49 @@
+import pytest
+
+import nds_3d_export as nds
+import nds_calllist
+import meshes
+
+
+def decimator(kind,nb_faces) :
+    options = meshes.get_options(meshes.make_mesh(kind , nb_faces) , ".")
+    return ( nds._nds_decimator( nds._nds_mesh_snapshot(options) ) )
+
+def test_flat_grid() :
+    #every collapse of a flat grid costs nothing : they must not pile up on one vertex
+    d = decimator('grid' , 4000)
+    nb_edges = len(d.heap)
+    d.decimate(1000)
+    assert 990 <= d.nb_faces <= 1000
+    assert d.get_error() == 0.0
+    assert max([ len(f) for f in d.vertex_faces if f != None ]) <= nds.LOD_MAX_VALENCE
+    #only the edges whose cost changed are pushed again
+    assert len(d.heap) < nb_edges
+
+def test_error_target() :
+    d = decimator('sphere' , 2000)
+    d.decimate(0 , 0.05)
+    assert 0.0 < d.get_error() <= 0.05
+    assert d.nb_faces < 2000
+
+def test_vertices_stay_in_the_mesh_box() :
+    d = decimator('soup' , 500)
+    low , high = d.low[:] , d.high[:]
+    d.decimate(50)
+    for v in range( len(d.positions) ) :
+        if (d.vertex_faces[v] != None) :
+            assert [ low[k] <= d.positions[v][k] <= high[k] for k in range(3) ] == [ True ] * 3
+
+@pytest.mark.parametrize("kind , targets , polygons" , [
+    ('soup' , "1000" , [ 500 , 500 ]) ,
+    ('soup' , "e0.01,600,200,50" , [ 500 , 500 , 500 , 200 , 50 ]) ,
+    ('sphere' , "e0.05,200,e1" , [ 450 , 450 , 199 , 90 ]) ,
+    ('grid' , "100" , [ 484 , 99 ])
+])
+def test_levels(tmpdir,kind,targets,polygons) :
+    #the levels of a random soup have vertices at the borders of the 4.12 range : their BOX_TEST boxes are checked
+    flags = { 'lod_targets' : targets , 'vertex_packing' : nds.EXPORT_OPTIONS['VERTEX_SMALLEST'] , 'vertex_tolerance' : 0.01 }
+    options = meshes.export(meshes.make_mesh(kind , 500) , str(tmpdir) , **flags)
+    result = nds_calllist.check_file(options.get_final_path_mesh() , 1 , { 'polygons' : None })
+    assert result['errors'] == []
+    assert [ l['polygons'] for l in result['lists'] ] == polygons
@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+import nds_lz
+
+
+def samples() :
+    rnd = random.Random(7)
+    noise = "".join([ chr(rnd.randrange(256)) for i in range(5000) ])
+    words = "".join([ rnd.choice(["vertex " , "normal " , "texcoord " , "color "]) for i in range(3000) ])
+    return ( [
+        "" ,
+        "a" ,
+        "ab" ,
+        "aaaa" ,
+        "abc" * 7 ,
+        "\0" * 70000 ,
+        noise ,
+        words ,
+        #copies crossing the block of the hash chains
+        (noise[:3000] + words[:2000]) * 30
+    ] )
+
+@pytest.mark.parametrize("type" , [ nds_lz.LZ10 , nds_lz.LZ11 ])
+def test_round_trip(type) :
+    for data in samples() :
+        compressed = nds_lz.compress(data , type)
+        assert len(compressed) % 4 == 0
+        assert nds_lz.get_header(compressed)[:2] == (type , len(data))
+        assert nds_lz.decompress(compressed) == data
+        nds_lz.verify(data , compressed)
+
+def test_repeated_data_is_smaller() :
+    data = "".join([ chr(i % 50) for i in range(100000) ])
+    assert len(nds_lz.compress(data , nds_lz.LZ10)) < len(data) / 7
+    #LZ11 copies up to 65808 bytes at once
+    assert len(nds_lz.compress(data , nds_lz.LZ11)) < len(nds_lz.compress(data , nds_lz.LZ10)) / 4
+
+def copy_distances(compressed) :
+    """Distance of every copy of LZ10 data"""
+    type , size , pos = nds_lz.get_header(compressed)
+    distances = []
+    n = 0
+    while (n < size) :
+        flags = ord(compressed[pos])
+        pos += 1
+        for bit in range(7 , -1 , -1) :
+            if (n >= size) : break
+            if (flags & (1 << bit)) :
+                a , b = ord(compressed[pos]) , ord(compressed[pos + 1])
+                distances.append( (((a & 0xF) << 8) | b) + 1 )
+                n += (a >> 4) + 3
+                pos += 2
+            else :
+                n += 1
+                pos += 1
+    return ( distances )
+
+def test_no_copy_from_the_previous_byte() :
+    #swiDecompressLZSSVram writes 16 bits at once : it cannot read back the byte just written
+    distances = copy_distances( nds_lz.compress("z" * 1000 , nds_lz.LZ10) )
+    assert len(distances) > 0
+    assert min(distances) >= nds_lz.LZ_MIN_DISTANCE
+
+def test_bad_data() :
+    compressed = nds_lz.compress("hello hello hello hello" * 20 , nds_lz.LZ10)
+    with pytest.raises(ValueError) :
+        nds_lz.decompress(compressed[:len(compressed) / 2])
+    with pytest.raises(ValueError) :
+        nds_lz.decompress("\x20\0\0\0")
+    with pytest.raises(ValueError) :
+        nds_lz.verify("other data" , compressed)
+
+def test_compress_file(tmpdir) :
+    path = tmpdir.join("ship.bin")
+    data = "\x01\x02\x03\x04" * 1000
+    path.write(data , "wb")
+    size , compressed = nds_lz.compress_file(str(path) , nds_lz.LZ11)
+    #the compressed file replaces the raw one, under another name
+    lz_path = tmpdir.join("ship.bin.lz")
+    assert not path.check()
+    assert (size , compressed) == (len(data) , len(lz_path.read("rb")))
+    assert nds_lz.decompress(lz_path.read("rb")) == data
+    assert nds_lz.main(["verify" , str(lz_path)]) == 0
+    assert nds_lz.main(["decompress" , str(lz_path)]) == 0
+    assert not lz_path.check()
+    assert path.read("rb") == data
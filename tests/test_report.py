@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+import nds_3d_export as nds
+import nds_calllist
+import meshes
+
+
+@pytest.mark.parametrize("json_module" , [ json , None ])
+def test_report(tmpdir,monkeypatch,json_module) :
+    #without the json module (Python < 2.6), json_string writes the report
+    monkeypatch.setattr(nds , 'json' , json_module)
+    options = meshes.export(meshes.make_mesh('grid' , 100) , str(tmpdir) , export_report=nds.EXPORT_OPTIONS['REPORT'] , strip_export=nds.EXPORT_OPTIONS['STRIPS'])
+    report = json.loads( meshes.read(options.get_final_path_report()) )
+    assert report['mesh'] == 'grid_100'
+    assert report['counters']['quads'] == 100
+    assert report['counters']['mesh_bytes'] == len( meshes.read(options.get_final_path_mesh()) )
+    assert sorted(report['times'].keys()) == [ 'cmdpack' , 'encode' , 'faces' , 'write' ]
+
+@pytest.mark.parametrize("json_module" , [ json , None ])
+def test_checker_json(tmpdir,monkeypatch,json_module) :
+    monkeypatch.setattr(nds_calllist , 'json' , json_module)
+    options = meshes.export(meshes.make_mesh('sphere' , 100) , str(tmpdir))
+    path = str(tmpdir.join("budget.json"))
+    assert nds_calllist.main([ "--json=%s" % (path) , options.get_final_path_mesh() ]) == 0
+    results = json.loads( meshes.read(path) )
+    assert results['budgets']['cycles'] == None
+    assert results['files'][0]['totals']['polygons'] == 98